@@ -0,0 +1,12 @@
+# backend_path.py
+# The local server shares the pure-python helpers in final_backend_code (caches,
+# migrations, routing, etc.) with the lambdas. Importing this module makes them
+# importable from software.py, hardware.py, main.py and the benchmarks, whichever
+# of them is imported first.
+import os
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'final_backend_code')
+
+if BACKEND_DIR not in sys.path:
+    sys.path.append(BACKEND_DIR)
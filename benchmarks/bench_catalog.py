@@ -0,0 +1,81 @@
+# benchmarks/bench_catalog.py
+#
+# Size, cold-start and lookup cost of the memory-mapped product catalog
+# (final_backend_code/catalog.py), next to unpickling the same catalog as a
+# dict, the obvious alternative for a Lambda cold start.
+#
+#   python benchmarks/bench_catalog.py [products ...]
+import os
+import sys
+import time
+import pickle
+import random
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import backend_path  # noqa: F401
+
+from catalog import Catalog, build_catalog
+
+CATEGORIES = ["Dairies", "Beverages", "Snacks", "Frozen foods", "Condiments", "Fruits", "Vegetables", "Meats"]
+
+def make_records(count, seed=0):
+    rng = random.Random(seed)
+    barcodes = rng.sample(range(10 ** 12, 10 ** 13), count)
+    return [(f"{barcode:013d}", f"Product {barcode} {rng.choice(['Original', 'Light', 'Family size'])}", rng.choice(CATEGORIES))
+            for barcode in barcodes]
+
+def best_of(fn, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def per_lookup(lookup, barcodes):
+    def run():
+        for barcode in barcodes:
+            lookup(barcode)
+    return best_of(run) / len(barcodes)
+
+def main(sizes):
+    print(f"{'products':>10} {'build s':>8} {'file MB':>8} {'pickle MB':>9} {'open ms':>8} {'unpickle ms':>11} {'hit us':>7} {'miss us':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in sizes:
+            records = make_records(count)
+            path = os.path.join(tmp, "catalog.bin")
+            pickle_path = os.path.join(tmp, "catalog.pickle")
+
+            start = time.perf_counter()
+            build_catalog(records, path)
+            build = time.perf_counter() - start
+
+            with open(pickle_path, "wb") as f:
+                pickle.dump({barcode: (name, category) for barcode, name, category in records}, f)
+
+            def open_catalog():
+                Catalog(path).close()
+
+            def unpickle():
+                with open(pickle_path, "rb") as f:
+                    pickle.load(f)
+
+            opened = best_of(open_catalog)
+            unpickled = best_of(unpickle, repeat=2)
+
+            catalog = Catalog(path)
+            sample = random.Random(1).sample(records, 10000)
+            for barcode, name, category in sample[:100]:
+                assert catalog.lookup(barcode) == (name, category)
+            hit = per_lookup(catalog.lookup, [barcode for barcode, _, _ in sample])
+            miss = per_lookup(catalog.lookup, [f"{barcode:013d}" for barcode in range(10 ** 11, 10 ** 11 + 10000)])
+            catalog.close()
+
+            print(f"{count:>10} {build:>8.2f} {os.path.getsize(path) / 2 ** 20:>8.1f} {os.path.getsize(pickle_path) / 2 ** 20:>9.1f} "
+                  f"{opened * 1000:>8.3f} {unpickled * 1000:>11.1f} {hit * 1e6:>7.2f} {miss * 1e6:>8.2f}")
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [100000, 1000000, 3000000])
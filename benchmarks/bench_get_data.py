@@ -0,0 +1,75 @@
+# benchmarks/bench_get_data.py
+#
+# Cost of software.get_data per 1k items, before (two scans + strptime/strftime
+# per row) and after (one indexed scan + cached date formatting).
+#
+#   python benchmarks/bench_get_data.py [items ...]
+import os
+import sys
+import time
+import uuid
+import random
+import sqlite3
+import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import backend_path  # noqa: F401
+
+import software
+from migrations import run_migrations
+
+def legacy_get_data(fridge_id, db_cursor):
+    db_cursor.execute("SELECT uuid, expiration_date, name FROM item_info WHERE fridge_id = ? AND name IS NOT NULL", (fridge_id,))
+    labeled_items = [{"uuid": row[0], "expiration_date": datetime.datetime.strptime(row[1], "%Y-%m-%d").strftime("%m/%d/%Y"), "name": row[2]} for row in db_cursor.fetchall()]
+
+    db_cursor.execute("SELECT uuid, expiration_date, barcode, image_url FROM item_info WHERE fridge_id = ? AND name IS NULL", (fridge_id,))
+    unlabeled_items = [{"uuid": row[0], "expiration_date": datetime.datetime.strptime(row[1], "%Y-%m-%d").strftime("%m/%d/%Y"), "barcode": row[2], "image_url": row[3]} for row in db_cursor.fetchall()]
+
+    return {"success": True, "labeled_items": labeled_items, "unlabeled_items": unlabeled_items}
+
+def setup(item_count):
+    conn = sqlite3.connect(':memory:')
+    run_migrations(conn, "sqlite")
+    cursor = conn.cursor()
+
+    today = datetime.date.today()
+    rows = []
+    # Several fridges so the per-fridge filter actually has to use the index
+    for fridge in range(4):
+        for _ in range(item_count):
+            barcode = str(random.randrange(200))
+            rows.append((str(uuid.uuid4()), f"fridge{fridge}", today + datetime.timedelta(days=random.randrange(60)),
+                         barcode, f"https://example.com/{barcode}.jpg", None if random.random() < 0.3 else f"Item {barcode}"))
+    cursor.executemany("INSERT INTO item_info (uuid, fridge_id, expiration_date, barcode, image_url, name) VALUES (?, ?, ?, ?, ?, ?)", rows)
+    cursor.execute("INSERT INTO user_map (user_id, fridge_id) VALUES ('user0', 'fridge0')")
+    conn.commit()
+    return conn, cursor
+
+def best_of(fn, repeat=20):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main(sizes):
+    print(f"{'items':>8} {'before us/1k':>14} {'after us/1k':>14} {'speedup':>8}")
+    for item_count in sizes:
+        conn, cursor = setup(item_count)
+        expected, actual = legacy_get_data('fridge0', cursor), software.get_data({"user_id": "user0"}, conn, cursor)
+        for key in ("labeled_items", "unlabeled_items"):
+            # "full_image_url" and "suggestions" are newer than the legacy response
+            items = [{field: value for field, value in item.items() if field not in ("full_image_url", "suggestions")} for item in actual[key]]
+            assert sorted(expected[key], key=lambda item: item["uuid"]) == sorted(items, key=lambda item: item["uuid"])
+
+        before = best_of(lambda: legacy_get_data('fridge0', cursor))
+        after = best_of(lambda: software.get_data({"user_id": "user0"}, conn, cursor))
+        scale = 1e6 * 1000 / item_count
+        print(f"{item_count:>8} {before * scale:>14.1f} {after * scale:>14.1f} {before / after:>7.2f}x")
+        conn.close()
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 50000])
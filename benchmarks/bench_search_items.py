@@ -0,0 +1,76 @@
+# benchmarks/bench_search_items.py
+#
+# Latency of software.search_items (FTS5 prefix match, ranked) against the
+# LIKE '%word%' scan it replaces, on fridges with many items.
+#
+#   python benchmarks/bench_search_items.py [items ...]
+import os
+import sys
+import time
+import uuid
+import random
+import sqlite3
+import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import backend_path  # noqa: F401
+
+import software
+from migrations import run_migrations
+
+WORDS = ["milk", "cheese", "cheddar", "yogurt", "butter", "cream", "whole", "skim", "organic", "greek",
+         "apple", "orange", "juice", "chicken", "breast", "ham", "salami", "lettuce", "tomato", "pesto"]
+QUERIES = ["milk", "chees", "greek yog", "organic whole milk", "zucchini"]
+
+def like_search(db_cursor, fridge_id, query, limit=20):
+    conditions = " AND ".join(["name LIKE ?"] * len(query.split()))
+    db_cursor.execute(f"SELECT uuid, expiration_date, name FROM item_info WHERE fridge_id = ? AND {conditions} ORDER BY name LIMIT ?",
+                      [fridge_id] + [f"%{word}%" for word in query.split()] + [limit])
+    return db_cursor.fetchall()
+
+def setup(item_count):
+    conn = sqlite3.connect(':memory:')
+    run_migrations(conn, "sqlite")
+    cursor = conn.cursor()
+
+    rng = random.Random(0)
+    today = datetime.date.today()
+    rows = []
+    # Several fridges so the per-fridge filter has to do its part
+    for fridge in range(4):
+        for _ in range(item_count):
+            name = " ".join(rng.sample(WORDS, rng.randrange(1, 4))).capitalize()
+            rows.append((str(uuid.uuid4()), f"fridge{fridge}", today + datetime.timedelta(days=rng.randrange(60)), None, None, name))
+    cursor.executemany("INSERT INTO item_info (uuid, fridge_id, expiration_date, barcode, image_url, name) VALUES (?, ?, ?, ?, ?, ?)", rows)
+    cursor.execute("INSERT INTO user_map (user_id, fridge_id) VALUES ('user0', 'fridge0')")
+    conn.commit()
+    return conn, cursor
+
+def best_of(fn, repeat=20):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main(sizes):
+    print(f"{'items':>8} {'query':>20} {'like ms':>9} {'fts ms':>8} {'hits':>5}")
+    for item_count in sizes:
+        conn, cursor = setup(item_count)
+        for query in QUERIES:
+            result = software.search_items({"user_id": "user0", "query": query}, conn, cursor)
+            assert result["success"]
+            for item in result["items"]:
+                words = item["name"].lower().split()
+                assert all(any(word.startswith(term) for word in words) for term in query.split())
+
+            like = best_of(lambda: like_search(cursor, "fridge0", query))
+            fts = best_of(lambda: software.search_items({"user_id": "user0", "query": query}, conn, cursor))
+            print(f"{item_count:>8} {query:>20} {like * 1000:>9.2f} {fts * 1000:>8.2f} {len(result['items']):>5}")
+        conn.close()
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [10000, 100000])
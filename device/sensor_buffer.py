@@ -0,0 +1,188 @@
+# Device-side write-behind buffer for fridge sensor samples.
+#
+# Instead of one add_env_data/add_door_data request per sample, readings are
+# buffered and posted to the hardware API's add_sensor_data in one request,
+# which the backend writes in a single transaction. A flush happens when
+# max_batch samples are waiting or the oldest one has waited flush_interval
+# seconds, so the fridge's latest values reach get_env_data/get_door_data at
+# most flush_interval seconds late; door changes can be flushed immediately.
+#
+#     buffer = SensorBuffer("fridge1", post_json(HARDWARE_API + "/add_sensor_data"))
+#     (or post_frame(...) to send packed binary frames on constrained uplinks)
+#     buffer.start()
+#     buffer.add_env(temperature, humidity)
+#     buffer.add_door(value)
+
+import json
+import time
+import logging
+import threading
+import urllib.request
+
+logger = logging.getLogger(__name__)
+
+def post_json(url, timeout=10):
+    """
+    send(payload) for SensorBuffer that POSTs JSON to url with the standard library
+    """
+    def send(payload):
+        request = urllib.request.Request(url, data=json.dumps(payload).encode(),
+                                         headers={"Content-Type": "application/json"}, method="POST")
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read() or b"{}")
+    return send
+
+def post_frame(url, timeout=10):
+    """
+    send(payload) for SensorBuffer that POSTs the batch as packed binary frames
+    (sensor_frame.py), about a tenth of the bytes of the JSON body
+    """
+    from sensor_frame import CONTENT_TYPE, encode_frame, split_samples
+
+    def send(payload):
+        readings = [(r["timestamp"], r["temperature"], r["humidity"]) for r in payload.get("readings", [])]
+        events = [(e["timestamp"], e["value"]) for e in payload.get("events", [])]
+        for group_readings, group_events in split_samples(readings, events):
+            request = urllib.request.Request(url, data=encode_frame(payload["fridge_id"], group_readings, group_events),
+                                             headers={"Content-Type": CONTENT_TYPE}, method="POST")
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                response.read()
+    return send
+
+class SensorBuffer:
+    """
+    Collects samples for one fridge and sends them in batches through send(payload).
+    A failed send keeps the samples for the next flush; when more than max_buffered
+    are waiting (a long outage) the oldest are dropped.
+    """
+
+    def __init__(self, fridge_id, send, flush_interval=30.0, max_batch=100, max_buffered=5000,
+                 flush_on_door_change=True, clock=time.time):
+        self.fridge_id = fridge_id
+        self.send = send
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_buffered = max_buffered
+        self.flush_on_door_change = flush_on_door_change
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        # Held for a whole flush, so a failed batch is put back before the next
+        # one is taken and samples are always sent in order
+        self._send_lock = threading.Lock()
+        self._readings = []
+        self._events = []
+        self._oldest = None
+        self._last_door = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.dropped = 0
+
+    def add_env(self, temperature, humidity, timestamp=None):
+        with self._lock:
+            self._readings.append({"timestamp": int(timestamp or self.clock()), "temperature": temperature, "humidity": humidity})
+            self._added()
+        self.maybe_flush()
+
+    def add_door(self, value, timestamp=None):
+        with self._lock:
+            self._events.append({"timestamp": int(timestamp or self.clock()), "value": value})
+            changed = self._last_door is not None and bool(value) != bool(self._last_door)
+            self._last_door = value
+            self._added()
+        if changed and self.flush_on_door_change:
+            self.flush()
+        else:
+            self.maybe_flush()
+
+    def _added(self):
+        if self._oldest is None:
+            self._oldest = self.clock()
+
+        overflow = len(self._readings) + len(self._events) - self.max_buffered
+        if overflow > 0:
+            # Drop the oldest samples, readings first: door events feed the open-time totals
+            dropped = min(overflow, len(self._readings))
+            del self._readings[:dropped]
+            del self._events[:overflow - dropped]
+            self.dropped += overflow
+
+    def pending(self):
+        with self._lock:
+            return len(self._readings) + len(self._events)
+
+    def maybe_flush(self):
+        """
+        Flush if the batch is full or the oldest sample is due; call this from
+        the device's main loop when not using start()
+        """
+        with self._lock:
+            count = len(self._readings) + len(self._events)
+            due = count >= self.max_batch or (self._oldest is not None and self.clock() - self._oldest >= self.flush_interval)
+        if due:
+            self.flush()
+
+    def flush(self):
+        """
+        Send up to max_batch samples; returns False if the send failed. Concurrent
+        calls (the background thread and a door change) take turns.
+        """
+        with self._send_lock:
+            with self._lock:
+                if not self._readings and not self._events:
+                    return True
+                # Door events go first; they are few and drive the open-time aggregates
+                events = self._events[:self.max_batch]
+                readings = self._readings[:self.max_batch - len(events)]
+                del self._events[:len(events)]
+                del self._readings[:len(readings)]
+                self._oldest = self.clock() if self._readings or self._events else None
+
+            payload = {"fridge_id": self.fridge_id}
+            if readings:
+                payload["readings"] = readings
+            if events:
+                payload["events"] = events
+
+            # Samples keep being added while the send is in flight; only _send_lock is held
+            try:
+                self.send(payload)
+            except Exception as e:
+                logger.warning(f"Sensor flush failed, keeping {len(readings) + len(events)} samples: {e}")
+                with self._lock:
+                    self._readings[:0] = readings
+                    self._events[:0] = events
+                    if self._oldest is None:
+                        self._oldest = self.clock()
+                    self.failed_flushes += 1
+                return False
+
+            with self._lock:
+                self.flushes += 1
+            return True
+
+    def start(self, poll_interval=1.0):
+        """
+        Flush from a background thread instead of the caller's loop
+        """
+        def run():
+            while not self._stopped.wait(poll_interval):
+                self.maybe_flush()
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=run, name="sensor-buffer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the background thread and send whatever is left
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        while self.pending() and self.flush():
+            pass
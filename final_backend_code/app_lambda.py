@@ -1,10 +1,20 @@
-import sys
 import logging
 import pymysql
-import json
 import uuid
 import datetime
+import functools
+import time
 import os
+from pymysql.constants import CLIENT
+from db import ConnectionManager
+from router import Router
+from inventory import get_cursor, get_version, make_etag, read_changes, record_changes, record_changes_if_ok, bump_labels_version_if_ok, run_batch
+from ttl_cache import TTLCache
+from thumbnails import read_thumbnailed, thumbnail_url
+from label_suggestions import add_suggestions, count_label_if_ok
+from item_search import SEARCH_LIMIT, MAX_SEARCH_LIMIT, boolean_query, like_patterns, search_terms
+from telemetry import RESOLUTIONS, pick_resolution, query_env_history
+from door_events import SECONDS_PER_DAY, query_door_stats
 
 # rds settings
 user_name = os.environ['USER_NAME']
@@ -15,42 +25,67 @@ db_name = os.environ['DB_NAME']
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# create the database connection outside of the handler to allow connections to be
-# re-used by subsequent function invocations.
-try:
-    conn = pymysql.connect(host=rds_proxy_host, user=user_name, passwd=password, db=db_name, connect_timeout=5)
-except pymysql.MySQLError as e:
-    logger.error("ERROR: Unexpected error: Could not connect to MySQL instance.")
-    logger.error(e)
-    sys.exit(1)
-
-logger.info("SUCCESS: Connection to RDS for MySQL instance succeeded")
-
-def get_user_mapping(data):
+# the database connection lives outside of the handler so it can be re-used by
+# subsequent function invocations; it is opened on first use and re-opened if the
+# proxy has dropped it.
+db = ConnectionManager(host=rds_proxy_host, user=user_name, password=password, db=db_name, connect_timeout=5)
+
+# The relabel handlers send their writes as one multi-statement batch that passes
+# the compare-and-set outcome along in @ok (ROW_COUNT() counting matched rather
+# than changed rows, hence FOUND_ROWS). Multi-statement text and user variables
+# make RDS Proxy pin the client's session to one database connection for as long
+# as it stays open, so the batch gets a connection of its own: each warm container
+# that has relabeled pins one proxy connection, while every other handler keeps
+# using the shared, multiplexed one above. Going through db instead would pin that
+# too; giving up the batch would cost the relabel five or more round trips.
+relabel_db = ConnectionManager(host=rds_proxy_host, user=user_name, password=password, db=db_name, connect_timeout=5,
+                               client_flag=CLIENT.MULTI_STATEMENTS | CLIENT.FOUND_ROWS)
+
+# user_id -> fridge_id mappings are kept across invocations of a warm container
+fridge_cache = TTLCache(maxsize=int(os.environ.get('FRIDGE_CACHE_SIZE', 1024)),
+                        ttl=float(os.environ.get('FRIDGE_CACHE_TTL', 300)))
+
+router = Router()
+
+@router.fridge_resolver
+def lookup_fridge_id(user_id):
     """
-    {
-        "user_id": "user1"
-    }
+    Return the fridge_id mapped to user_id, or None if the user has no fridge.
+    Only existing mappings are cached since a missing one can be added at any time.
     """
-    # Extract user_id from the request
-    user_id = data.get('user_id')
-
-    fridge_id = None
-
-    with conn.cursor() as cur:
-        # Check if user_id exists in user_map table
-        cur.execute("SELECT fridge_id FROM user_map WHERE user_id = %s", (user_id,))
-        fridge_id_row = cur.fetchone()
+    fridge_id = fridge_cache.get(user_id)
+    if fridge_id is None:
+        conn = db.connection()
+        with conn.cursor() as cur:
+            cur.execute("SELECT fridge_id FROM user_map WHERE user_id = %s", (user_id,))
+            fridge_id_row = cur.fetchone()
 
         if fridge_id_row is None:
-            return {"success": False, "message": "User does not have a fridge associated"}, 200
+            return None
 
         fridge_id = fridge_id_row[0]
-        
-        conn.commit()
+        fridge_cache.set(user_id, fridge_id)
 
-    return {"success": True, "user_id": user_id, "fridge_id": fridge_id}, 200
+    return fridge_id
+
+@router.errorhandler(pymysql.OperationalError, pymysql.InterfaceError)
+def database_unavailable(e):
+    # The connection is unusable; drop it so the next invocation reconnects
+    logger.error(e)
+    db.reset()
+    relabel_db.reset()
+    return {"message": "Database unavailable"}, 500
 
+@router.route("get_user_mapping", fridge=True)
+def get_user_mapping(data, fridge_id):
+    """
+    {
+        "user_id": "user1"
+    }
+    """
+    return {"success": True, "user_id": data.get('user_id'), "fridge_id": fridge_id}, 200
+
+@router.route("add_user_mapping", schema={"user_id": str, "fridge_id": str})
 def add_user_mapping(data):
     """
     {   
@@ -62,6 +97,7 @@ def add_user_mapping(data):
     user_id = data.get('user_id')
     fridge_id = data.get('fridge_id')
 
+    conn = db.connection()
     with conn.cursor() as cur:
         # Check if the mapping already exists
         cur.execute("SELECT * FROM user_map WHERE user_id = %s", (user_id,))
@@ -75,42 +111,239 @@ def add_user_mapping(data):
         
         conn.commit()
 
+    fridge_cache.invalidate(user_id)
+
     return {"success": True, "user_id": user_id, "fridge_id": fridge_id}, 200
 
-def get_data(data):
+NO_IMAGE_URL = "https://fridgemate-images.s3.us-east-2.amazonaws.com/No_Image.png"
+
+# door_daily days are counted from 1970-01-01
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+@functools.lru_cache(maxsize=4096)
+def format_date(value):
+    """
+    date -> "MM/DD/YYYY". A fridge holds few distinct dates, so the cache turns
+    most rows into a dictionary hit instead of a strftime call.
+    """
+    return value.strftime("%m/%d/%Y")
+
+def serialize_items(cur, rows, full_images=False):
+    """
+    Split (uuid, expiration_date, name, barcode, image_url) rows into the
+    labeled and unlabeled item lists returned by get_data. "image_url" is the
+    thumbnail, where one is stored, unless full_images is set; "full_image_url"
+    is always the original.
+    """
+    thumbnailed = set() if full_images else read_thumbnailed(cur, [row[4] for row in rows])
+
+    labeled_items, unlabeled_items = [], []
+    for item_uuid, expiration_date, name, barcode, image_url in rows:
+        if name is not None:
+            # Items added from the phone carry the placeholder image, which the app shows as "Error"
+            if image_url is None or image_url == NO_IMAGE_URL:
+                image_url = "Error"
+            labeled_items.append({"uuid": item_uuid, "expiration_date": format_date(expiration_date), "name": name,
+                                  "image_url": thumbnail_url(image_url, thumbnailed), "full_image_url": image_url})
+        else:
+            unlabeled_items.append({"uuid": item_uuid, "expiration_date": format_date(expiration_date), "barcode": barcode,
+                                    "image_url": thumbnail_url(image_url, thumbnailed), "full_image_url": image_url})
+
+    return labeled_items, unlabeled_items
+
+@router.route("get_data", fridge=True)
+def get_data(data, fridge_id):
     """
+    Pass the "etag" of a previous response to get {"not_modified": true} back without
+    the item lists when the fridge's inventory has not changed since. Item images
+    are thumbnails once rendered; send "full_images": true to get the originals in "image_url".
+    Unlabeled items carry "suggestions", the names other fridges most often gave their barcode.
     {
-        "user_id": "user1"
+        "user_id": "user1",
+        "etag": "\"fridge1:42\""
     }
     """
-    # Extract user_id from the request
-    user_id = data.get('user_id')
-    fridge_id = None
     labeled_items, unlabeled_items = [], []
     
+    conn = db.connection()
     with conn.cursor() as cur:
-        # Check if user_id exists in user_map table
-        cur.execute("SELECT fridge_id FROM user_map WHERE user_id = %s", (user_id,))
-        fridge_id_row = cur.fetchone()
+        # The version is read first so the items below are at least as new as the etag
+        etag = make_etag(fridge_id, get_version(cur, fridge_id))
 
-        if fridge_id_row is None:
-            return {"success": False, "message": "User does not have a fridge associated"}, 200
-            
-        fridge_id = fridge_id_row[0]
+        if data.get('etag') == etag:
+            conn.commit()
+            return {"success": True, "not_modified": True, "etag": etag}, 200
+
+        # Starting point for get_changes, read before the items for the same reason
+        cursor = get_cursor(cur, fridge_id)
 
-        # Fetch labeled items
-        cur.execute("SELECT uuid, expiration_date, name, image_url FROM item_info WHERE fridge_id = %s AND name IS NOT NULL", (fridge_id,))
-        labeled_items = [{"uuid": row[0], "expiration_date": row[1].strftime("%m/%d/%Y"), "name": row[2], "image_url": row[3] if "No_Image" not in row[3] else "Error"} for row in cur.fetchall()]
+        # Fetch every item of the fridge in one pass and split it in Python
+        cur.execute("SELECT uuid, expiration_date, name, barcode, image_url FROM item_info WHERE fridge_id = %s", (fridge_id,))
+        labeled_items, unlabeled_items = serialize_items(cur, cur.fetchall(), data.get('full_images', False))
 
-        # Fetch unlabeled items with barcode
-        cur.execute("SELECT uuid, expiration_date, barcode, image_url FROM item_info WHERE fridge_id = %s AND name IS NULL", (fridge_id,))
-        unlabeled_items = [{"uuid": row[0], "expiration_date": row[1].strftime("%m/%d/%Y"), "barcode": row[2], "image_url": row[3]} for row in cur.fetchall()]
+        # Names other fridges gave the unlabeled barcodes
+        add_suggestions(cur, unlabeled_items)
         
         conn.commit()
 
-    return {"success": True, "labeled_items": labeled_items, "unlabeled_items": unlabeled_items}, 200
+    return {"success": True, "etag": etag, "cursor": cursor, "labeled_items": labeled_items, "unlabeled_items": unlabeled_items}, 200
 
-def update_unlabeled_data(data):
+@router.route("get_changes", fridge=True)
+def get_changes(data, fridge_id):
+    """
+    Items inserted, updated or deleted since "cursor" (from get_data or a previous
+    get_changes). Returns the new cursor; keep calling while "has_more" is true.
+    {
+        "user_id": "user1",
+        "cursor": 1234,
+        "limit": 500
+    }
+    """
+    # Extract the sync position from the request
+    try:
+        cursor = int(data.get('cursor') or 0)
+        limit = min(max(int(data.get('limit') or 500), 1), 1000)
+    except (TypeError, ValueError):
+        return {"success": False, "message": "Invalid cursor or limit"}, 200
+
+    conn = db.connection()
+    with conn.cursor() as cur:
+        cursor, has_more, rows, deleted = read_changes(cur, fridge_id, cursor, limit)
+        labeled_items, unlabeled_items = serialize_items(cur, rows, data.get('full_images', False))
+        add_suggestions(cur, unlabeled_items)
+
+        conn.commit()
+
+    return {"success": True, "cursor": cursor, "has_more": has_more, "labeled_items": labeled_items, "unlabeled_items": unlabeled_items, "deleted": deleted}, 200
+
+# get_expiring defaults and caps
+EXPIRING_DAYS = 3
+MAX_EXPIRING_DAYS = 365
+EXPIRING_LIMIT = 20
+MAX_EXPIRING_LIMIT = 200
+
+@router.route("get_expiring", fridge=True)
+def get_expiring(data, fridge_id):
+    """
+    Items expiring within "days" days of "today" (default: the server's date),
+    already expired ones included, soonest first. Served by a range scan on
+    idx_item_fridge_exp. Pass the returned "cursor" back for the next page;
+    it is null on the last one.
+    {
+        "user_id": "user1",
+        "days": 3,
+        "today": "01/01/2024",
+        "limit": 20,
+        "cursor": null
+    }
+    """
+    try:
+        days = min(max(int(data.get('days', EXPIRING_DAYS)), 0), MAX_EXPIRING_DAYS)
+        limit = min(max(int(data.get('limit') or EXPIRING_LIMIT), 1), MAX_EXPIRING_LIMIT)
+        today = datetime.datetime.strptime(data['today'], "%m/%d/%Y").date() if data.get('today') else datetime.date.today()
+        cursor = data.get('cursor')
+        if cursor:
+            # "YYYY-MM-DD|uuid" of the last item of the previous page
+            after_date, after_uuid = cursor.split("|", 1)
+            after_date = datetime.date.fromisoformat(after_date)
+    except (TypeError, ValueError, AttributeError):
+        return {"success": False, "message": "Invalid days, limit, today or cursor"}, 400
+
+    until = today + datetime.timedelta(days=days)
+    query = "SELECT uuid, expiration_date, name, barcode, image_url FROM item_info WHERE fridge_id = %s AND expiration_date <= %s"
+    params = [fridge_id, until]
+    if cursor:
+        # Keyset on (expiration_date, uuid), spelled out so MySQL uses an index range
+        query += " AND (expiration_date > %s OR (expiration_date = %s AND uuid > %s))"
+        params += [after_date, after_date, after_uuid]
+    query += " ORDER BY expiration_date, uuid LIMIT %s"
+    params.append(limit + 1)
+
+    conn = db.connection()
+    with conn.cursor() as cur:
+        cur.execute(query, params)
+        rows = cur.fetchall()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        thumbnailed = read_thumbnailed(cur, [row[4] for row in rows])
+        conn.commit()
+
+    items = []
+    for item_uuid, expiration_date, name, barcode, image_url in rows:
+        items.append({"uuid": item_uuid, "expiration_date": format_date(expiration_date), "days_left": (expiration_date - today).days,
+                      "name": name, "barcode": barcode,
+                      "image_url": "Error" if image_url is None or image_url == NO_IMAGE_URL else thumbnail_url(image_url, thumbnailed)})
+
+    next_cursor = f"{rows[-1][1].isoformat()}|{rows[-1][0]}" if has_more else None
+    return {"success": True, "items": items, "cursor": next_cursor}, 200
+
+@router.route("search_items", schema={"query": str}, fridge=True)
+def search_items(data, fridge_id):
+    """
+    Labeled items whose name contains every word of "query", best match first.
+    Served by the ngram FULLTEXT index on item_info.name.
+    {
+        "user_id": "user1",
+        "query": "chees",
+        "limit": 20
+    }
+    """
+    terms = search_terms(data.get('query'))
+    if not terms:
+        return {"success": False, "message": "Query has no words to search for"}, 200
+
+    try:
+        limit = min(max(int(data.get('limit') or SEARCH_LIMIT), 1), MAX_SEARCH_LIMIT)
+    except (TypeError, ValueError):
+        return {"success": False, "message": "Invalid limit"}, 200
+
+    query = boolean_query(terms)
+    patterns = like_patterns(terms)
+
+    conn = db.connection()
+    with conn.cursor() as cur:
+        # While the server keeps its default stopwords, the ngram parser drops the
+        # bigrams of a term that contain one and matches on the rest; LIKE keeps
+        # only names that really contain every term
+        cur.execute(f"""
+            SELECT uuid, expiration_date, name, barcode, image_url, MATCH (name) AGAINST (%s IN BOOLEAN MODE) AS score
+            FROM item_info
+            WHERE fridge_id = %s AND MATCH (name) AGAINST (%s IN BOOLEAN MODE) AND {" AND ".join(["name LIKE %s"] * len(patterns))}
+            ORDER BY score DESC, name, uuid
+            LIMIT %s
+        """, (query, fridge_id, query, *patterns, limit))
+        items, _ = serialize_items(cur, [row[:5] for row in cur.fetchall()], data.get('full_images', False))
+
+        conn.commit()
+
+    return {"success": True, "items": items}, 200
+
+# Errors of a batch that lost a race: two relabels of one unmapped barcode can both
+# pass the NOT EXISTS check, and the later insert then hits the saved_map key (1062)
+# or deadlocks on the shared locks INSERT ... SELECT takes (1213)
+CONFLICT_ERRORS = (1062, 1213)
+
+def commit_if_ok(conn, cur, statements):
+    """
+    Run statements, which set @ok, and the commit in one round trip on a
+    relabel_db connection and return whether @ok was set. Writes gated on @ok
+    make the commit a no-op otherwise. A batch that fails on CONFLICT_ERRORS
+    wrote nothing and also returns False.
+    """
+    try:
+        rows = run_batch(cur, statements + [("COMMIT", None), ("SELECT @ok", None)])
+    except pymysql.MySQLError as e:
+        # The batch stops at the failing statement; dropping the connection discards
+        # whatever ran before it without another round trip
+        relabel_db.reset()
+        if e.args and e.args[0] in CONFLICT_ERRORS:
+            return False
+        raise
+    return rows[0][0] == 1
+
+@router.route("update_unlabeled_data", schema={"item": dict}, fridge=True)
+def update_unlabeled_data(data, fridge_id):
     """
     {
         "user_id": "user1",
@@ -120,71 +353,76 @@ def update_unlabeled_data(data):
             "expiration_date": "12/31/2020"
         }
     }
+    Returns "conflict": true if another request labeled the item first.
     """
-    # Extract user_id and item data from the request
-    user_id = data.get('user_id')
+    # Extract item data from the request
     item = data.get('item')
 
     # Extract item details
     uuid = item.get('uuid')
     name = item.get('name')
     expiration_date_str = item.get('expiration_date')
-    
-    with conn.cursor() as cur:
-        # Check if user_id exists in user_map table
-        cur.execute("SELECT fridge_id FROM user_map WHERE user_id = %s", (user_id,))
-        fridge_id_row = cur.fetchone()
 
-        if fridge_id_row is None:
-            return {"success": False, "message": "User does not have a fridge associated"}, 200
-    
-        fridge_id = fridge_id_row[0]
-    
-        # Check if the item exists and is unlabeled
-        cur.execute("SELECT name FROM item_info WHERE uuid = %s AND name IS NULL", (uuid,))
-        existing_item = cur.fetchone()
-    
-        if existing_item is None:
+    # Convert expiration_date string to a datetime object
+    expiration_date = datetime.datetime.strptime(expiration_date_str, "%m/%d/%Y").date()
+
+    conn = relabel_db.connection()
+    with conn.cursor() as cur:
+        # Round trip 1: a plain read of the item and any mapping of its barcode, no locks taken
+        cur.execute("""
+            SELECT i.name, i.barcode, s.barcode FROM item_info i
+            LEFT JOIN saved_map s ON s.fridge_id = i.fridge_id AND s.barcode = i.barcode
+            WHERE i.uuid = %s AND i.fridge_id = %s
+        """, (uuid, fridge_id))
+        row = cur.fetchone()
+
+        if row is None or row[0] is not None:
+            conn.rollback()
             return {"success": False, "message": "Item with specified UUID does not exist or is labeled"}, 200
-    
-        # Convert expiration_date string to a datetime object
-        expiration_date = datetime.datetime.strptime(expiration_date_str, "%m/%d/%Y").date()
-    
-        # Update the item in item_info table
-        cur.execute("UPDATE item_info SET name = %s, expiration_date = %s WHERE uuid = %s",
-                          (name, expiration_date, uuid))
-    
-        # Get barcode
-        cur.execute("SELECT barcode FROM item_info WHERE uuid = %s", (uuid,))
-        barcode_row = cur.fetchone()
-        
-        if barcode_row is None:
-            return {"success": False, "message": "Failed to retrieve barcode for the updated item"}, 200
-            
-        barcode = barcode_row[0]
-    
-        # Check if the barcode already exists in the saved_map table for the specified fridge_id
-        cur.execute("SELECT COUNT(*) FROM saved_map WHERE fridge_id = %s AND barcode = %s", (fridge_id, barcode))
-        existing_mapping_count = cur.fetchone()[0]
-    
-        if existing_mapping_count == 0:
-            # Add an entry in the saved_map table associating the barcode with the name
-            cur.execute("INSERT INTO saved_map (fridge_id, barcode, name) VALUES (%s, %s, %s)", (fridge_id, barcode, name))
-            
-            # Update all items with that barcode to that name for that fridge id in item_info table
-            cur.execute("""
-                UPDATE item_info
-                SET name = %s
-                WHERE fridge_id = %s AND barcode = %s
-            """, (name, fridge_id, barcode))
-        else:
+
+        barcode, mapped_barcode = row[1], row[2]
+        if mapped_barcode is not None:
+            conn.rollback()
             return {"success": False, "message": f"Barcode {barcode} already exists in the saved_map table"}, 200
-        
-        conn.commit()
+
+        # Round trip 2: every write plus the commit. Each write is gated on @ok, set by the
+        # first one only if the item is still unlabeled (and the barcode still unmapped), so
+        # a concurrent relabel shows up as a conflict instead of waiting on row locks
+        if barcode is None:
+            statements = [
+                ("UPDATE item_info SET name = %s, expiration_date = %s WHERE uuid = %s AND fridge_id = %s AND name IS NULL",
+                 (name, expiration_date, uuid, fridge_id)),
+                ("SET @ok = ROW_COUNT()", None),
+            ]
+        else:
+            statements = [
+                ("""
+                    INSERT INTO saved_map (fridge_id, barcode, name)
+                    SELECT %s, %s, %s FROM DUAL
+                    WHERE EXISTS (SELECT 1 FROM item_info WHERE uuid = %s AND fridge_id = %s AND name IS NULL)
+                      AND NOT EXISTS (SELECT 1 FROM saved_map WHERE fridge_id = %s AND barcode = %s)
+                """, (fridge_id, barcode, name, uuid, fridge_id, fridge_id, barcode)),
+                ("SET @ok = ROW_COUNT()", None),
+                ("UPDATE item_info SET expiration_date = %s WHERE uuid = %s AND @ok = 1", (expiration_date, uuid)),
+                # Update all items with that barcode to that name for that fridge id in item_info table
+                ("UPDATE item_info SET name = %s WHERE fridge_id = %s AND barcode = %s AND @ok = 1",
+                 (name, fridge_id, barcode)),
+            ]
+            # Suggest the name to other fridges that scan this barcode
+            statements += count_label_if_ok(barcode, name)
+
+        statements += record_changes_if_ok(fridge_id, upserted=[uuid], barcode=barcode)
+        if barcode is not None:
+            # Tells the hardware containers' barcode caches that saved_map changed
+            statements.append(bump_labels_version_if_ok(fridge_id))
+
+        if not commit_if_ok(conn, cur, statements):
+            return {"success": False, "conflict": True, "message": "Item was changed by another request"}, 200
 
     return {"success": True, "item": {"uuid": uuid, "name": name, "expiration_date": expiration_date_str}}, 200
 
-def update_labeled_data(data):
+@router.route("update_labeled_data", schema={"item": dict}, fridge=True)
+def update_labeled_data(data, fridge_id):
     """
     Note: not all labeled items that can be updated need to have a barcode. For example, an items added from the phone may not have a barcode.
     {
@@ -192,62 +430,73 @@ def update_labeled_data(data):
         "item": {       
             "uuid": "1234",
             "name": "Cheese",
-            "expiration_date": "12/31/2020"
+            "expiration_date": "12/31/2020",
+            "expected_name": "Cheddar"
         }
     }
+    expected_name is optional: the name the client last saw. If the item has been
+    renamed since, nothing is written and "conflict": true is returned.
     """
-    # Extract user_id and item data from the request
-    user_id = data.get('user_id')
+    # Extract item data from the request
     item = data.get('item')
 
     # Extract item details
     uuid = item.get('uuid')
     name = item.get('name')
     expiration_date_str = item.get('expiration_date')
-    
+
+    # Convert expiration_date string to a datetime object
+    expiration_date = datetime.datetime.strptime(expiration_date_str, "%m/%d/%Y").date()
+
+    conn = relabel_db.connection()
     with conn.cursor() as cur:
-        # Check if user_id exists in user_map table
-        cur.execute("SELECT fridge_id FROM user_map WHERE user_id = %s", (user_id,))
-        fridge_id_row = cur.fetchone()
-    
-        if fridge_id_row is None:
-            return {"success": False, "message": "User does not have a fridge associated"}, 200
-        
-        fridge_id = fridge_id_row[0]
-    
-        # Check if the item exists and is labeled
-        cur.execute("SELECT name, barcode FROM item_info WHERE uuid = %s AND name IS NOT NULL", (uuid,))
-        existing_name, existing_barcode = cur.fetchone()
-    
-        if existing_name is None:
+        # Round trip 1: a plain read of the item, no locks taken
+        cur.execute("SELECT name, barcode FROM item_info WHERE uuid = %s AND fridge_id = %s", (uuid, fridge_id))
+        row = cur.fetchone()
+
+        if row is None or row[0] is None:
+            conn.rollback()
             return {"success": False, "message": "Item with specified UUID does not exist or is unlabeled"}, 200
-    
-        # Convert expiration_date string to a datetime object
-        expiration_date = datetime.datetime.strptime(expiration_date_str, "%m/%d/%Y").date()
-    
-        # Update the expiration_date for the labeled item in item_info table
-        cur.execute("UPDATE item_info SET name = %s, expiration_date = %s WHERE uuid = %s",
-                          (name, expiration_date, uuid))
-                          
-        # Update barcode's value in saved_map
-        cur.execute("SELECT barcode FROM item_info WHERE uuid = %s", (uuid,))
-        barcode_row = cur.fetchone()
-        
-        if barcode_row is not None:
-            barcode = barcode_row[0]
-            cur.execute("UPDATE saved_map SET name = %s WHERE fridge_id = %s AND barcode = %s", (name, fridge_id, barcode))
-            # Update all items with that barcode to that name for that fridge id in item_info table
-            cur.execute("""
-                UPDATE item_info
-                SET name = %s
-                WHERE fridge_id = %s AND barcode = %s
-            """, (name, fridge_id, barcode))
-                          
-        conn.commit()
+
+        existing_name, barcode = row
+        expected_name = item.get('expected_name', existing_name)
+        if expected_name != existing_name:
+            conn.rollback()
+            return {"success": False, "conflict": True, "message": "Item was changed by another request"}, 200
+
+        # Round trip 2: every write plus the commit, gated on the name being unchanged since round trip 1
+        statements = [
+            ("UPDATE item_info SET name = %s, expiration_date = %s WHERE uuid = %s AND fridge_id = %s AND name = %s",
+             (name, expiration_date, uuid, fridge_id, expected_name)),
+            ("SET @ok = ROW_COUNT()", None),
+        ]
+        if barcode is not None:
+            statements += [
+                # Update barcode's value in saved_map; an item named from the product catalog has no entry yet
+                ("""
+                    INSERT INTO saved_map (fridge_id, barcode, name)
+                    SELECT %s, %s, %s FROM DUAL WHERE @ok = 1
+                    ON DUPLICATE KEY UPDATE name = VALUES(name)
+                """, (fridge_id, barcode, name)),
+                # Update all items with that barcode to that name for that fridge id in item_info table
+                ("UPDATE item_info SET name = %s WHERE fridge_id = %s AND barcode = %s AND @ok = 1",
+                 (name, fridge_id, barcode)),
+            ]
+            if name != existing_name:
+                statements += count_label_if_ok(barcode, name)
+
+        statements += record_changes_if_ok(fridge_id, upserted=[uuid], barcode=barcode)
+        if barcode is not None:
+            # Tells the hardware containers' barcode caches that saved_map changed
+            statements.append(bump_labels_version_if_ok(fridge_id))
+
+        if not commit_if_ok(conn, cur, statements):
+            return {"success": False, "conflict": True, "message": "Item was changed by another request"}, 200
 
     return {"success": True, "item": {"uuid": uuid, "expiration_date": expiration_date_str}}, 200
 
-def add_data(data):
+@router.route("add_data", schema={"item": dict}, fridge=True)
+def add_data(data, fridge_id):
     """
     { 
         "user_id": "user1",
@@ -257,20 +506,11 @@ def add_data(data):
         }
     }
     """
-    # Extract user_id and item data from the request
-    user_id = data.get('user_id')
+    # Extract item data from the request
     item = data.get('item')
 
+    conn = db.connection()
     with conn.cursor() as cur:
-        # Check if user_id exists in user_map table
-        cur.execute("SELECT fridge_id FROM user_map WHERE user_id = %s", (user_id,))
-        fridge_id_row = cur.fetchone()
-    
-        if fridge_id_row is None:
-            return {"success": False, "message": "User does not have a fridge associated"}, 200
-    
-        fridge_id = fridge_id_row[0]
-    
         # Generate UUID for the item
         item_uuid = str(uuid.uuid4())
     
@@ -281,17 +521,18 @@ def add_data(data):
         # Convert expiration_date string to a datetime object
         expiration_date = datetime.datetime.strptime(expiration_date_str, "%m/%d/%Y").date()
     
-        no_image_url = "https://fridgemate-images.s3.us-east-2.amazonaws.com/No_Image.png"
-    
         # Insert item into item_info table
         cur.execute("INSERT INTO item_info (uuid, fridge_id, name, expiration_date, image_url) VALUES (%s, %s, %s, %s, %s)",
-                          (item_uuid, fridge_id, name, expiration_date, no_image_url))
+                          (item_uuid, fridge_id, name, expiration_date, NO_IMAGE_URL))
+
+        record_changes(cur, fridge_id, upserted=[item_uuid])
                           
         conn.commit()
 
     return {"success": True, "item": {"uuid": item_uuid, "name": name, "expiration_date": expiration_date_str}}, 200
 
-def delete_data(data):
+@router.route("delete_data", schema={"item": dict}, fridge=True)
+def delete_data(data, fridge_id):
     """
     {
         "user_id": "user1",
@@ -301,50 +542,35 @@ def delete_data(data):
     }
     """
 
-    # Extract user_id and item data from the request
-    user_id = data.get('user_id')
+    # Extract item data from the request
     item = data.get('item')
 
     # Extract item details
     uuid = item.get('uuid')
 
+    conn = db.connection()
     with conn.cursor() as cur:
-        # Check if user_id exists in user_map table
-        cur.execute("SELECT fridge_id FROM user_map WHERE user_id = %s", (user_id,))
-        fridge_id_row = cur.fetchone()
-    
-        if fridge_id_row is None:
-            return {"success": False, "message": "User does not have a fridge associated"}, 200
-    
-        # Delete the item from item_info table
-        cur.execute("DELETE FROM item_info WHERE uuid = %s", (uuid,))
+        # Delete the item from item_info table, only from the user's own fridge
+        cur.execute("DELETE FROM item_info WHERE uuid = %s AND fridge_id = %s", (uuid, fridge_id))
     
         if cur.rowcount == 0:
             return {"success": False, "message": "Item with specified UUID does not exist"}, 200
+
+        record_changes(cur, fridge_id, deleted=[uuid])
         
         conn.commit()
 
     return {"success": True, "item": {"uuid": uuid}}, 200
 
-def get_env_data(data):
+@router.route("get_env_data", fridge=True)
+def get_env_data(data, fridge_id):
     """
     {
         "user_id": "user1"
     }
     """
-    # Extract user_id and item data from the request
-    user_id = data.get('user_id')
-
+    conn = db.connection()
     with conn.cursor() as cur:
-        # Check if user_id exists in user_map table
-        cur.execute("SELECT fridge_id FROM user_map WHERE user_id = %s", (user_id,))
-        fridge_id_row = cur.fetchone()
-    
-        if fridge_id_row is None:
-            return {"success": False, "message": "User does not have a fridge associated"}, 200
-        
-        fridge_id = fridge_id_row[0]
-        
         # get env data from env_info table
         cur.execute("SELECT temperature, humidity FROM env_info WHERE fridge_id = %s", (fridge_id,))
         env_data_row = cur.fetchone()
@@ -358,25 +584,47 @@ def get_env_data(data):
     
     return {"success": True, "env_data": {"temperature": existing_temperature, "humidity": existing_humidity}}, 200
 
-def get_door_data(data):
+@router.route("get_env_history", fridge=True)
+def get_env_history(data, fridge_id):
     """
+    Temperature and humidity min/max/mean per minute, hour or day between "start"
+    and "end" (epoch seconds, default: the last 7 days). "resolution" defaults to
+    "auto", the finest one that returns at most telemetry.MAX_POINTS points.
     {
-        "user_id": "user1"
+        "user_id": "user1",
+        "start": 1760000000,
+        "end": 1760604800,
+        "resolution": "hour"
     }
     """
-    # Extract user_id and item data from the request
-    user_id = data.get('user_id')
+    try:
+        end = int(data.get('end') or time.time())
+        start = int(data.get('start') or end - 7 * 86400)
+    except (TypeError, ValueError):
+        return {"success": False, "message": "start and end must be epoch seconds"}, 400
+
+    resolution = data.get('resolution', 'auto')
+    if resolution == 'auto':
+        resolution = pick_resolution(start, end)
+    if resolution not in RESOLUTIONS or start >= end:
+        return {"success": False, "message": f"resolution must be one of auto, {', '.join(RESOLUTIONS)} and start before end"}, 400
+
+    conn = db.connection()
+    with conn.cursor() as cur:
+        points = query_env_history(cur, fridge_id, resolution, start, end)
+        conn.commit()
+
+    return {"success": True, "resolution": resolution, "start": start, "end": end, "points": points}, 200
 
+@router.route("get_door_data", fridge=True)
+def get_door_data(data, fridge_id):
+    """
+    {
+        "user_id": "user1"
+    }
+    """
+    conn = db.connection()
     with conn.cursor() as cur:
-        # Check if user_id exists in user_map table
-        cur.execute("SELECT fridge_id FROM user_map WHERE user_id = %s", (user_id,))
-        fridge_id_row = cur.fetchone()
-    
-        if fridge_id_row is None:
-            return {"success": False, "message": "User does not have a fridge associated"}, 200
-        
-        fridge_id = fridge_id_row[0]
-        
         # get env data from env_info table
         cur.execute("SELECT value FROM door_info WHERE fridge_id = %s", (fridge_id,))
         env_data_row = cur.fetchone()
@@ -389,49 +637,46 @@ def get_door_data(data):
         conn.commit()
     
     return {"success": True, "value": existing_value}, 200
-    
 
-def generate_response(body, status):
-    response = {
-        'statusCode': status,
-        'body': json.dumps(body),
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*'
-        },
+@router.route("get_door_stats", fridge=True)
+def get_door_stats(data, fridge_id):
+    """
+    Per-day door openings, seconds open and longest opening (seconds) for the
+    last "days" UTC days including today (default 7), plus whether the door is
+    open now and since when. Reads one pre-aggregated row per day.
+    {
+        "user_id": "user1",
+        "days": 7
     }
-    return response    
+    """
+    try:
+        days = min(max(int(data.get('days') or 7), 1), 366)
+    except (TypeError, ValueError):
+        return {"success": False, "message": "days must be a number"}, 400
 
-def lambda_handler(event, context):
+    now = int(time.time())
+    today = now // SECONDS_PER_DAY
+
+    conn = db.connection()
+    with conn.cursor() as cur:
+        stats, state = query_door_stats(cur, fridge_id, today - days + 1, today, now)
+        conn.commit()
+
+    for day in stats:
+        day["date"] = datetime.date.fromordinal(EPOCH_ORDINAL + day.pop("day")).strftime("%m/%d/%Y")
+
+    return {"success": True, "door": state, "days": stats}, 200
+
+@router.route("get_cache_stats", body=False)
+def get_cache_stats():
     """
-    This function creates a new RDS database table and writes records to it
+    Hit/miss counters of the caches held by this container, its connection and route timings
     """
+    return {"success": True, "fridge_cache": fridge_cache.stats(), "connection": db.stats(), "relabel_connection": relabel_db.stats(), "routes": router.timings}, 200
     
-    path = event["path"].split('/')[-1]
-    body = json.loads(event["body"])
-    
-    return_body = None
-    return_status = None
-    if path == "get_user_mapping":
-        return_body, return_status = get_user_mapping(body)
-    elif path == "add_user_mapping":
-        return_body, return_status = add_user_mapping(body)
-    elif path == "get_data":
-        return_body, return_status = get_data(body)
-    elif path == "update_unlabeled_data":
-        return_body, return_status = update_unlabeled_data(body)
-    elif path == "update_labeled_data":
-        return_body, return_status = update_labeled_data(body)
-    elif path == "add_data":
-        return_body, return_status = add_data(body)
-    elif path == "delete_data":
-        return_body, return_status = delete_data(body)
-    elif path == "get_env_data":
-        return_body, return_status = get_env_data(body)
-    elif path == "get_door_data":
-        return_body, return_status = get_door_data(body)
-    else:
-        return_body, return_status = {"message": "Invalid path"}, 500 
-    
-    return generate_response(return_body, return_status)
-    
\ No newline at end of file
+
+def lambda_handler(event, context):
+    """
+    Entry point for the app API; requests are dispatched by the last segment of the path
+    """
+    return router.handle(event)
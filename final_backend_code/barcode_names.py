@@ -0,0 +1,25 @@
+import os
+from ttl_cache import TTLCache
+from inventory import get_labels_version
+
+# fridge_id -> (labels_version, {barcode: name}) kept for the lifetime of the process
+# (a warm Lambda container or the local server)
+barcode_name_cache = TTLCache(maxsize=int(os.environ.get('BARCODE_CACHE_SIZE', 256)),
+                              ttl=float(os.environ.get('BARCODE_CACHE_TTL', 3600)))
+
+def lookup_barcode_names(cur, fridge_id, param="%s"):
+    """
+    The fridge's barcode -> name map. A cached map is used for as long as the
+    fridge's labels_version is unchanged, so a restock costs a primary key lookup
+    instead of re-reading saved_map; the update_* handlers of the app API bump
+    labels_version whenever they write saved_map.
+    """
+    labels_version = get_labels_version(cur, fridge_id, param)
+    cached = barcode_name_cache.get(fridge_id)
+    if cached is not None and cached[0] == labels_version:
+        return cached[1]
+
+    cur.execute(f"SELECT barcode, name FROM saved_map WHERE fridge_id = {param}", (fridge_id,))
+    barcode_names = dict(cur.fetchall())
+    barcode_name_cache.set(fridge_id, (labels_version, barcode_names))
+    return barcode_names
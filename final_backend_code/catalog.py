@@ -0,0 +1,240 @@
+import os
+import csv
+import sys
+import gzip
+import mmap
+import bisect
+import struct
+import logging
+import functools
+from array import array
+
+logger = logging.getLogger()
+
+# Global barcode -> (name, category) product catalog used to pre-label items at
+# insert time. It is built offline from a product dump (such as an Open Food
+# Facts export) into a single read-only file that is memory-mapped, so a cold
+# start maps the file instead of loading it and a lookup is a binary search over
+# the mapped pages. All integers are little-endian; sections follow the header
+# in this order, each aligned to 8 bytes:
+#
+#   header        "<4sHHII8x"  magic b"FCAT", version, flags (reserved, 0),
+#                              entry count, category count
+#   keys          uint64 x count            barcodes as integers, ascending
+#   name offsets  uint32 x (count + 1)      into the name pool
+#   categories    uint16 x count            category index, NO_CATEGORY for none
+#   cat offsets   uint32 x (categories + 1) into the category pool
+#   category pool, name pool                UTF-8
+#
+# Build one with:  python catalog.py <dump.csv[.gz]> <catalog.bin>
+MAGIC = b"FCAT"
+VERSION = 1
+HEADER = struct.Struct("<4sHHII8x")
+
+NO_CATEGORY = 0xFFFF
+
+# item_info.name is a VARCHAR(255)
+MAX_NAME_LENGTH = 255
+
+# Barcodes are stored as integers, so UPC-A "012345678905" and its EAN-13 form
+# "0012345678905" are the same product, as they are in GTIN-14
+MAX_BARCODE_DIGITS = 19
+
+def normalize_barcode(barcode):
+    """
+    The integer key of a barcode, or None if it is not a numeric barcode
+    """
+    if barcode is None:
+        return None
+    barcode = str(barcode).strip()
+    if not (barcode.isascii() and barcode.isdigit()) or len(barcode) > MAX_BARCODE_DIGITS:
+        return None
+    return int(barcode)
+
+def align(offset):
+    return (offset + 7) & ~7
+
+def layout(count, category_count):
+    """
+    Start offsets of the fixed-size sections and where the name pool begins
+    """
+    keys = align(HEADER.size)
+    name_offsets = align(keys + 8 * count)
+    categories = align(name_offsets + 4 * (count + 1))
+    category_offsets = align(categories + 2 * count)
+    pools = align(category_offsets + 4 * (category_count + 1))
+    return keys, name_offsets, categories, category_offsets, pools
+
+def build_catalog(records, path):
+    """
+    Write records, (barcode, name, category) tuples, to a catalog file at path and
+    return the number of entries. Records without a numeric barcode or a name are
+    skipped and the first record of a barcode wins. The file is written next to
+    path and renamed over it, so a process mapping the old file is not disturbed.
+    """
+    if sys.byteorder != "little":
+        raise RuntimeError("Catalogs are built on little-endian hosts")
+
+    entries = {}
+    categories = {}
+    for barcode, name, category in records:
+        key = normalize_barcode(barcode)
+        name = (name or "").strip()[:MAX_NAME_LENGTH]
+        if key is None or not name or key in entries:
+            continue
+
+        category = (category or "").strip()[:MAX_NAME_LENGTH]
+        category_id = NO_CATEGORY
+        if category:
+            category_id = categories.get(category, NO_CATEGORY)
+            if category_id == NO_CATEGORY and len(categories) < NO_CATEGORY:
+                category_id = categories[category] = len(categories)
+
+        entries[key] = (name, category_id)
+
+    keys = array("Q", sorted(entries))
+    name_offsets, category_ids, name_pool = array("I", [0]), array("H"), bytearray()
+    for key in keys:
+        name, category_id = entries[key]
+        name_pool += name.encode("utf-8")
+        name_offsets.append(len(name_pool))
+        category_ids.append(category_id)
+
+    category_offsets, category_pool = array("I", [0]), bytearray()
+    for category in categories:
+        category_pool += category.encode("utf-8")
+        category_offsets.append(len(category_pool))
+
+    sections = zip(layout(len(keys), len(categories)),
+                   (keys, name_offsets, category_ids, category_offsets, category_pool + name_pool))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, len(keys), len(categories)))
+        for offset, section in sections:
+            f.write(b"\0" * (offset - f.tell()))
+            f.write(section)
+    os.replace(tmp_path, path)
+
+    return len(keys)
+
+def read_off_dump(path):
+    """
+    Yield (barcode, name, category) from an Open Food Facts CSV export (tab
+    separated, optionally gzipped)
+    """
+    # Some columns of the export hold very long values
+    csv.field_size_limit(2 ** 31 - 1)
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f, delimiter="\t", quoting=csv.QUOTE_NONE):
+            category = row.get("main_category_en") or (row.get("categories_en") or "").split(",")[-1]
+            yield row.get("code"), row.get("product_name"), category
+
+class Catalog:
+    """
+    Read-only view of a catalog file. Opening it maps the file and decodes only
+    the header and the category names; lookups fault in the pages they touch.
+    """
+
+    def __init__(self, path):
+        if sys.byteorder != "little":
+            raise RuntimeError("Catalogs are read on little-endian hosts")
+
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            if len(self._mmap) < HEADER.size:
+                raise ValueError("Truncated catalog")
+            magic, version, _, count, category_count = HEADER.unpack_from(self._mmap)
+            if magic != MAGIC:
+                raise ValueError("Not a catalog file")
+            if version != VERSION:
+                raise ValueError(f"Unsupported catalog version {version}")
+
+            keys, name_offsets, categories, category_offsets, pools = layout(count, category_count)
+            if len(self._mmap) < pools:
+                raise ValueError("Truncated catalog")
+            view = self._view = memoryview(self._mmap)
+            self._keys = view[keys:keys + 8 * count].cast("Q")
+            self._name_offsets = view[name_offsets:name_offsets + 4 * (count + 1)].cast("I")
+            self._categories = view[categories:categories + 2 * count].cast("H")
+
+            offsets = view[category_offsets:category_offsets + 4 * (category_count + 1)].cast("I")
+            category_pool = bytes(view[pools:pools + offsets[-1]])
+            self._category_names = [category_pool[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(category_count)]
+            offsets.release()
+
+            names = pools + len(category_pool)
+            if len(self._mmap) != names + self._name_offsets[-1]:
+                raise ValueError("Catalog size does not match its header")
+            self._names = view[names:]
+        except Exception:
+            self.close()
+            raise
+
+    def __len__(self):
+        return len(self._keys)
+
+    def lookup(self, barcode):
+        """
+        (name, category) of the product with this barcode, None if it is not in
+        the catalog; category is None when the dump had none
+        """
+        key = normalize_barcode(barcode)
+        if key is None:
+            return None
+
+        keys = self._keys
+        index = bisect.bisect_left(keys, key)
+        if index == len(keys) or keys[index] != key:
+            return None
+
+        name = str(self._names[self._name_offsets[index]:self._name_offsets[index + 1]], "utf-8")
+        category_id = self._categories[index]
+        return name, None if category_id == NO_CATEGORY else self._category_names[category_id]
+
+    def close(self):
+        for attr in ("_keys", "_name_offsets", "_categories", "_names", "_view"):
+            view = self.__dict__.pop(attr, None)
+            if view is not None:
+                view.release()
+        self._mmap.close()
+
+@functools.lru_cache(maxsize=None)
+def open_catalog(path):
+    """
+    Map the catalog at path once per process; None if it cannot be opened, so a
+    broken file costs one logged error rather than one per request
+    """
+    try:
+        catalog = Catalog(path)
+    except (OSError, ValueError, RuntimeError) as e:
+        logger.error(f"Could not open barcode catalog {path}: {e}")
+        return None
+
+    logger.info(f"Mapped barcode catalog {path} with {len(catalog)} products")
+    return catalog
+
+def lookup_product(barcode):
+    """
+    (name, category) from the catalog named by BARCODE_CATALOG_PATH, or None if
+    the barcode is unknown or no catalog is configured
+    """
+    path = os.environ.get('BARCODE_CATALOG_PATH')
+    if not path:
+        return None
+
+    catalog = open_catalog(path)
+    if catalog is None:
+        return None
+
+    return catalog.lookup(barcode)
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit("usage: python catalog.py <dump.csv[.gz]> <catalog.bin>")
+    logging.basicConfig(level=logging.INFO)
+    count = build_catalog(read_off_dump(sys.argv[1]), sys.argv[2])
+    logger.info(f"Wrote {count} products to {sys.argv[2]}")
@@ -0,0 +1,100 @@
+import time
+import logging
+import pymysql
+
+logger = logging.getLogger()
+
+class ConnectionManager:
+    """
+    Lazily opened pymysql connection that is re-used across invocations of a warm
+    Lambda container. connection() pings a connection that sat idle for longer than
+    ping_interval seconds (the RDS proxy drops idle sockets) and reconnects with
+    bounded retries and exponential backoff when it is gone.
+    """
+
+    def __init__(self, host, user, password, db, connect_timeout=5, max_retries=3,
+                 backoff=0.1, ping_interval=30, **connect_kwargs):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.db = db
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.ping_interval = ping_interval
+        self.connect_kwargs = connect_kwargs
+
+        self._conn = None
+        self._last_used = 0.0
+
+        self.connects = 0
+        self.reconnects = 0
+        self.failed_attempts = 0
+        self.last_connect_ms = None
+        self.total_connect_ms = 0.0
+
+    def connection(self):
+        """
+        Return a live connection, opening or re-opening it as needed.
+        Raises pymysql.MySQLError once every retry has failed.
+        """
+        if self._conn is not None and time.monotonic() - self._last_used >= self.ping_interval:
+            try:
+                self._conn.ping(reconnect=False)
+            except pymysql.MySQLError as e:
+                logger.warning(f"Stale database connection, reconnecting: {e}")
+                self.reset()
+
+        if self._conn is None:
+            self._conn = self._connect()
+
+        self._last_used = time.monotonic()
+        return self._conn
+
+    def reset(self):
+        """
+        Drop the current connection so the next connection() call opens a new one.
+        Called after a query fails with a connection-level error.
+        """
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except pymysql.MySQLError:
+                pass
+        self._conn = None
+
+    def _connect(self):
+        is_reconnect = self.connects > 0
+
+        for attempt in range(1, self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                conn = pymysql.connect(host=self.host, user=self.user, passwd=self.password, db=self.db,
+                                       connect_timeout=self.connect_timeout, **self.connect_kwargs)
+            except pymysql.MySQLError as e:
+                self.failed_attempts += 1
+                logger.error(f"ERROR: Could not connect to MySQL instance (attempt {attempt}/{self.max_retries}): {e}")
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+                continue
+
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.connects += 1
+            if is_reconnect:
+                self.reconnects += 1
+            self.last_connect_ms = elapsed_ms
+            self.total_connect_ms += elapsed_ms
+
+            logger.info(f"SUCCESS: {'Reconnection' if is_reconnect else 'Connection'} to RDS for MySQL instance succeeded in {elapsed_ms:.1f} ms")
+            return conn
+
+    def stats(self):
+        return {
+            "connected": self._conn is not None,
+            "connects": self.connects,
+            "reconnects": self.reconnects,
+            "failed_attempts": self.failed_attempts,
+            "last_connect_ms": self.last_connect_ms,
+            "total_connect_ms": self.total_connect_ms
+        }
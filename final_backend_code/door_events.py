@@ -0,0 +1,122 @@
+# Door open/close history (MySQL).
+# Transitions are appended to door_events. door_state holds each fridge's
+# current state and when it last changed, and door_daily holds per-day
+# aggregates (open count, seconds open, longest opening), so recording a batch
+# of events and reading a day are a constant number of statements however long
+# the history gets. Days are UTC days since the epoch.
+
+SECONDS_PER_DAY = 86400
+
+# An opening longer than this most likely means a lost "closed" reading; only
+# its last MAX_CREDITED_OPEN seconds are credited, which also bounds the work
+# per event to a few day rows
+MAX_CREDITED_OPEN = 7 * SECONDS_PER_DAY
+
+def credit_opening(daily, opened_at, closed_at):
+    """
+    Add an opening to daily ({day: [open_count, open_seconds, longest_open]}),
+    split at midnight when it spans days. The longest opening is credited to
+    the day the door was closed.
+    """
+    opened_at = max(opened_at, closed_at - MAX_CREDITED_OPEN)
+    start = opened_at
+    while start < closed_at:
+        day = start // SECONDS_PER_DAY
+        end = min(closed_at, (day + 1) * SECONDS_PER_DAY)
+        stats = daily.setdefault(day, [0, 0, 0])
+        stats[1] += end - start
+        if end == closed_at:
+            stats[2] = max(stats[2], closed_at - opened_at)
+        start = end
+
+def record_door_events(cur, fridge_id, events):
+    """
+    Apply door readings, a list of (ts, is_open) with ts in epoch seconds, in
+    timestamp order; readings of the same second keep their order in the list. Readings that repeat the current state, or are older than
+    the last transition, are not transitions and only refresh door_info, which
+    keeps the newest reading.
+    The batch is folded in memory, so it costs the same handful of statements
+    whether it holds one reading or hundreds. Runs in the caller's transaction;
+    the door_state row lock serialises concurrent batches of one fridge.
+    Returns the number of transitions.
+    """
+    if not events:
+        return 0
+    events = sorted(events, key=lambda event: event[0])
+
+    cur.execute("SELECT is_open, changed_at FROM door_state WHERE fridge_id = %s FOR UPDATE", (fridge_id,))
+    row = cur.fetchone()
+    is_open, changed_at = (bool(row[0]), row[1]) if row else (None, None)
+
+    transitions, daily = [], {}
+    for ts, event_open in events:
+        if is_open is not None and (event_open == is_open or ts < changed_at):
+            continue
+
+        transitions.append((fridge_id, ts, event_open))
+        if event_open:
+            daily.setdefault(ts // SECONDS_PER_DAY, [0, 0, 0])[0] += 1
+        elif is_open is not None:
+            # An open -> closed transition; the first ever reading being "closed" has nothing to credit
+            credit_opening(daily, changed_at, ts)
+        is_open, changed_at = event_open, ts
+
+    # A batch older than the reading door_info holds (a late retry) leaves it alone;
+    # MySQL assigns left to right, so ts is compared before it is moved forward
+    cur.execute("""
+        INSERT INTO door_info (fridge_id, value, ts)
+        VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            value = IF(ts IS NULL OR VALUES(ts) >= ts, VALUES(value), value),
+            ts = IF(ts IS NULL OR VALUES(ts) >= ts, VALUES(ts), ts)
+    """, (fridge_id, int(events[-1][1]), events[-1][0]))
+
+    if not transitions:
+        return 0
+
+    cur.executemany("INSERT INTO door_events (fridge_id, ts, is_open) VALUES (%s, %s, %s)", transitions)
+    cur.execute("""
+        INSERT INTO door_state (fridge_id, is_open, changed_at)
+        VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE is_open = VALUES(is_open), changed_at = VALUES(changed_at)
+    """, (fridge_id, is_open, changed_at))
+    cur.executemany("""
+        INSERT INTO door_daily (fridge_id, day, open_count, open_seconds, longest_open)
+        VALUES (%s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE open_count = open_count + VALUES(open_count),
+                                open_seconds = open_seconds + VALUES(open_seconds),
+                                longest_open = GREATEST(longest_open, VALUES(longest_open))
+    """, [(fridge_id, day, *stats) for day, stats in daily.items()])
+
+    return len(transitions)
+
+def query_door_stats(cur, fridge_id, first_day, last_day, now):
+    """
+    Aggregates for each day in [first_day, last_day] that has any, oldest first,
+    plus the current state. An opening still in progress is counted up to now.
+    """
+    cur.execute("""
+        SELECT day, open_count, open_seconds, longest_open FROM door_daily
+        WHERE fridge_id = %s AND day BETWEEN %s AND %s
+        ORDER BY day
+    """, (fridge_id, first_day, last_day))
+    days = {day: {"day": day, "open_count": open_count, "open_seconds": open_seconds, "longest_open": longest_open}
+            for day, open_count, open_seconds, longest_open in cur.fetchall()}
+
+    cur.execute("SELECT is_open, changed_at FROM door_state WHERE fridge_id = %s", (fridge_id,))
+    row = cur.fetchone()
+    state = {"is_open": bool(row[0]), "since": row[1]} if row else {"is_open": None, "since": None}
+
+    if state["is_open"]:
+        start = max(state["since"], first_day * SECONDS_PER_DAY)
+        while start < now:
+            day = start // SECONDS_PER_DAY
+            end = min(now, (day + 1) * SECONDS_PER_DAY)
+            if first_day <= day <= last_day:
+                stats = days.setdefault(day, {"day": day, "open_count": 0, "open_seconds": 0, "longest_open": 0})
+                stats["open_seconds"] += end - start
+                if end == now:
+                    stats["longest_open"] = max(stats["longest_open"], now - state["since"])
+            start = end
+
+    return [days[day] for day in sorted(days)], state
@@ -1,10 +1,19 @@
-import sys
 import logging
 import pymysql
-import json
 import os
 import uuid
+import time
 import datetime
+import collections
+from db import ConnectionManager
+from router import Router
+from inventory import record_changes
+from barcode_names import lookup_barcode_names
+from catalog import lookup_product
+from telemetry import record_env_readings
+from door_events import record_door_events
+from sensor_frame import CONTENT_TYPE as FRAME_CONTENT_TYPE, decode_frame
+from object_store import get_object_store, image_key, IMAGE_CONTENT_TYPE
 
 # rds settings
 user_name = os.environ['USER_NAME']
@@ -15,19 +24,64 @@ db_name = os.environ['DB_NAME']
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# create the database connection outside of the handler to allow connections to be
-# re-used by subsequent function invocations.
-try:
-    conn = pymysql.connect(host=rds_proxy_host, user=user_name, passwd=password, db=db_name, connect_timeout=5)
-except pymysql.MySQLError as e:
-    logger.error("ERROR: Unexpected error: Could not connect to MySQL instance.")
+# the database connection lives outside of the handler so it can be re-used by
+# subsequent function invocations; it is opened on first use and re-opened if the
+# proxy has dropped it.
+db = ConnectionManager(host=rds_proxy_host, user=user_name, password=password, db=db_name, connect_timeout=5)
+
+# Image store used to hand out presigned upload URLs
+store = get_object_store()
+
+# Presigned upload URLs are short lived; a device asks for a new one per capture
+UPLOAD_URL_EXPIRES = int(os.environ.get('UPLOAD_URL_EXPIRES', 300))
+MAX_UPLOAD_URLS = 20
+
+router = Router()
+
+@router.errorhandler(pymysql.OperationalError, pymysql.InterfaceError)
+def database_unavailable(e):
+    # The connection is unusable; drop it so the next invocation reconnects
     logger.error(e)
-    sys.exit(1)
+    db.reset()
+    return {"message": "Database unavailable"}, 500
+
+NO_IMAGE_URL = "https://fridgemate-images.s3.us-east-2.amazonaws.com/No_Image.png"
+BASE_IMAGE_URL = "https://fridgemate-images.s3.us-east-2.amazonaws.com/{}.jpg"
+
+def parse_item(item):
+    """
+    Validate one entry of the "items" array and return (barcode, image_url, expiration_date).
+    Raises ValueError with a message that is reported back for that item.
+    """
+    if not isinstance(item, dict):
+        raise ValueError("Item must be an object")
 
-logger.info("SUCCESS: Connection to RDS for MySQL instance succeeded")
+    barcode = item.get('barcode')
+    image_name = item.get('image_url')
+    expiration_date_str = item.get('expiration_date')
 
+    if not expiration_date_str:
+        raise ValueError("Missing expiration_date")
+
+    # Convert expiration_date string to a datetime object
+    try:
+        expiration_date = datetime.datetime.strptime(expiration_date_str, "%m/%d/%Y").date()
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid expiration_date {expiration_date_str!r}, expected MM/DD/YYYY")
+
+    if image_name and image_name != "Error":
+        image_url = BASE_IMAGE_URL.format(image_name)
+    else:
+        image_url = NO_IMAGE_URL
+
+    return barcode, image_url, expiration_date
+
+@router.route("add_data", schema={"fridge_id": str, "items": list})
 def add_data(data):
     """
+    All items are validated up front and the valid ones are written in a single
+    transaction; "results" reports the outcome of each item by its index. Items
+    named from the product catalog report that "name" and the product's "category".
     {
         "fridge_id": "fridge1",
         "items": [
@@ -44,164 +98,340 @@ def add_data(data):
         ]
     }
     """
-    
-    base_image_url = "https://fridgemate-images.s3.us-east-2.amazonaws.com/{}.jpg"
-    
     fridge_id = data.get('fridge_id')
     items = data.get('items', [])
 
-    with conn.cursor() as cur:
-        # Fetch barcode-name pairs from the saved_map table and store them in a dictionary
-        barcode_name_map = {}
-        cur.execute("SELECT barcode, name FROM saved_map WHERE fridge_id = %s", (fridge_id,))
-        rows = cur.fetchall()
-        for row in rows:
-            barcode_name_map[row[0]] = row[1]
-    
-        for item in items:
-            barcode = item.get('barcode')
-            image_name = item.get('image_url')
-            image_url = None
-            if image_name != "Error":
-                image_url = base_image_url.format(image_name)
-            else:
-                image_url = "https://fridgemate-images.s3.us-east-2.amazonaws.com/No_Image.png"
-            expiration_date_str = item.get('expiration_date')
-    
-            # Generate UUID for the item
-            item_uuid = str(uuid.uuid4())
-    
-            # Convert expiration_date string to a datetime object
-            expiration_date = datetime.datetime.strptime(expiration_date_str, "%m/%d/%Y").date()
-    
-            # Check if the barcode has a name in the barcode_name_map dictionary
-            name = barcode_name_map.get(barcode)
-    
-            # Add the item to the item_info table
-            cur.execute("INSERT INTO item_info (uuid, fridge_id, expiration_date, barcode, image_url, name) VALUES (%s, %s, %s, %s, %s, %s)",
-                              (item_uuid, fridge_id, expiration_date, barcode, image_url, name))
-            
-            conn.commit()
+    # Validate the whole batch before touching the database
+    results = [None] * len(items)
+    parsed = []
+    for index, item in enumerate(items):
+        try:
+            parsed.append((index, parse_item(item)))
+        except ValueError as e:
+            results[index] = {"index": index, "success": False, "message": str(e)}
+
+    if parsed:
+        conn = db.connection()
+        with conn.cursor() as cur:
+            # barcode -> name pairs of the fridge, from the container's cache when current
+            barcode_name_map = lookup_barcode_names(cur, fridge_id)
+
+            rows = []
+            for index, (barcode, image_url, expiration_date) in parsed:
+                # Generate UUID for the item
+                item_uuid = str(uuid.uuid4())
+
+                results[index] = {"index": index, "success": True, "uuid": item_uuid}
+
+                # Check if the barcode has a name in the barcode_name_map dictionary
+                name = barcode_name_map.get(barcode)
+                if name is None and barcode:
+                    # Fall back to the global product catalog; the fridge's own labels win
+                    product = lookup_product(barcode)
+                    if product is not None:
+                        name, category = product
+                        results[index].update(name=name, category=category)
+
+                rows.append((item_uuid, fridge_id, expiration_date, barcode, image_url, name))
+
+            # pymysql rewrites executemany of a plain INSERT ... VALUES into multi-row
+            # INSERT statements, so the whole basket costs one round trip and one commit
+            try:
+                cur.executemany("INSERT INTO item_info (uuid, fridge_id, expiration_date, barcode, image_url, name) VALUES (%s, %s, %s, %s, %s, %s)", rows)
+                record_changes(cur, fridge_id, upserted=[row[0] for row in rows])
+                conn.commit()
+            except pymysql.MySQLError as e:
+                conn.rollback()
+                logger.error(e)
+                for index, _ in parsed:
+                    results[index] = {"index": index, "success": False, "message": "Failed to insert item"}
+                return {"success": False, "message": "Failed to add items", "results": results}, 200
+
+    added = len(parsed)
+    if added < len(items):
+        return {"success": False, "message": f"Added {added} of {len(items)} items", "results": results}, 200
+
+    return {"success": True, "message": "Items added successfully", "results": results}, 200
 
-    return {"success": True, "message": "Items added successfully"}, 200
 
+def consume_items(cur, fridge_id, barcode_counts):
+    """
+    Delete the earliest-expiring units of each barcode in one transaction.
+    barcode_counts maps barcode -> number of units that left the fridge; returns
+    barcode -> list of deleted uuids (shorter than requested if the fridge ran out).
+    The lookups are range scans on idx_item_fridge_barcode_exp and the rows are
+    locked until commit, so two door cycles cannot consume the same unit.
+    """
+    consumed = {}
+    for barcode, count in barcode_counts.items():
+        cur.execute("SELECT uuid FROM item_info WHERE fridge_id = %s AND barcode = %s ORDER BY expiration_date, uuid LIMIT %s FOR UPDATE",
+                    (fridge_id, barcode, count))
+        consumed[barcode] = [row[0] for row in cur.fetchall()]
+
+    uuids = [item_uuid for item_uuids in consumed.values() for item_uuid in item_uuids]
+    if uuids:
+        cur.execute("DELETE FROM item_info WHERE uuid IN ({})".format(", ".join(["%s"] * len(uuids))), uuids)
+
+    return consumed
 
+@router.route("delete_data", schema={"fridge_id": str})
 def delete_data(data):
     """
+    Consumes the earliest-expiring unit of the barcode. Send "barcodes" instead of
+    "barcode" to consume several items that left the fridge in one door cycle;
+    repeat a barcode once per unit.
     {
         "fridge_id": "fridge1",
         "barcode": "1234567890"
     }
+    {
+        "fridge_id": "fridge1",
+        "barcodes": ["1234567890", "1234567890", "0987654321"]
+    }
     """
     fridge_id = data.get('fridge_id')
     barcode = data.get('barcode')
+    barcodes = data.get('barcodes')
+
+    # A null "barcodes" counts as left out
+    batch = barcodes is not None
+    if not batch:
+        barcodes = [barcode] if barcode is not None else []
 
+    if not barcodes:
+        return {"success": False, "message": "Missing barcode"}, 200
+
+    if not isinstance(barcodes, list) or not all(isinstance(code, str) for code in barcodes):
+        return {"success": False, "message": "barcode must be a string and barcodes a list of strings"}, 200
+
+    # Counter keeps first-seen order, so results come back in request order
+    barcode_counts = collections.Counter(barcodes)
+
+    conn = db.connection()
     with conn.cursor() as cur:
-        # Check if there's an item with the specified fridge_id and barcode
-        # cur.execute("SELECT uuid, MIN(expiration_date) FROM item_info WHERE fridge_id = %s AND barcode = %s", (fridge_id, barcode))
-        cur.execute("SELECT uuid, expiration_date FROM item_info WHERE fridge_id = %s AND barcode = %s AND expiration_date = (SELECT MIN(expiration_date) FROM item_info WHERE fridge_id = %s AND barcode = %s)", (fridge_id, barcode, fridge_id, barcode))
-        row = cur.fetchone()
-    
-    
-        if row == (None, None):
+        consumed = consume_items(cur, fridge_id, barcode_counts)
+
+        deleted = [item_uuid for item_uuids in consumed.values() for item_uuid in item_uuids]
+        if deleted:
+            record_changes(cur, fridge_id, deleted=deleted)
+
+        conn.commit()
+
+    if not batch:
+        if not consumed[barcode]:
             return {"success": False, "message": "No item found with the specified fridge_id and barcode"}, 200
-    
-        item_uuid, latest_expiration_date = row
-    
-        # Delete the row with the latest expiration date
-        cur.execute("DELETE FROM item_info WHERE uuid = %s", (item_uuid,))
-        
+
+        return {"success": True, "message": f"Item with barcode {barcode} deleted successfully"}, 200
+
+    results = [{"barcode": code, "requested": count, "consumed": len(consumed[code]), "uuids": consumed[code]}
+               for code, count in barcode_counts.items()]
+    missing = sum(count - len(consumed[code]) for code, count in barcode_counts.items())
+
+    if missing:
+        return {"success": False, "message": f"{missing} item(s) not found in fridge {fridge_id}", "results": results}, 200
+
+    return {"success": True, "message": "Items deleted successfully", "results": results}, 200
+
+@router.route("request_upload", schema={"fridge_id": str})
+def request_upload(data):
+    """
+    Presigned PUT URLs so the camera uploads images straight to the bucket
+    instead of through image_upload. The device PUTs the JPEG to "upload_url"
+    with the returned headers, then sends "file_name" as the item's "image_url"
+    in add_data, or calls link_image if the item was added first.
+    {
+        "fridge_id": "fridge1",
+        "count": 2
+    }
+    """
+    count = data.get('count', 1)
+    if not isinstance(count, int) or not 1 <= count <= MAX_UPLOAD_URLS:
+        return {"success": False, "message": f"count must be between 1 and {MAX_UPLOAD_URLS}"}, 400
+
+    uploads = []
+    for _ in range(count):
+        image_uuid = str(uuid.uuid4())
+        uploads.append({
+            "file_name": image_uuid,
+            "upload_url": store.presign_put(image_key(image_uuid), IMAGE_CONTENT_TYPE, UPLOAD_URL_EXPIRES),
+            "headers": {"Content-Type": IMAGE_CONTENT_TYPE},
+        })
+
+    return {"success": True, "expires_in": UPLOAD_URL_EXPIRES, "uploads": uploads}, 200
+
+@router.route("link_image", schema={"fridge_id": str, "uuid": str, "file_name": str})
+def link_image(data):
+    """
+    Completion hook for a presigned upload: point the item at the uploaded image
+    once the object exists.
+    {
+        "fridge_id": "fridge1",
+        "uuid": "<item uuid>",
+        "file_name": "<file_name from request_upload>"
+    }
+    """
+    fridge_id = data.get('fridge_id')
+    item_uuid = data.get('uuid')
+    file_name = data.get('file_name')
+
+    try:
+        uploaded = store.exists(image_key(file_name))
+    except ValueError:
+        uploaded = False
+    if not uploaded:
+        return {"success": False, "message": f"Image {file_name} has not been uploaded"}, 200
+
+    conn = db.connection()
+    with conn.cursor() as cur:
+        # rowcount of an UPDATE only counts changed rows, so check the item separately
+        cur.execute("SELECT uuid FROM item_info WHERE uuid = %s AND fridge_id = %s FOR UPDATE", (item_uuid, fridge_id))
+        if cur.fetchone() is None:
+            conn.rollback()
+            return {"success": False, "message": "No item found with the specified fridge_id and uuid"}, 200
+
+        cur.execute("UPDATE item_info SET image_url = %s WHERE uuid = %s", (BASE_IMAGE_URL.format(file_name), item_uuid))
+        record_changes(cur, fridge_id, upserted=[item_uuid])
         conn.commit()
 
-    return {"success": True, "message": f"Item with barcode {barcode} deleted successfully"}, 200
+    return {"success": True, "message": f"Item {item_uuid} linked to image {file_name}"}, 200
+
+# Upper bound on readings plus door events in one request
+MAX_BATCH = 1000
+
+def parse_timestamp(sample, now):
+    # "timestamp" is UTC epoch seconds and defaults to the time the request arrived
+    ts = sample.get('timestamp', now)
+    if not isinstance(ts, (int, float)) or ts <= 0 or ts > now + 300:
+        raise ValueError(f"Invalid timestamp {ts!r}")
+    return int(ts)
 
+def parse_readings(data, now):
+    """
+    [(ts, temperature, humidity)] from "readings", or from the request itself
+    when it carries a single "temperature"/"humidity" pair
+    """
+    readings = data['readings'] if 'readings' in data else [data]
+    if not isinstance(readings, list) or not readings:
+        raise ValueError("readings must be a non-empty list")
+
+    parsed = []
+    for reading in readings:
+        if not isinstance(reading, dict):
+            raise ValueError("Each reading must be an object")
+        temperature = reading.get('temperature')
+        humidity = reading.get('humidity')
+        if not isinstance(temperature, (int, float)) or not isinstance(humidity, (int, float)):
+            raise ValueError("temperature and humidity must be numbers")
+        parsed.append((parse_timestamp(reading, now), float(temperature), float(humidity)))
+    return parsed
+
+def parse_door_events(data, now):
+    """
+    [(ts, is_open)] from "events", or from the request itself when it carries
+    a single "value"; any nonzero value means open
+    """
+    events = data['events'] if 'events' in data else [data]
+    if not isinstance(events, list) or not events:
+        raise ValueError("events must be a non-empty list")
+
+    parsed = []
+    for event in events:
+        if not isinstance(event, dict) or not isinstance(event.get('value'), (int, float)):
+            raise ValueError(f"Invalid door event {event!r}")
+        parsed.append((parse_timestamp(event, now), event['value'] != 0))
+    return parsed
+
+@router.route("add_env_data", schema={"fridge_id": str})
 def add_env_data(data):
     """
+    Appends the reading to the fridge's environment history. Devices that
+    sample more often than they report can send "readings" instead, each with
+    its own "timestamp" (epoch seconds).
     {
         "fridge_id": "fridge1",
         "temperature": 33,
         "humidity": 15
     }
+    {
+        "fridge_id": "fridge1",
+        "readings": [
+            {"timestamp": 1760000000, "temperature": 33, "humidity": 15},
+            {"timestamp": 1760000060, "temperature": 34, "humidity": 15}
+        ]
+    }
     """
-    
-    fridge_id = data.get('fridge_id')
-    temperature = data.get('temperature')
-    humidity = data.get('humidity')
-    
-    with conn.cursor() as cur:
-        cur.execute(
-            """
-            INSERT INTO env_info (fridge_id, temperature, humidity)
-            VALUES (%s, %s, %s)
-            ON DUPLICATE KEY UPDATE temperature = VALUES(temperature), humidity = VALUES(humidity)
-            """, 
-        (fridge_id, temperature, humidity))
-   
-        conn.commit()
-    
-    return {"success": True, "message": f"Fridge: {fridge_id} updated with temperature: {temperature} and humidity: {humidity}"}, 200
+    return add_sensor_data({"fridge_id": data.get('fridge_id'), "readings": data.get('readings', [data])})
 
+@router.route("add_door_data", schema={"fridge_id": str})
 def add_door_data(data):
+    """
+    Records the door reading; any nonzero value means open. "timestamp" (epoch
+    seconds) defaults to the time the request arrived. Send "events" instead to
+    report several readings at once.
     {
         "fridge_id": "fridge1",
         "value": 0
     }
-    
+    {
+        "fridge_id": "fridge1",
+        "events": [
+            {"timestamp": 1760000000, "value": 1},
+            {"timestamp": 1760000042, "value": 0}
+        ]
+    }
+    """
+    return add_sensor_data({"fridge_id": data.get('fridge_id'), "events": data.get('events', [data])})
+
+@router.route("add_sensor_data", schema={"fridge_id": str},
+              decoders={FRAME_CONTENT_TYPE: decode_frame, "application/octet-stream": decode_frame})
+def add_sensor_data(data):
+    """
+    Write-behind ingestion: everything a device buffered since its last flush
+    (see device/sensor_buffer.py), environment readings and door events alike,
+    is written in one transaction with one commit. The newest reading and door
+    value are visible to get_env_data/get_door_data as soon as it commits.
+    Constrained uplinks can send the same content as a packed binary frame
+    (sensor_frame.py) with Content-Type application/x-fridge-frame.
+    {
+        "fridge_id": "fridge1",
+        "readings": [
+            {"timestamp": 1760000000, "temperature": 33, "humidity": 15}
+        ],
+        "events": [
+            {"timestamp": 1760000042, "value": 1}
+        ]
+    }
+    """
     fridge_id = data.get('fridge_id')
-    value = data.get('value')
+    now = int(time.time())
+
+    try:
+        readings = parse_readings(data, now) if data.get('readings') else []
+        events = parse_door_events(data, now) if data.get('events') else []
+    except ValueError as e:
+        return {"success": False, "message": str(e)}, 400
+
+    if not readings and not events:
+        return {"success": False, "message": "No readings or events"}, 400
+    if len(readings) + len(events) > MAX_BATCH:
+        return {"success": False, "message": f"At most {MAX_BATCH} readings and events per request"}, 400
     
+    conn = db.connection()
     with conn.cursor() as cur:
-        cur.execute(
-            """
-            INSERT INTO door_info (fridge_id, value)
-            VALUES (%s, %s)
-            ON DUPLICATE KEY UPDATE value = VALUES(value)
-            """, 
-        (fridge_id, value))
-   
+        record_env_readings(cur, fridge_id, readings)
+        transitions = record_door_events(cur, fridge_id, events)
         conn.commit()
-    
-    return {"success": True, "message": f"Fridge: {fridge_id} updated with door value: {value}"}, 200
-    
 
-def generate_response(body, status):
-    response = {
-        'statusCode': status,
-        'body': json.dumps(body),
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*'
-        },
-    }
-    return response
+    response = {"success": True, "message": f"Fridge: {fridge_id} updated", "readings": len(readings), "events": len(events), "transitions": transitions}
+    if readings:
+        _, temperature, humidity = max(readings)
+        response["message"] += f" with temperature: {temperature} and humidity: {humidity}"
+    if events:
+        response["message"] += f" with door value: {int(max(events)[1])}"
+    return response, 200
 
 def lambda_handler(event, context):
     """
-    This function creates a new RDS database table and writes records to it
+    Entry point for the hardware API; requests are dispatched by the last segment of the path
     """
-
-    # with conn.cursor() as cur:
-    #     cur.execute("create table if not exists Inventory ( UUID varchar(255) NOT NULL, Barcode varchar(255) NOT NULL, Name varchar(255), FridgeID varchar(255) NOT NULL, Image varchar(255) NOT NULL, ExpiryDate DATE NOT NULL, PRIMARY KEY (UUID) )")
-    #     cur.execute("create table if not exists SavedNames ( Barcode varchar(255) NOT NULL, Name varchar(255) NOT NULL, FridgeID varchar(255) NOT NULL, PRIMARY KEY (Barcode) )")
-    #     cur.execute("create table if not exists UsersMap ( UserID varchar(255) NOT NULL, FridgeID varchar(255) NOT NULL, PRIMARY KEY (UserID) )")
-    #     conn.commit()
-    # conn.commit()
-    
-    path = event["path"].split('/')[-1]
-    body = json.loads(event["body"])
-    
-    return_body = None
-    return_status = None
-    if path == "add_data":
-        return_body, return_status = add_data(body)
-    elif path == "delete_data":
-        return_body, return_status = delete_data(body)
-    elif path == "add_env_data":
-        return_body, return_status = add_env_data(body)
-    elif path == "add_door_data":
-        return_body, return_status = add_door_data(body)
-    else:
-        return_body, return_status = {"message": "Invalid path"}, 500 
-    
-    return generate_response(return_body, return_status)
-    
\ No newline at end of file
+    return router.handle(event)
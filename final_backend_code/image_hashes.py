@@ -0,0 +1,87 @@
+import io
+import os
+import hashlib
+
+# Pillow is optional, as in thumbnails.py; without it only exact duplicates are found
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Two frames whose 64-bit difference hashes differ in at most this many bits are
+# treated as the same picture. Must stay below DHASH_BANDS so the band lookup
+# below cannot miss a match.
+DHASH_MAX_DISTANCE = int(os.environ.get('DHASH_MAX_DISTANCE', 3))
+DHASH_BANDS = 4
+
+def sha256_hex(data):
+    return hashlib.sha256(data).hexdigest()
+
+def dhash(data):
+    """
+    64-bit difference hash of the image as 16 hex digits, or None without Pillow
+    or for bytes Pillow cannot read. Each bit says whether a pixel of a 9x8
+    grayscale thumbnail is brighter than its right neighbour, so recompression,
+    small exposure changes and resizing leave the hash (nearly) unchanged.
+    """
+    if Image is None:
+        return None
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.draft("L", (64, 64))
+        pixels = list(image.convert("L").resize((9, 8), Image.LANCZOS).getdata())
+    except (OSError, ValueError):
+        return None
+
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return f"{value:016x}"
+
+def hamming(a, b):
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+def dhash_bands(value):
+    """
+    Split the hash into DHASH_BANDS 16-bit integers. Hashes within
+    DHASH_MAX_DISTANCE bits of each other share at least one band exactly
+    (pigeonhole), so candidates are found with indexed equality lookups.
+    """
+    if value is None:
+        return [None] * DHASH_BANDS
+    number = int(value, 16)
+    return [(number >> (16 * band)) & 0xFFFF for band in range(DHASH_BANDS)]
+
+def find_duplicate(cur, sha256, dhash_value, param="%s"):
+    """
+    uuid of an already stored image with the same content, or a perceptually
+    identical one, else None. param is the driver's placeholder ("%s" for
+    pymysql, "?" for sqlite3).
+    """
+    cur.execute(f"SELECT image_uuid FROM image_hashes WHERE sha256 = {param}", (sha256,))
+    row = cur.fetchone()
+    if row:
+        return row[0]
+
+    if dhash_value is None:
+        return None
+
+    bands = dhash_bands(dhash_value)
+    where = " OR ".join(f"band{band} = {param}" for band in range(DHASH_BANDS))
+    cur.execute(f"SELECT image_uuid, dhash FROM image_hashes WHERE {where}", bands)
+    best = None
+    for image_uuid, candidate in cur.fetchall():
+        distance = hamming(dhash_value, candidate)
+        if distance <= DHASH_MAX_DISTANCE and (best is None or distance < best[0]):
+            best = (distance, image_uuid)
+    return best[1] if best else None
+
+def record_image(cur, image_uuid, sha256, dhash_value, param="%s"):
+    """
+    Add a stored image to the hash index
+    """
+    placeholders = ", ".join([param] * (3 + DHASH_BANDS))
+    cur.execute(f"INSERT INTO image_hashes (image_uuid, sha256, dhash, band0, band1, band2, band3) VALUES ({placeholders})",
+                (image_uuid, sha256, dhash_value, *dhash_bands(dhash_value)))
@@ -1,44 +1,205 @@
+import os
 import json
 import base64
-import boto3
+import binascii
+import logging
 import uuid
+import pymysql
+
+from db import ConnectionManager
+from object_store import get_object_store, image_key, IMAGE_CONTENT_TYPE
+from router import generate_response
+from thumbnails import generate_thumbnails, record_thumbnails
+from image_hashes import sha256_hex, dhash, find_duplicate, record_image
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Created once per container and reused across invocations
+store = get_object_store()
+
+# The content hash index lives in RDS; without database settings images are
+# stored without deduplication
+if os.environ.get('RDS_PROXY_HOST'):
+    db = ConnectionManager(host=os.environ['RDS_PROXY_HOST'], user=os.environ['USER_NAME'],
+                           password=os.environ['PASSWORD'], db=os.environ['DB_NAME'], connect_timeout=5)
+else:
+    db = None
+
+def decode_legacy_content(content):
+    """
+    Old firmware sends base64 of the image's hex string
+    """
+    return bytes.fromhex(base64.b64decode(content).decode('utf-8'))
+
+def decode_body(event):
+    """
+    Image bytes from an API Gateway request body. Binary bodies arrive with
+    isBase64Encoded set and are decoded once; text bodies are plain base64.
+    """
+    body = event.get("body") or ""
+    if isinstance(body, bytes):
+        return body
+    return base64.b64decode(body, validate=not event.get("isBase64Encoded"))
+
+def mark_thumbnails(image_uuids):
+    """
+    Record thumbnails generate_thumbnails just wrote. Best effort, like the
+    deduplication: an image left unrecorded is served in full until the
+    backfill_thumbnails backfill finds it.
+    """
+    if db is None or not image_uuids:
+        return
+    try:
+        conn = db.connection()
+        with conn.cursor() as cur:
+            record_thumbnails(cur, list(image_uuids))
+        conn.commit()
+    except pymysql.MySQLError as e:
+        logger.error(e)
+        db.reset()
+
+def store_image(binary):
+    """
+    Store a capture and return (file_name, deduplicated). A frame identical to,
+    or perceptually indistinguishable from, an image already stored reuses that
+    image's file name and is not written again.
+    """
+    if db is None:
+        image_uuid = str(uuid.uuid4())
+        store.put(image_key(image_uuid), binary, IMAGE_CONTENT_TYPE)
+        generate_thumbnails(store, [image_uuid], originals={image_uuid: binary})
+        return image_uuid, False
+
+    sha256, dhash_value = sha256_hex(binary), dhash(binary)
+    try:
+        conn = db.connection()
+        with conn.cursor() as cur:
+            existing = find_duplicate(cur, sha256, dhash_value)
+            conn.commit()
+    except pymysql.MySQLError as e:
+        # Deduplication is an optimisation; never lose an upload over it
+        logger.error(e)
+        db.reset()
+        existing, conn = None, None
+
+    if existing is not None:
+        logger.info(f"Duplicate of {existing}, not stored")
+        return existing, True
 
-def lambda_handler(event, context):
-    # TODO implement
-    s3 = boto3.client("s3")
-
-    get_file_content = event["content"]
-    
-    print("file content")
-    print(get_file_content)
-    
-    decode_content = base64.b64decode(get_file_content)
-    print("decode content")
-    print(decode_content)
-    
-    hex_string = decode_content.decode('utf-8')
-    print("hex string")
-    print(hex_string)
-
-    binary = bytes.fromhex(hex_string)
-    print("binary")
-    print(binary)
-    
     image_uuid = str(uuid.uuid4())
-    # Specify the file extension/type if it's known, e.g., '.jpg' for JPEG images
-    file_extension = ".jpg"  # Adjust this based on the actual image type if necessary
-    
-    # Upload the decoded content to S3, using the UUID (and optional file extension) as the file name
-    s3_upload = s3.put_object(
-        Bucket="fridgemate-images", 
-        Key=f"{image_uuid}{file_extension}", 
-        ContentType='image/jpg',           # Set the MIME type for a PDF file
-        ContentDisposition='inline',             # Suggests to the browser to open rather than download
-        Body=binary
-    )
-
-    return {
-        'statusCode': 200,
-        'body': {'message': 'The Object is Uploaded successfully!', 'file_name': image_uuid}
+    store.put(image_key(image_uuid), binary, IMAGE_CONTENT_TYPE)
+    # The capture is already in memory, so render its thumbnails right away
+    mark_thumbnails(generate_thumbnails(store, [image_uuid], originals={image_uuid: binary}))
+
+    # Indexed only after the object exists, so a hit always points at a stored image
+    if conn is not None:
+        try:
+            with conn.cursor() as cur:
+                record_image(cur, image_uuid, sha256, dhash_value)
+            conn.commit()
+        except pymysql.IntegrityError:
+            # The same bytes were indexed by a concurrent upload
+            conn.rollback()
+        except pymysql.MySQLError as e:
+            logger.error(e)
+            db.reset()
+
+    return image_uuid, False
+
+def upload_image(event):
+    """
+    Single request upload; the body is the whole image.
+    Returns the file name the hardware sends as "image_url" in add_data.
+    """
+    binary = decode_body(event)
+    if not binary:
+        return {"success": False, "message": "Empty image"}, 400
+
+    image_uuid, deduplicated = store_image(binary)
+    logger.info(f"Uploaded {image_uuid} ({len(binary)} bytes)")
+    return {"success": True, "message": "The Object is Uploaded successfully!", "file_name": image_uuid, "deduplicated": deduplicated}, 200
+
+def start_upload(event, params):
+    """
+    Begin a chunked upload for a large capture; returns the file name and upload id
+    to pass to every following part/complete request. Chunked uploads are not
+    deduplicated on the way in; the dedupe_images backfill catches them.
+    """
+    image_uuid = str(uuid.uuid4())
+    upload_id = store.create_multipart(image_key(image_uuid), IMAGE_CONTENT_TYPE)
+    return {"success": True, "file_name": image_uuid, "upload_id": upload_id}, 200
+
+def upload_part(event, params):
+    """
+    Upload one chunk, numbered from 1 by the "part" query parameter. The body is
+    encoded as for a single request upload. Returns the part's ETag for complete.
+    """
+    binary = decode_body(event)
+    if not binary:
+        return {"success": False, "message": "Empty part"}, 400
+
+    part_number = int(params["part"])
+    etag = store.upload_part(image_key(params["file_name"]), params["upload_id"], part_number, binary)
+    return {"success": True, "part": part_number, "etag": etag}, 200
+
+def complete_upload(event, params):
+    """
+    Assemble the uploaded parts. The body lists them as JSON:
+    {
+        "parts": [[1, "<etag>"], [2, "<etag>"]]
     }
-    
\ No newline at end of file
+    """
+    parts = [(int(number), etag) for number, etag in json.loads(event.get("body") or "{}").get("parts", [])]
+    if not parts:
+        return {"success": False, "message": "No parts to complete"}, 400
+
+    store.complete_multipart(image_key(params["file_name"]), params["upload_id"], parts)
+    mark_thumbnails(generate_thumbnails(store, [params["file_name"]]))
+    logger.info(f"Completed chunked upload {params['file_name']} ({len(parts)} parts)")
+    return {"success": True, "message": "The Object is Uploaded successfully!", "file_name": params["file_name"]}, 200
+
+def abort_upload(event, params):
+    store.abort_multipart(image_key(params["file_name"]), params["upload_id"])
+    return {"success": True}, 200
+
+# Chunked upload steps, selected by the "upload" query parameter
+MULTIPART_ACTIONS = {
+    "start": (start_upload, ()),
+    "part": (upload_part, ("file_name", "upload_id", "part")),
+    "complete": (complete_upload, ("file_name", "upload_id")),
+    "abort": (abort_upload, ("file_name", "upload_id")),
+}
+
+def lambda_handler(event, context):
+    # Legacy firmware invokes the function directly with {"content": ...}
+    if "content" in event:
+        try:
+            binary = decode_legacy_content(event["content"])
+        except (binascii.Error, ValueError):
+            return {'statusCode': 400, 'body': {'message': 'Invalid image content'}}
+
+        image_uuid, _ = store_image(binary)
+        return {
+            'statusCode': 200,
+            'body': {'message': 'The Object is Uploaded successfully!', 'file_name': image_uuid}
+        }
+
+    params = event.get("queryStringParameters") or {}
+    try:
+        action = params.get("upload")
+        if action is None:
+            return generate_response(*upload_image(event))
+
+        if action not in MULTIPART_ACTIONS:
+            return generate_response({"success": False, "message": f"Invalid upload action: {action}"}, 400)
+
+        handler, required = MULTIPART_ACTIONS[action]
+        missing = [name for name in required if not params.get(name)]
+        if missing:
+            return generate_response({"success": False, "message": f"Missing required parameter: {missing[0]}"}, 400)
+        return generate_response(*handler(event, params))
+    except (binascii.Error, ValueError) as e:
+        return generate_response({"success": False, "message": str(e)}, 400)
+    except KeyError as e:
+        return generate_response({"success": False, "message": f"Unknown upload: {e}"}, 404)
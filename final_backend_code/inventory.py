@@ -0,0 +1,155 @@
+# Bookkeeping shared by every write to a fridge's inventory.
+# Helpers take an open cursor and run inside the caller's transaction, so the
+# bookkeeping commits or rolls back together with the write it describes. They
+# default to MySQL placeholders; the local SQLite server passes param="?".
+
+# The version upsert is the one statement whose syntax differs between the two
+VERSION_UPSERT = {
+    "%s": "ON DUPLICATE KEY UPDATE version = version + 1",
+    "?": "ON CONFLICT (fridge_id) DO UPDATE SET version = version + 1",
+}
+
+def bump_version(cur, fridge_id, param="%s"):
+    """
+    Advance the fridge's inventory version; called by every write to item_info
+    """
+    cur.execute(f"""
+        INSERT INTO fridge_version (fridge_id, version)
+        VALUES ({param}, 1)
+        {VERSION_UPSERT[param]}
+    """, (fridge_id,))
+
+def get_version(cur, fridge_id, param="%s"):
+    """
+    Current inventory version of the fridge, 0 if it was never written
+    """
+    cur.execute(f"SELECT version FROM fridge_version WHERE fridge_id = {param}", (fridge_id,))
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+def get_labels_version(cur, fridge_id, param="%s"):
+    """
+    Version of the fridge's saved_map, 0 if it was never written
+    """
+    cur.execute(f"SELECT labels_version FROM fridge_version WHERE fridge_id = {param}", (fridge_id,))
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+def bump_labels_version(cur, fridge_id, param="%s"):
+    """
+    Advance the fridge's labels_version after a write to its saved_map; call after
+    record_changes, which creates the fridge_version row
+    """
+    cur.execute(f"UPDATE fridge_version SET labels_version = labels_version + 1 WHERE fridge_id = {param}", (fridge_id,))
+
+def make_etag(fridge_id, version):
+    return f'"{fridge_id}:{version}"'
+
+def record_changes(cur, fridge_id, upserted=(), deleted=(), barcode=None, param="%s"):
+    """
+    Bump the fridge's version and append the touched item uuids to item_changes
+    for delta sync. barcode marks every item of the fridge with that barcode as
+    updated (used by the fridge-wide renames). Call after the item writes: the
+    version bump locks the fridge_version row until commit, so change sequence
+    numbers of one fridge are handed out in commit order and a sync cursor can
+    never skip past a change that commits later.
+    """
+    bump_version(cur, fridge_id, param)
+
+    rows = [(fridge_id, item_uuid, False) for item_uuid in upserted]
+    rows += [(fridge_id, item_uuid, True) for item_uuid in deleted]
+    if rows:
+        cur.executemany(f"INSERT INTO item_changes (fridge_id, uuid, deleted) VALUES ({param}, {param}, {param})", rows)
+
+    if barcode is not None:
+        cur.execute(f"""
+            INSERT INTO item_changes (fridge_id, uuid, deleted)
+            SELECT fridge_id, uuid, FALSE FROM item_info
+            WHERE fridge_id = {param} AND barcode = {param}
+        """, (fridge_id, barcode))
+
+def get_cursor(cur, fridge_id, param="%s"):
+    """
+    Sequence number of the fridge's latest change, the starting point for get_changes
+    """
+    cur.execute(f"SELECT MAX(seq) FROM item_changes WHERE fridge_id = {param}", (fridge_id,))
+    row = cur.fetchone()
+    return (row[0] or 0) if row else 0
+
+def read_changes(cur, fridge_id, cursor, limit, param="%s"):
+    """
+    Collapse up to limit changes after cursor into (cursor, has_more, rows, deleted):
+    the current item_info rows of items inserted or updated since, and the uuids
+    of items deleted since. rows are (uuid, expiration_date, name, barcode, image_url).
+    """
+    cur.execute(f"SELECT seq, uuid, deleted FROM item_changes WHERE fridge_id = {param} AND seq > {param} ORDER BY seq LIMIT {param}",
+                (fridge_id, cursor, limit + 1))
+    changes = cur.fetchall()
+
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    if not changes:
+        return cursor, False, [], []
+
+    # Only the latest change of each item matters
+    latest = {}
+    for seq, item_uuid, is_deleted in changes:
+        latest[item_uuid] = bool(is_deleted)
+
+    upserted = [item_uuid for item_uuid, is_deleted in latest.items() if not is_deleted]
+    deleted = [item_uuid for item_uuid, is_deleted in latest.items() if is_deleted]
+
+    rows = []
+    if upserted:
+        cur.execute(f"SELECT uuid, expiration_date, name, barcode, image_url FROM item_info WHERE fridge_id = {param} AND uuid IN ({', '.join([param] * len(upserted))})",
+                    [fridge_id] + upserted)
+        rows = cur.fetchall()
+
+        # An item updated and then deleted by a change past this page is gone already
+        found = {row[0] for row in rows}
+        deleted += [item_uuid for item_uuid in upserted if item_uuid not in found]
+
+    return changes[-1][0], has_more, rows, deleted
+
+def run_batch(cur, statements):
+    """
+    Send (sql, params) statements to the server as one multi-statement query,
+    a single round trip however many statements there are. The connection must
+    be opened with CLIENT.MULTI_STATEMENTS, which has RDS Proxy pin it (see
+    app_lambda.relabel_db). Returns the rows of the last result set.
+    """
+    cur.execute(";\n".join(cur.mogrify(sql, params) for sql, params in statements))
+    rows = cur.fetchall()
+    while cur.nextset():
+        rows = cur.fetchall()
+    return rows
+
+def record_changes_if_ok(fridge_id, upserted=(), barcode=None):
+    """
+    record_changes as run_batch statements that only take effect when the
+    batch has set @ok = 1; list them after the item writes for the same reason
+    """
+    statements = [("""
+        INSERT INTO fridge_version (fridge_id, version)
+        SELECT %s, 1 FROM DUAL WHERE @ok = 1
+        ON DUPLICATE KEY UPDATE version = version + 1
+    """, (fridge_id,))]
+
+    statements += [("INSERT INTO item_changes (fridge_id, uuid, deleted) SELECT %s, %s, FALSE FROM DUAL WHERE @ok = 1",
+                    (fridge_id, item_uuid)) for item_uuid in upserted]
+
+    if barcode is not None:
+        statements.append(("""
+            INSERT INTO item_changes (fridge_id, uuid, deleted)
+            SELECT fridge_id, uuid, FALSE FROM item_info
+            WHERE fridge_id = %s AND barcode = %s AND @ok = 1
+        """, (fridge_id, barcode)))
+
+    return statements
+
+def bump_labels_version_if_ok(fridge_id):
+    """
+    run_batch statement advancing the fridge's labels_version when @ok = 1; list
+    it after record_changes_if_ok, which creates the fridge_version row
+    """
+    return ("UPDATE fridge_version SET labels_version = labels_version + 1 WHERE fridge_id = %s AND @ok = 1", (fridge_id,))
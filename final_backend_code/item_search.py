@@ -0,0 +1,45 @@
+import re
+
+# Full-text search over item names. MySQL serves it from a FULLTEXT index built
+# with the ngram parser, so a word matches anywhere inside a name ("chees" finds
+# "Mac and cheese"); the local SQLite database uses an FTS5 table that triggers
+# keep in step with item_info, where each word is a prefix query. Both indexes
+# are maintained by the database on every write to item_info.
+
+SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
+# Longer queries are cut to their first words
+MAX_SEARCH_TERMS = 8
+
+# SQLite ranks only the newest matches of a fridge. Every match of an AND query
+# holds all the terms once or so, which leaves bm25 ranking mostly by name length;
+# ordering by length directly skips the per-row scoring that dominates on large
+# fridges, and the cap bounds the work when a common word matches most of them.
+MAX_RANKED_MATCHES = 1000
+
+def search_terms(query):
+    """
+    Lowercased words of a search query; punctuation and search operators are dropped
+    """
+    return re.findall(r"\w+", (query or "").lower())[:MAX_SEARCH_TERMS]
+
+def boolean_query(terms):
+    """
+    MySQL boolean-mode query requiring every term
+    """
+    return " ".join(f'+"{term}"' for term in terms)
+
+def like_patterns(terms):
+    """
+    LIKE patterns matching names that contain each term; terms are word
+    characters, of which only "_" is special to LIKE
+    """
+    return ["%" + term.replace("_", "\\_") + "%" for term in terms]
+
+def fts5_query(fridge_id, terms):
+    """
+    FTS5 query for names with a word starting with each term, in one fridge
+    """
+    fridge_id = str(fridge_id).replace('"', '""')
+    return " AND ".join([f'fridge_id : "{fridge_id}"'] + [f'name : "{term}"*' for term in terms])
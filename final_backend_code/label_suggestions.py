@@ -0,0 +1,89 @@
+# Cross-fridge label suggestions.
+# Every name a fridge gives a barcode is counted in label_sketch, a Space-Saving
+# summary per barcode: at most SKETCH_SIZE (name, count, error) slots. A name
+# that has a slot is incremented; otherwise it takes a free slot, or replaces
+# the slot with the lowest count and inherits that count as its error. Any name
+# given to more than 1/SKETCH_SIZE of a barcode's labelings is guaranteed a slot
+# and its count is overestimated by at most its error. Updating is a constant
+# number of statements and reading a barcode's suggestions is a primary key
+# range of at most SKETCH_SIZE rows, however many fridges there are.
+
+SKETCH_SIZE = 8
+MAX_SUGGESTIONS = 3
+
+def count_label_if_ok(barcode, name):
+    """
+    run_batch statements (MySQL) counting name for barcode when the batch has
+    set @ok = 1. @counted tracks whether an earlier step already counted it.
+    """
+    return [
+        ("UPDATE label_sketch SET count = count + 1 WHERE barcode = %s AND name = %s AND @ok = 1", (barcode, name)),
+        ("SET @counted = ROW_COUNT()", None),
+        # Slots are never removed, so the next free slot is the number of slots in use.
+        # IGNORE: a concurrent labeling may have just taken that slot; losing one count is fine
+        ("""
+            INSERT IGNORE INTO label_sketch (barcode, slot, name, count, error)
+            SELECT %s, COUNT(*), %s, 1, 0 FROM label_sketch WHERE barcode = %s
+            HAVING COUNT(*) < %s AND @ok = 1 AND @counted = 0
+        """, (barcode, name, barcode, SKETCH_SIZE)),
+        ("SET @counted = @counted + ROW_COUNT()", None),
+        # Only a full sketch gives up a slot: after a lost race for a free slot the
+        # count is dropped rather than evicting another name's. MySQL cannot read
+        # label_sketch in a subquery of the UPDATE below, hence the variable
+        ("SET @full = (SELECT COUNT(*) FROM label_sketch WHERE barcode = %s) >= %s", (barcode, SKETCH_SIZE)),
+        # MySQL assigns left to right, so error takes the replaced count
+        ("""
+            UPDATE label_sketch SET name = %s, error = count, count = count + 1
+            WHERE barcode = %s AND @ok = 1 AND @counted = 0 AND @full = 1
+            ORDER BY count, slot LIMIT 1
+        """, (name, barcode)),
+    ]
+
+def count_label(cur, barcode, name, param="%s"):
+    """
+    Count name for barcode with one read and one write, in the caller's transaction.
+    Used by the local SQLite server, whose UPDATE has no ORDER BY ... LIMIT.
+    """
+    cur.execute(f"SELECT slot, name, count FROM label_sketch WHERE barcode = {param}", (barcode,))
+    slots = cur.fetchall()
+
+    for slot, slot_name, count in slots:
+        if slot_name == name:
+            cur.execute(f"UPDATE label_sketch SET count = count + 1 WHERE barcode = {param} AND slot = {param}", (barcode, slot))
+            return
+
+    if len(slots) < SKETCH_SIZE:
+        cur.execute(f"INSERT INTO label_sketch (barcode, slot, name, count, error) VALUES ({param}, {param}, {param}, 1, 0)",
+                    (barcode, len(slots), name))
+        return
+
+    slot = min(slots, key=lambda row: (row[2], row[0]))[0]
+    cur.execute(f"UPDATE label_sketch SET name = {param}, error = count, count = count + 1 WHERE barcode = {param} AND slot = {param}",
+                (name, barcode, slot))
+
+def read_suggestions(cur, barcodes, param="%s"):
+    """
+    barcode -> up to MAX_SUGGESTIONS names, most often given first
+    """
+    barcodes = list(barcodes)
+    if not barcodes:
+        return {}
+
+    cur.execute(f"SELECT barcode, name, count, error FROM label_sketch WHERE barcode IN ({', '.join([param] * len(barcodes))})",
+                barcodes)
+
+    # Ties go to the name whose count is the more certain
+    suggestions = {}
+    for barcode, name, count, error in sorted(cur.fetchall(), key=lambda row: (-row[2], row[3])):
+        names = suggestions.setdefault(barcode, [])
+        if len(names) < MAX_SUGGESTIONS and name not in names:
+            names.append(name)
+    return suggestions
+
+def add_suggestions(cur, unlabeled_items, param="%s"):
+    """
+    Set "suggestions" on each unlabeled item from one read for all of their barcodes
+    """
+    suggestions = read_suggestions(cur, {item["barcode"] for item in unlabeled_items if item["barcode"]}, param)
+    for item in unlabeled_items:
+        item["suggestions"] = suggestions.get(item["barcode"], [])
@@ -0,0 +1,451 @@
+import logging
+
+logger = logging.getLogger()
+
+# Ordered up-migrations shared by the RDS (MySQL) schema and the local SQLite
+# simulation. Each entry is (version, description, {dialect: [statements]}).
+# Never edit a migration once it has been applied anywhere; append a new one.
+MIGRATIONS = [
+    (1, "Create base tables", {
+        "mysql": [
+            '''CREATE TABLE IF NOT EXISTS item_info (
+                    uuid VARCHAR(255) PRIMARY KEY,
+                    fridge_id TEXT NOT NULL,
+                    expiration_date DATE NOT NULL,
+                    barcode TEXT,
+                    image_url TEXT,
+                    name TEXT
+                )''',
+            '''CREATE TABLE IF NOT EXISTS user_map (
+                    user_id VARCHAR(255) PRIMARY KEY,
+                    fridge_id TEXT NOT NULL
+                )''',
+            '''CREATE TABLE IF NOT EXISTS saved_map (
+                    barcode VARCHAR(255) PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    fridge_id TEXT NOT NULL
+                )''',
+            '''CREATE TABLE IF NOT EXISTS env_info (
+                    fridge_id VARCHAR(255) PRIMARY KEY,
+                    temperature FLOAT NOT NULL,
+                    humidity FLOAT NOT NULL
+                )''',
+            '''CREATE TABLE IF NOT EXISTS door_info (
+                    fridge_id VARCHAR(255) PRIMARY KEY,
+                    value INT NOT NULL
+                )''',
+        ],
+        "sqlite": [
+            '''CREATE TABLE IF NOT EXISTS item_info (
+                    uuid TEXT PRIMARY KEY,
+                    fridge_id INTEGER NOT NULL,
+                    expiration_date DATE NOT NULL,
+                    barcode TEXT,
+                    image_url TEXT,
+                    name TEXT
+                )''',
+            '''CREATE TABLE IF NOT EXISTS user_map (
+                    user_id TEXT PRIMARY KEY,
+                    fridge_id INTEGER NOT NULL
+                )''',
+            '''CREATE TABLE IF NOT EXISTS saved_map (
+                    barcode TEXT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    fridge_id INTEGER NOT NULL
+                )''',
+        ],
+    }),
+    (2, "Use VARCHAR keys and index item lookups by fridge", {
+        "mysql": [
+            "ALTER TABLE item_info MODIFY fridge_id VARCHAR(255) NOT NULL, MODIFY barcode VARCHAR(255), MODIFY name VARCHAR(255)",
+            "ALTER TABLE user_map MODIFY fridge_id VARCHAR(255) NOT NULL",
+            "ALTER TABLE saved_map MODIFY fridge_id VARCHAR(255) NOT NULL, MODIFY name VARCHAR(255) NOT NULL",
+            "CREATE INDEX idx_item_fridge_barcode_exp ON item_info (fridge_id, barcode, expiration_date)",
+            "CREATE INDEX idx_item_fridge_name ON item_info (fridge_id, name)",
+            "CREATE INDEX idx_saved_map_fridge ON saved_map (fridge_id)",
+        ],
+        "sqlite": [
+            # SQLite ignores declared lengths, so only the indexes are needed here
+            "CREATE INDEX IF NOT EXISTS idx_item_fridge_barcode_exp ON item_info (fridge_id, barcode, expiration_date)",
+            "CREATE INDEX IF NOT EXISTS idx_item_fridge_name ON item_info (fridge_id, name)",
+            "CREATE INDEX IF NOT EXISTS idx_saved_map_fridge ON saved_map (fridge_id)",
+        ],
+    }),
+    (3, "Track a per-fridge inventory version", {
+        "mysql": [
+            '''CREATE TABLE IF NOT EXISTS fridge_version (
+                    fridge_id VARCHAR(255) PRIMARY KEY,
+                    version BIGINT NOT NULL DEFAULT 0
+                )''',
+        ],
+        "sqlite": [
+            '''CREATE TABLE IF NOT EXISTS fridge_version (
+                    fridge_id TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL DEFAULT 0
+                )''',
+        ],
+    }),
+    (4, "Log item changes for delta sync", {
+        "mysql": [
+            '''CREATE TABLE IF NOT EXISTS item_changes (
+                    seq BIGINT AUTO_INCREMENT PRIMARY KEY,
+                    fridge_id VARCHAR(255) NOT NULL,
+                    uuid VARCHAR(255) NOT NULL,
+                    deleted BOOLEAN NOT NULL DEFAULT FALSE,
+                    INDEX idx_changes_fridge_seq (fridge_id, seq)
+                )''',
+        ],
+        "sqlite": [
+            '''CREATE TABLE IF NOT EXISTS item_changes (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    fridge_id TEXT NOT NULL,
+                    uuid TEXT NOT NULL,
+                    deleted BOOLEAN NOT NULL DEFAULT FALSE
+                )''',
+            "CREATE INDEX IF NOT EXISTS idx_changes_fridge_seq ON item_changes (fridge_id, seq)",
+        ],
+    }),
+    (5, "Index uploaded images by content hash", {
+        "mysql": [
+            '''CREATE TABLE IF NOT EXISTS image_hashes (
+                    image_uuid VARCHAR(255) PRIMARY KEY,
+                    sha256 CHAR(64) NOT NULL,
+                    dhash CHAR(16),
+                    band0 INT,
+                    band1 INT,
+                    band2 INT,
+                    band3 INT,
+                    UNIQUE INDEX idx_image_hashes_sha256 (sha256),
+                    INDEX idx_image_hashes_band0 (band0),
+                    INDEX idx_image_hashes_band1 (band1),
+                    INDEX idx_image_hashes_band2 (band2),
+                    INDEX idx_image_hashes_band3 (band3)
+                )''',
+        ],
+        "sqlite": [
+            '''CREATE TABLE IF NOT EXISTS image_hashes (
+                    image_uuid TEXT PRIMARY KEY,
+                    sha256 TEXT NOT NULL,
+                    dhash TEXT,
+                    band0 INTEGER,
+                    band1 INTEGER,
+                    band2 INTEGER,
+                    band3 INTEGER
+                )''',
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_image_hashes_sha256 ON image_hashes (sha256)",
+            "CREATE INDEX IF NOT EXISTS idx_image_hashes_band0 ON image_hashes (band0)",
+            "CREATE INDEX IF NOT EXISTS idx_image_hashes_band1 ON image_hashes (band1)",
+            "CREATE INDEX IF NOT EXISTS idx_image_hashes_band2 ON image_hashes (band2)",
+            "CREATE INDEX IF NOT EXISTS idx_image_hashes_band3 ON image_hashes (band3)",
+        ],
+    }),
+    (6, "Index items by fridge and uuid for keyset exports", {
+        "mysql": [
+            "CREATE INDEX idx_item_fridge_uuid ON item_info (fridge_id, uuid)",
+        ],
+        "sqlite": [
+            "CREATE INDEX IF NOT EXISTS idx_item_fridge_uuid ON item_info (fridge_id, uuid)",
+        ],
+    }),
+    (7, "Keep environment readings and their rollups", {
+        "mysql": [
+            '''CREATE TABLE IF NOT EXISTS env_readings (
+                    fridge_id VARCHAR(255) NOT NULL,
+                    ts INT UNSIGNED NOT NULL,
+                    temperature FLOAT NOT NULL,
+                    humidity FLOAT NOT NULL,
+                    PRIMARY KEY (fridge_id, ts)
+                )''',
+            '''CREATE TABLE IF NOT EXISTS env_rollups (
+                    fridge_id VARCHAR(255) NOT NULL,
+                    resolution INT UNSIGNED NOT NULL,
+                    bucket INT UNSIGNED NOT NULL,
+                    count INT UNSIGNED NOT NULL,
+                    temperature_sum DOUBLE NOT NULL,
+                    temperature_min FLOAT NOT NULL,
+                    temperature_max FLOAT NOT NULL,
+                    humidity_sum DOUBLE NOT NULL,
+                    humidity_min FLOAT NOT NULL,
+                    humidity_max FLOAT NOT NULL,
+                    PRIMARY KEY (fridge_id, resolution, bucket)
+                )''',
+        ],
+        "sqlite": [
+            '''CREATE TABLE IF NOT EXISTS env_readings (
+                    fridge_id TEXT NOT NULL,
+                    ts INTEGER NOT NULL,
+                    temperature REAL NOT NULL,
+                    humidity REAL NOT NULL,
+                    PRIMARY KEY (fridge_id, ts)
+                ) WITHOUT ROWID''',
+            '''CREATE TABLE IF NOT EXISTS env_rollups (
+                    fridge_id TEXT NOT NULL,
+                    resolution INTEGER NOT NULL,
+                    bucket INTEGER NOT NULL,
+                    count INTEGER NOT NULL,
+                    temperature_sum REAL NOT NULL,
+                    temperature_min REAL NOT NULL,
+                    temperature_max REAL NOT NULL,
+                    humidity_sum REAL NOT NULL,
+                    humidity_min REAL NOT NULL,
+                    humidity_max REAL NOT NULL,
+                    PRIMARY KEY (fridge_id, resolution, bucket)
+                ) WITHOUT ROWID''',
+        ],
+    }),
+    (8, "Log door transitions and keep daily door aggregates", {
+        "mysql": [
+            '''CREATE TABLE IF NOT EXISTS door_events (
+                    seq BIGINT AUTO_INCREMENT PRIMARY KEY,
+                    fridge_id VARCHAR(255) NOT NULL,
+                    ts INT UNSIGNED NOT NULL,
+                    is_open BOOLEAN NOT NULL,
+                    INDEX idx_door_events_fridge_ts (fridge_id, ts)
+                )''',
+            '''CREATE TABLE IF NOT EXISTS door_state (
+                    fridge_id VARCHAR(255) PRIMARY KEY,
+                    is_open BOOLEAN NOT NULL,
+                    changed_at INT UNSIGNED NOT NULL
+                )''',
+            '''CREATE TABLE IF NOT EXISTS door_daily (
+                    fridge_id VARCHAR(255) NOT NULL,
+                    day INT UNSIGNED NOT NULL,
+                    open_count INT UNSIGNED NOT NULL DEFAULT 0,
+                    open_seconds INT UNSIGNED NOT NULL DEFAULT 0,
+                    longest_open INT UNSIGNED NOT NULL DEFAULT 0,
+                    PRIMARY KEY (fridge_id, day)
+                )''',
+        ],
+        "sqlite": [
+            '''CREATE TABLE IF NOT EXISTS door_events (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    fridge_id TEXT NOT NULL,
+                    ts INTEGER NOT NULL,
+                    is_open BOOLEAN NOT NULL
+                )''',
+            "CREATE INDEX IF NOT EXISTS idx_door_events_fridge_ts ON door_events (fridge_id, ts)",
+            '''CREATE TABLE IF NOT EXISTS door_state (
+                    fridge_id TEXT PRIMARY KEY,
+                    is_open BOOLEAN NOT NULL,
+                    changed_at INTEGER NOT NULL
+                )''',
+            '''CREATE TABLE IF NOT EXISTS door_daily (
+                    fridge_id TEXT NOT NULL,
+                    day INTEGER NOT NULL,
+                    open_count INTEGER NOT NULL DEFAULT 0,
+                    open_seconds INTEGER NOT NULL DEFAULT 0,
+                    longest_open INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (fridge_id, day)
+                ) WITHOUT ROWID''',
+        ],
+    }),
+    (9, "Index items by fridge and expiration date", {
+        "mysql": [
+            "CREATE INDEX idx_item_fridge_exp ON item_info (fridge_id, expiration_date, uuid)",
+        ],
+        "sqlite": [
+            "CREATE INDEX IF NOT EXISTS idx_item_fridge_exp ON item_info (fridge_id, expiration_date, uuid)",
+        ],
+    }),
+    (10, "Key saved_map by fridge and barcode, version each fridge's labels", {
+        "mysql": [
+            "ALTER TABLE saved_map MODIFY barcode VARCHAR(255) NOT NULL, DROP PRIMARY KEY, ADD PRIMARY KEY (fridge_id, barcode)",
+            # The primary key now starts with fridge_id
+            "DROP INDEX idx_saved_map_fridge ON saved_map",
+            # Bumped by every write to saved_map so warm hardware containers can tell
+            # whether their cached barcode -> name map is still current
+            "ALTER TABLE fridge_version ADD COLUMN labels_version BIGINT NOT NULL DEFAULT 0",
+        ],
+        "sqlite": [
+            # SQLite cannot change a primary key in place, so the table is rebuilt.
+            # The local server is one process and invalidates its cache directly.
+            '''CREATE TABLE saved_map_new (
+                    fridge_id INTEGER NOT NULL,
+                    barcode TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    PRIMARY KEY (fridge_id, barcode)
+                )''',
+            "INSERT INTO saved_map_new (fridge_id, barcode, name) SELECT fridge_id, barcode, name FROM saved_map WHERE barcode IS NOT NULL",
+            "DROP TABLE saved_map",
+            "ALTER TABLE saved_map_new RENAME TO saved_map",
+        ],
+    }),
+    (11, "Count the names given to each barcode across fridges", {
+        "mysql": [
+            '''CREATE TABLE IF NOT EXISTS label_sketch (
+                    barcode VARCHAR(255) NOT NULL,
+                    slot TINYINT UNSIGNED NOT NULL,
+                    name VARCHAR(255) NOT NULL,
+                    count INT UNSIGNED NOT NULL,
+                    error INT UNSIGNED NOT NULL,
+                    PRIMARY KEY (barcode, slot)
+                )''',
+        ],
+        "sqlite": [
+            '''CREATE TABLE IF NOT EXISTS label_sketch (
+                    barcode TEXT NOT NULL,
+                    slot INTEGER NOT NULL,
+                    name TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    error INTEGER NOT NULL,
+                    PRIMARY KEY (barcode, slot)
+                )''',
+        ],
+    }),
+    (12, "Index item names for full-text search", {
+        "mysql": [
+            "CREATE FULLTEXT INDEX ft_item_name ON item_info (name) WITH PARSER ngram",
+        ],
+        "sqlite": [
+            # External-content FTS5 table over item_info keyed by its rowid. VACUUM may
+            # renumber those rowids; run INSERT INTO item_search(item_search) VALUES ('rebuild') after one
+            '''CREATE VIRTUAL TABLE IF NOT EXISTS item_search USING fts5(
+                    name, fridge_id,
+                    content = 'item_info', content_rowid = 'rowid',
+                    tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3 4 5 6'
+                )''',
+            '''CREATE TRIGGER IF NOT EXISTS item_search_insert AFTER INSERT ON item_info BEGIN
+                    INSERT INTO item_search (rowid, name, fridge_id) VALUES (new.rowid, new.name, new.fridge_id);
+                END''',
+            '''CREATE TRIGGER IF NOT EXISTS item_search_delete AFTER DELETE ON item_info BEGIN
+                    INSERT INTO item_search (item_search, rowid, name, fridge_id) VALUES ('delete', old.rowid, old.name, old.fridge_id);
+                END''',
+            '''CREATE TRIGGER IF NOT EXISTS item_search_update AFTER UPDATE OF name, fridge_id ON item_info BEGIN
+                    INSERT INTO item_search (item_search, rowid, name, fridge_id) VALUES ('delete', old.rowid, old.name, old.fridge_id);
+                    INSERT INTO item_search (rowid, name, fridge_id) VALUES (new.rowid, new.name, new.fridge_id);
+                END''',
+            "INSERT INTO item_search (item_search) VALUES ('rebuild')",
+        ],
+    }),
+    (13, "Version saved_map in the local database too", {
+        # MySQL has had labels_version since migration 10
+        "mysql": [],
+        "sqlite": [
+            # The local server shares the labels_version-checked barcode name cache of the hardware lambda
+            "ALTER TABLE fridge_version ADD COLUMN labels_version INTEGER NOT NULL DEFAULT 0",
+        ],
+    }),
+    (14, "Record which item images have thumbnails", {
+        # Keyed by the image_url items point at; thumbnail_url serves the original until a row exists
+        "mysql": [
+            '''CREATE TABLE IF NOT EXISTS image_thumbnails (
+                    image_url VARCHAR(255) PRIMARY KEY
+                )''',
+        ],
+        "sqlite": [
+            '''CREATE TABLE IF NOT EXISTS image_thumbnails (
+                    image_url TEXT PRIMARY KEY
+                )''',
+        ],
+    }),
+    (15, "Keep the time of the reading env_info holds", {
+        # NULL until the fridge's next batch of readings
+        "mysql": [
+            "ALTER TABLE env_info ADD COLUMN ts INT UNSIGNED NULL",
+        ],
+        # env_info is only kept in MySQL
+        "sqlite": [],
+    }),
+    (16, "Keep the time of the reading door_info holds", {
+        # NULL until the fridge's next door reading
+        "mysql": [
+            "ALTER TABLE door_info ADD COLUMN ts INT UNSIGNED NULL",
+        ],
+        # door_info is only kept in MySQL
+        "sqlite": [],
+    }),
+    (17, "Index item names without stopwords", {
+        # Migration 12 built the index with the default stopword list, and the ngram
+        # parser leaves out every bigram containing a stopword such as "a" or "i", so
+        # "milk" was indexed as "lk" alone. The setting is read when the index is
+        # built; queries read it too, so the server's parameter group also needs
+        # innodb_ft_enable_stopword = OFF (search_items re-checks matches with LIKE
+        # until it does).
+        "mysql": [
+            "SET SESSION innodb_ft_enable_stopword = OFF",
+            "DROP INDEX ft_item_name ON item_info",
+            "CREATE FULLTEXT INDEX ft_item_name ON item_info (name) WITH PARSER ngram",
+        ],
+        # FTS5 has no stopwords
+        "sqlite": [],
+    }),
+]
+
+SCHEMA_VERSION_TABLE = {
+    "mysql": '''CREATE TABLE IF NOT EXISTS schema_version (
+                    version INT PRIMARY KEY,
+                    description VARCHAR(255) NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )''',
+    "sqlite": '''CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )''',
+}
+
+PARAMSTYLE = {"mysql": "%s", "sqlite": "?"}
+
+# MySQL DDL is not transactional, so a migration interrupted half way is re-run
+# statement by statement; these errors mean the statement already took effect.
+# 1050: table exists, 1060: duplicate column, 1061: duplicate key name,
+# 1091: dropped key does not exist
+ALREADY_APPLIED_ERRORS = {"mysql": (1050, 1060, 1061, 1091), "sqlite": ()}
+
+def current_version(conn, dialect):
+    """
+    Return the highest applied migration version, creating schema_version if needed.
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute(SCHEMA_VERSION_TABLE[dialect])
+        cur.execute("SELECT MAX(version) FROM schema_version")
+        row = cur.fetchone()
+    finally:
+        cur.close()
+    conn.commit()
+
+    return (row[0] or 0) if row else 0
+
+def run_migrations(conn, dialect, target=None):
+    """
+    Apply every pending migration up to target (default: latest) in order.
+    Safe to call repeatedly; returns the list of versions applied by this call.
+    """
+    if dialect not in PARAMSTYLE:
+        raise ValueError(f"Unsupported dialect {dialect!r}")
+
+    version = current_version(conn, dialect)
+    param = PARAMSTYLE[dialect]
+    applied = []
+
+    for migration_version, description, statements in MIGRATIONS:
+        if migration_version <= version or (target is not None and migration_version > target):
+            continue
+
+        cur = conn.cursor()
+        try:
+            for statement in statements[dialect]:
+                try:
+                    cur.execute(statement)
+                except Exception as e:
+                    if not (e.args and e.args[0] in ALREADY_APPLIED_ERRORS[dialect]):
+                        raise
+                    logger.info(f"Migration {migration_version}: skipping already applied statement ({e.args[0]})")
+
+            cur.execute(f"INSERT INTO schema_version (version, description) VALUES ({param}, {param})",
+                        (migration_version, description))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+        logger.info(f"Applied migration {migration_version}: {description}")
+        applied.append(migration_version)
+
+    return applied
+
+def latest_version():
+    return MIGRATIONS[-1][0]
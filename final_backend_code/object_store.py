@@ -0,0 +1,218 @@
+import os
+import hmac
+import time
+import uuid
+import shutil
+import hashlib
+import contextlib
+import urllib.parse
+
+IMAGE_BUCKET = os.environ.get('IMAGE_BUCKET', 'fridgemate-images')
+
+# Item images are stored as <uuid>.jpg
+IMAGE_CONTENT_TYPE = "image/jpeg"
+
+def image_key(image_uuid):
+    return f"{image_uuid}.jpg"
+
+@contextlib.contextmanager
+def known_upload(upload_id):
+    """
+    Turn S3's NoSuchUpload (never created, already completed or aborted) into the
+    KeyError LocalObjectStore raises, so callers handle both stores alike
+    """
+    from botocore.exceptions import ClientError
+    try:
+        yield
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") == "NoSuchUpload":
+            raise KeyError(f"Unknown upload: {upload_id}") from None
+        raise
+
+class S3ObjectStore:
+    """
+    Objects in an S3 bucket. endpoint_url points the client at an S3-compatible
+    server instead of AWS.
+    """
+
+    def __init__(self, bucket=IMAGE_BUCKET, client=None, endpoint_url=None):
+        if client is None:
+            import boto3
+            client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.bucket = bucket
+        self.client = client
+
+    def put(self, key, body, content_type):
+        # body may be bytes or a file-like object; boto3 streams the latter
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=key,
+            ContentType=content_type,
+            ContentDisposition='inline',    # Suggests to the browser to open rather than download
+            Body=body
+        )
+
+    def get(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def exists(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    def presign_put(self, key, content_type, expires_in):
+        """
+        URL the device PUTs the object to directly; the request must send the same Content-Type
+        """
+        return self.client.generate_presigned_url(
+            "put_object",
+            Params={"Bucket": self.bucket, "Key": key, "ContentType": content_type},
+            ExpiresIn=expires_in
+        )
+
+    def create_multipart(self, key, content_type):
+        response = self.client.create_multipart_upload(Bucket=self.bucket, Key=key, ContentType=content_type, ContentDisposition='inline')
+        return response["UploadId"]
+
+    def upload_part(self, key, upload_id, part_number, body):
+        # S3 requires every part except the last to be at least 5 MiB
+        with known_upload(upload_id):
+            response = self.client.upload_part(Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=part_number, Body=body)
+        return response["ETag"]
+
+    def complete_multipart(self, key, upload_id, parts):
+        """
+        parts is a list of (part_number, etag) as returned by upload_part
+        """
+        with known_upload(upload_id):
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": [{"PartNumber": number, "ETag": etag} for number, etag in sorted(parts)]}
+            )
+
+    def abort_multipart(self, key, upload_id):
+        with known_upload(upload_id):
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+
+class LocalObjectStore:
+    """
+    Filesystem stand-in for S3ObjectStore used for local testing. Objects are
+    files under root; multipart parts are staged under root/.multipart/<upload_id>.
+    Presigned URLs point at base_url/<key> and are signed with an HMAC of the key
+    and expiry; whatever serves base_url checks them with verify_presigned.
+    """
+
+    def __init__(self, root, base_url="http://127.0.0.1:5000/objects", secret=None):
+        self.root = root
+        self.base_url = base_url.rstrip("/")
+        self.secret = secret.encode() if secret else os.urandom(32)
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        path = os.path.realpath(os.path.join(self.root, key))
+        if not path.startswith(os.path.realpath(self.root) + os.sep):
+            raise ValueError(f"Invalid object key: {key}")
+        return path
+
+    def _staging(self, upload_id):
+        if not upload_id.isalnum():
+            raise ValueError(f"Invalid upload id: {upload_id}")
+        return os.path.join(self.root, ".multipart", upload_id)
+
+    def put(self, key, body, content_type):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            if isinstance(body, (bytes, bytearray, memoryview)):
+                f.write(body)
+            else:
+                shutil.copyfileobj(body, f)
+
+    def get(self, key):
+        with open(self._path(key), "rb") as f:
+            return f.read()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def exists(self, key):
+        return os.path.isfile(self._path(key))
+
+    def _signature(self, key, content_type, expires):
+        message = f"PUT\n{key}\n{content_type}\n{expires}".encode()
+        return hmac.new(self.secret, message, hashlib.sha256).hexdigest()
+
+    def presign_put(self, key, content_type, expires_in):
+        expires = int(time.time()) + expires_in
+        query = urllib.parse.urlencode({"expires": expires, "signature": self._signature(key, content_type, expires)})
+        return f"{self.base_url}/{urllib.parse.quote(key)}?{query}"
+
+    def verify_presigned(self, key, content_type, expires, signature):
+        """
+        True if the signature was issued by presign_put for this key and has not expired
+        """
+        try:
+            expires = int(expires)
+        except (TypeError, ValueError):
+            return False
+        if expires < time.time():
+            return False
+        return hmac.compare_digest(self._signature(key, content_type, expires), signature or "")
+
+    def create_multipart(self, key, content_type):
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self._staging(upload_id))
+        return upload_id
+
+    def upload_part(self, key, upload_id, part_number, body):
+        staging = self._staging(upload_id)
+        if not os.path.isdir(staging):
+            raise KeyError(f"Unknown upload: {upload_id}")
+        with open(os.path.join(staging, str(int(part_number))), "wb") as f:
+            f.write(body)
+        return f'"{upload_id}-{part_number}"'
+
+    def complete_multipart(self, key, upload_id, parts):
+        staging = self._staging(upload_id)
+        if not os.path.isdir(staging):
+            raise KeyError(f"Unknown upload: {upload_id}")
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as out:
+            for number, _ in sorted(parts):
+                with open(os.path.join(staging, str(int(number))), "rb") as part:
+                    shutil.copyfileobj(part, out)
+        shutil.rmtree(staging)
+
+    def abort_multipart(self, key, upload_id):
+        staging = self._staging(upload_id)
+        if not os.path.isdir(staging):
+            raise KeyError(f"Unknown upload: {upload_id}")
+        shutil.rmtree(staging, ignore_errors=True)
+
+def get_object_store():
+    """
+    Store selected from the environment: LOCAL_OBJECT_STORE_DIR for the
+    filesystem stand-in (served at LOCAL_OBJECT_STORE_URL), otherwise the S3
+    bucket IMAGE_BUCKET, on S3_ENDPOINT_URL if set (e.g. a local MinIO).
+    """
+    local_dir = os.environ.get('LOCAL_OBJECT_STORE_DIR')
+    if local_dir:
+        return LocalObjectStore(local_dir,
+                                base_url=os.environ.get('LOCAL_OBJECT_STORE_URL', 'http://127.0.0.1:5000/objects'),
+                                secret=os.environ.get('LOCAL_OBJECT_STORE_SECRET'))
+    return S3ObjectStore(IMAGE_BUCKET, endpoint_url=os.environ.get('S3_ENDPOINT_URL'))
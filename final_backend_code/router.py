@@ -0,0 +1,200 @@
+import json
+import time
+import base64
+import logging
+
+logger = logging.getLogger()
+
+def generate_response(body, status, headers=None):
+    # A str body is sent as is (e.g. NDJSON); set its Content-Type in headers
+    response = {
+        'statusCode': status,
+        'body': body if isinstance(body, str) else json.dumps(body),
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+    }
+    if headers:
+        response['headers'].update(headers)
+    return response
+
+def content_type(event):
+    headers = event.get("headers") or {}
+    for name, value in headers.items():
+        if name.lower() == "content-type":
+            return value.split(";")[0].strip().lower()
+    return None
+
+def raw_body(event):
+    body = event.get("body") or b""
+    if event.get("isBase64Encoded"):
+        return base64.b64decode(body)
+    return body.encode("latin-1") if isinstance(body, str) else body
+
+def parse_body(event):
+    """
+    JSON object sent as the request body; {} when there is none
+    """
+    body = event.get("body")
+    if not body:
+        return {}
+
+    if event.get("isBase64Encoded"):
+        body = base64.b64decode(body)
+
+    data = json.loads(body)
+    if not isinstance(data, dict):
+        raise ValueError("Request body must be a JSON object")
+    return data
+
+class Route:
+    __slots__ = ("path", "handler", "body", "schema", "fridge", "decoders")
+
+    def __init__(self, path, handler, body, schema, fridge, decoders):
+        self.path = path
+        self.handler = handler
+        self.body = body
+        self.schema = schema
+        self.fridge = fridge
+        self.decoders = decoders
+
+    def validate(self, data):
+        """
+        Error message for the first field missing or of the wrong type, else None
+        """
+        for field, expected_type in self.schema.items():
+            value = data.get(field)
+            if value is None:
+                return f"Missing required field: {field}"
+            if not isinstance(value, expected_type):
+                return f"Invalid type for field: {field}"
+        return None
+
+class Router:
+    """
+    Table-driven dispatch shared by the lambda handlers.
+
+    Routes are registered with @router.route(path, ...) and looked up by the last
+    segment of the event path. Each route declares whether it takes a JSON body,
+    the required body fields and their types, and whether it needs the caller's
+    fridge; the fridge is resolved once here through the function registered with
+    @router.fridge_resolver and passed to the handler as its second argument.
+    Middleware registered with use() wraps every call as middleware(route, data, call_next).
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.error_handlers = []
+        self.timings = {}
+        self._middleware = [self.timing_middleware]
+        self._resolve_fridge = None
+        self._chain = self._build_chain()
+
+    def route(self, path, body=True, schema=None, fridge=False, decoders=None):
+        """
+        Register the decorated handler for path. Handlers are called as
+        handler() when body is False, handler(data) or handler(data, fridge_id).
+        Routes that need a fridge always require a "user_id".
+        decoders maps a Content-Type to decoder(bytes) -> dict for bodies that
+        are not JSON; the decoded dict is validated and handled like JSON.
+        """
+        schema = dict(schema or {})
+        if fridge:
+            schema = {"user_id": str, **schema}
+
+        def decorator(handler):
+            self.routes[path] = Route(path, handler, body, schema, fridge, decoders or {})
+            return handler
+        return decorator
+
+    def fridge_resolver(self, resolver):
+        """
+        Register resolver(user_id) -> fridge_id or None for routes declared with fridge=True
+        """
+        self._resolve_fridge = resolver
+        return resolver
+
+    def errorhandler(self, *exception_types):
+        """
+        Register handler(exception) -> (body, status) for exceptions raised by routes
+        """
+        def decorator(handler):
+            self.error_handlers.append((exception_types, handler))
+            return handler
+        return decorator
+
+    def use(self, middleware):
+        self._middleware.append(middleware)
+        self._chain = self._build_chain()
+        return middleware
+
+    def _build_chain(self):
+        # Composed once when middleware is registered, not per request
+        call = self._invoke
+        for middleware in reversed(self._middleware):
+            call = (lambda middleware, call_next: lambda route, data: middleware(route, data, call_next))(middleware, call)
+        return call
+
+    def _invoke(self, route, data):
+        if route.fridge:
+            fridge_id = self._resolve_fridge(data['user_id'])
+            if fridge_id is None:
+                return {"success": False, "message": "User does not have a fridge associated"}, 200
+            return route.handler(data, fridge_id)
+
+        if route.body:
+            return route.handler(data)
+
+        return route.handler()
+
+    def timing_middleware(self, route, data, call_next):
+        start = time.perf_counter()
+        try:
+            return call_next(route, data)
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            timing = self.timings.setdefault(route.path, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            timing["count"] += 1
+            timing["total_ms"] += elapsed_ms
+            timing["max_ms"] = max(timing["max_ms"], elapsed_ms)
+            logger.info(f"{route.path} handled in {elapsed_ms:.1f} ms")
+
+    def dispatch(self, event):
+        """
+        Run the route matching the event and return (body, status[, headers])
+        """
+        path = (event.get("path") or "").split('/')[-1]
+        route = self.routes.get(path)
+        if route is None:
+            return {"message": "Invalid path"}, 500
+
+        data = None
+        decoder = route.decoders.get(content_type(event)) if route.decoders else None
+        if decoder is not None:
+            try:
+                data = decoder(raw_body(event))
+            except ValueError as e:
+                return {"success": False, "message": str(e)}, 400
+        elif route.body:
+            try:
+                data = parse_body(event)
+            except ValueError:
+                return {"success": False, "message": "Request body must be a JSON object"}, 400
+
+        if data is not None:
+            error = route.validate(data)
+            if error is not None:
+                return {"success": False, "message": error}, 400
+
+        try:
+            return self._chain(route, data)
+        except Exception as e:
+            for exception_types, handler in self.error_handlers:
+                if isinstance(e, exception_types):
+                    return handler(e)
+            raise
+
+    def handle(self, event):
+        # Handlers may return (body, status) or (body, status, extra_headers)
+        return generate_response(*self.dispatch(event))
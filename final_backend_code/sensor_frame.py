@@ -0,0 +1,67 @@
+import struct
+
+# Packed binary sensor frame, the compact alternative to the JSON body of
+# add_sensor_data. All integers are little-endian. The device-side encoder is
+# device/sensor_frame.py; keep the two in step and bump VERSION for any change.
+#
+#   header  "<2sBBIB"  magic b"FM", version, flags (reserved, 0),
+#                      base timestamp (epoch seconds), fridge id length
+#           fridge id  UTF-8, up to 255 bytes
+#           "<H"       sample count
+#   sample  "<HhHB"    seconds after the base timestamp,
+#                      temperature and humidity in hundredths,
+#                      sample flags (SAMPLE_ENV | SAMPLE_DOOR | DOOR_OPEN)
+# Samples are in timestamp order. Door events of one second take a sample each,
+# in the order they happened, so several samples may share a timestamp.
+MAGIC = b"FM"
+VERSION = 1
+CONTENT_TYPE = "application/x-fridge-frame"
+
+HEADER = struct.Struct("<2sBBIB")
+COUNT = struct.Struct("<H")
+SAMPLE = struct.Struct("<HhHB")
+
+SAMPLE_ENV = 0x01
+SAMPLE_DOOR = 0x02
+DOOR_OPEN = 0x04
+
+def decode_frame(frame):
+    """
+    Decode a frame into the add_sensor_data request it stands for:
+    {"fridge_id": ..., "readings": [...], "events": [...]}.
+    Raises ValueError for anything that is not a well-formed frame.
+    """
+    if len(frame) < HEADER.size:
+        raise ValueError("Truncated sensor frame")
+
+    magic, version, _, base_ts, key_length = HEADER.unpack_from(frame)
+    if magic != MAGIC:
+        raise ValueError("Not a sensor frame")
+    if version != VERSION:
+        raise ValueError(f"Unsupported sensor frame version {version}")
+
+    offset = HEADER.size
+    fridge_id = frame[offset:offset + key_length].decode("utf-8")
+    offset += key_length
+
+    if len(frame) < offset + COUNT.size:
+        raise ValueError("Truncated sensor frame")
+    (count,) = COUNT.unpack_from(frame, offset)
+    offset += COUNT.size
+    if len(frame) != offset + count * SAMPLE.size:
+        raise ValueError(f"Sensor frame length does not match its {count} samples")
+
+    readings, events = [], []
+    for dt, temperature, humidity, flags in SAMPLE.iter_unpack(frame[offset:]):
+        ts = base_ts + dt
+        if flags & SAMPLE_ENV:
+            readings.append({"timestamp": ts, "temperature": temperature / 100, "humidity": humidity / 100})
+        if flags & SAMPLE_DOOR:
+            events.append({"timestamp": ts, "value": 1 if flags & DOOR_OPEN else 0})
+
+    data = {"fridge_id": fridge_id}
+    if readings:
+        data["readings"] = readings
+    if events:
+        data["events"] = events
+    return data
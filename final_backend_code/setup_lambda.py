@@ -1,8 +1,18 @@
-import sys
+import io
+import json
+import time
 import logging
 import pymysql
-import json
+import pymysql.cursors
 import os
+from db import ConnectionManager
+from router import Router
+from migrations import current_version, latest_version, run_migrations
+from inventory import record_changes
+from telemetry import prune_env_readings as prune_readings
+from object_store import get_object_store, image_key
+from thumbnails import IMAGE_BASE_URL, THUMBNAIL_WIDTHS, DEFAULT_THUMBNAIL_WIDTH, image_uuid_from_url, thumbnail_key, generate_thumbnails, record_thumbnails
+from image_hashes import sha256_hex, dhash, find_duplicate, record_image
 
 # rds settings
 user_name = os.environ['USER_NAME']
@@ -13,18 +23,26 @@ db_name = os.environ['DB_NAME']
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# create the database connection outside of the handler to allow connections to be
-# re-used by subsequent function invocations.
-try:
-    conn = pymysql.connect(host=rds_proxy_host, user=user_name, passwd=password, db=db_name, connect_timeout=5)
-except pymysql.MySQLError as e:
-    logger.error("ERROR: Unexpected error: Could not connect to MySQL instance.")
-    logger.error(e)
-    sys.exit(1)
+# the database connection lives outside of the handler so it can be re-used by
+# subsequent function invocations; it is opened on first use and re-opened if the
+# proxy has dropped it.
+db = ConnectionManager(host=rds_proxy_host, user=user_name, password=password, db=db_name, connect_timeout=5)
 
-logger.info("SUCCESS: Connection to RDS for MySQL instance succeeded")
+# Image bucket, read and pruned by dedupe_images and backfill_thumbnails
+store = get_object_store()
 
+router = Router()
+
+@router.errorhandler(pymysql.OperationalError, pymysql.InterfaceError)
+def database_unavailable(e):
+    # The connection is unusable; drop it so the next invocation reconnects
+    logger.error(e)
+    db.reset()
+    return {"message": "Database unavailable"}, 500
+
+@router.route("create_tables", body=False)
 def create_tables():
+    conn = db.connection()
     with conn.cursor() as cur:
         cur.execute('''CREATE TABLE IF NOT EXISTS item_info (
                     uuid VARCHAR(255) PRIMARY KEY,
@@ -64,13 +82,37 @@ def create_tables():
     
     return {"message": "Tables created successfully"}, 200
 
+@router.route("migrate", body=False)
+def migrate():
+    """
+    Bring the schema up to the latest version by applying pending migrations in order
+    """
+    conn = db.connection()
+    from_version = current_version(conn, "mysql")
+    applied = run_migrations(conn, "mysql")
+
+    return {"message": "Schema is up to date", "from_version": from_version, "to_version": latest_version(), "applied": applied}, 200
+
+@router.route("clear_tables", body=False)
 def clear_tables():
+    conn = db.connection()
     with conn.cursor() as cur:
+        # Tombstone every item so clients syncing through get_changes drop them too
+        cur.execute("INSERT INTO item_changes (fridge_id, uuid, deleted) SELECT fridge_id, uuid, TRUE FROM item_info")
         cur.execute("DELETE FROM item_info")
         cur.execute("DELETE FROM user_map")
         cur.execute("DELETE FROM saved_map")
+        cur.execute("DELETE FROM label_sketch")
         cur.execute("DELETE FROM env_info")
+        cur.execute("DELETE FROM env_readings")
+        cur.execute("DELETE FROM env_rollups")
         cur.execute("DELETE FROM door_info")
+        cur.execute("DELETE FROM door_events")
+        cur.execute("DELETE FROM door_state")
+        cur.execute("DELETE FROM door_daily")
+        # Phones holding an old ETag refetch the emptied inventory, and warm
+        # hardware containers drop their cached barcode -> name maps
+        cur.execute("UPDATE fridge_version SET version = version + 1, labels_version = labels_version + 1")
         
         conn.commit()
 
@@ -78,56 +120,287 @@ def clear_tables():
     
     return {"message": "Tables cleared successfully"}, 200
 
-def get_all_items():
-    
-    items = None
+# Rows per export page, and the size of each part of an export written to the store
+EXPORT_PAGE_SIZE = 1000
+MAX_EXPORT_PAGE_SIZE = 5000
+EXPORT_PART_BYTES = 8 * 1024 * 1024
+
+def iter_items(conn, fridge_id=None, after="", limit=None):
+    """
+    Yield item_info rows as dicts in uuid order, starting after the given uuid.
+    The rows are streamed from the server through an unbuffered cursor, so
+    memory stays bounded however many rows the query returns. The keyset
+    condition is a range scan on the primary key (or idx_item_fridge_uuid when
+    filtering by fridge), so later pages cost the same as the first.
+    """
+    query = "SELECT uuid, fridge_id, expiration_date, barcode, image_url, name FROM item_info WHERE uuid > %s"
+    params = [after]
+    if fridge_id is not None:
+        query += " AND fridge_id = %s"
+        params.append(fridge_id)
+    query += " ORDER BY uuid"
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(limit)
+
+    with conn.cursor(pymysql.cursors.SSCursor) as cur:
+        cur.execute(query, params)
+        while True:
+            rows = cur.fetchmany(500)
+            if not rows:
+                break
+            for row in rows:
+                yield {
+                    "uuid": row[0],
+                    "fridge_id": row[1],
+                    "expiration_date": row[2].strftime('%Y-%m-%d') if row[2] else None,
+                    "barcode": row[3],
+                    "image_url": row[4],
+                    "name": row[5]
+                }
+    conn.commit()
+
+def parse_limit(data, default, maximum):
+    """
+    data["limit"] clamped to 1..maximum, default when it is left out; None when
+    it is not a number
+    """
+    try:
+        return min(max(int(data.get('limit') or default), 1), maximum)
+    except (TypeError, ValueError):
+        return None
+
+@router.route("export_items")
+def export_items(data):
+    """
+    One page of item_info as NDJSON (one item per line), in uuid order.
+    X-Export-Cursor holds the last uuid of the page; send it back as "cursor"
+    while X-Export-Has-More is "true". "fridge_id" limits the export to one fridge.
+    {
+        "fridge_id": "fridge1",
+        "cursor": "",
+        "limit": 1000
+    }
+    Send "to_store": true to instead stream the whole export into the object
+    store as exports/<name>.ndjson, written in parts of EXPORT_PART_BYTES.
+    """
+    fridge_id = data.get('fridge_id')
+    cursor = data.get('cursor') or ""
+
+    if data.get('to_store'):
+        return export_to_store(fridge_id, cursor)
+
+    limit = parse_limit(data, EXPORT_PAGE_SIZE, MAX_EXPORT_PAGE_SIZE)
+    if limit is None:
+        return {"success": False, "message": "Invalid limit"}, 400
+
+    lines = []
+    last_uuid = cursor
+    for item in iter_items(db.connection(), fridge_id, cursor, limit):
+        lines.append(json.dumps(item))
+        last_uuid = item["uuid"]
+    body = "\n".join(lines) + "\n" if lines else ""
+
+    return body, 200, {
+        "Content-Type": "application/x-ndjson",
+        "X-Export-Cursor": last_uuid,
+        "X-Export-Has-More": "true" if len(lines) == limit else "false",
+    }
+
+def export_to_store(fridge_id, cursor):
+    key = f"exports/items-{fridge_id or 'all'}-{time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())}.ndjson"
+    upload_id = store.create_multipart(key, "application/x-ndjson")
+
+    parts, buffer, count = [], io.BytesIO(), 0
+    try:
+        for item in iter_items(db.connection(), fridge_id, cursor):
+            buffer.write(json.dumps(item).encode() + b"\n")
+            count += 1
+            if buffer.tell() >= EXPORT_PART_BYTES:
+                parts.append((len(parts) + 1, store.upload_part(key, upload_id, len(parts) + 1, buffer.getvalue())))
+                buffer = io.BytesIO()
+
+        if buffer.tell() or not parts:
+            parts.append((len(parts) + 1, store.upload_part(key, upload_id, len(parts) + 1, buffer.getvalue())))
+        store.complete_multipart(key, upload_id, parts)
+    except Exception:
+        store.abort_multipart(key, upload_id)
+        raise
+
+    return {"success": True, "key": key, "items": count}, 200
+
+@router.route("get_all_items")
+def get_all_items(data):
+    """
+    Deprecated: first page of export_items in the old JSON shape. Pass the
+    returned "cursor" back to continue while "has_more" is true.
+    """
+    cursor = data.get('cursor') or ""
+    limit = parse_limit(data, EXPORT_PAGE_SIZE, MAX_EXPORT_PAGE_SIZE)
+    if limit is None:
+        return {"success": False, "message": "Invalid limit"}, 400
+    items = list(iter_items(db.connection(), data.get('fridge_id'), cursor, limit))
+
+    return {"all_items": items, "cursor": items[-1]["uuid"] if items else cursor, "has_more": len(items) == limit}, 200
+
+@router.route("prune_env_readings")
+def prune_env_readings(data):
+    """
+    Drop raw environment readings and minute rollups older than "days" (default 30);
+    meant to run on a schedule. Hour and day rollups are kept.
+    {
+        "days": 30
+    }
+    """
+    try:
+        days = max(int(data.get('days') or 30), 1)
+    except (TypeError, ValueError):
+        return {"success": False, "message": "Invalid days"}, 400
+    conn = db.connection()
     with conn.cursor() as cur:
-        cur.execute("SELECT * FROM item_info")
-        rows = cur.fetchall()
-        
-        items = [
-            {
-                "uuid": row[0], 
-                "fridge_id": row[1], 
-                "expiration_date": row[2].strftime('%Y-%m-%d') if row[2] else None, 
-                "barcode": row[3], 
-                "image_url": row[4], 
-                "name": row[5]
-            } for row in rows
-        ]
-        
+        readings, rollups = prune_readings(cur, int(time.time()) - days * 86400)
         conn.commit()
-    return {"all_items": items}, 200
-
-def generate_response(body, status):
-    response = {
-        'statusCode': status,
-        'body': json.dumps(body),
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*'
-        },
+
+    return {"success": True, "readings": readings, "rollups": rollups}, 200
+
+@router.route("dedupe_images")
+def dedupe_images(data):
+    """
+    Backfill the content hash index for images stored before it existed (or
+    uploaded in chunks / through presigned URLs). Items pointing at a duplicate
+    are moved to the first copy indexed and the duplicate and its thumbnails
+    are deleted. Walks item_info's image URLs in order; pass the returned
+    "cursor" back until "has_more" is false.
+    {
+        "cursor": "",
+        "limit": 100
     }
-    return response
+    """
+    cursor = data.get('cursor') or ""
+    limit = parse_limit(data, 100, 500)
+    if limit is None:
+        return {"success": False, "message": "Invalid limit"}, 400
+
+    indexed, merged, missing = 0, 0, 0
+    conn = db.connection()
+    with conn.cursor() as cur:
+        cur.execute("SELECT DISTINCT image_url FROM item_info WHERE image_url > %s AND image_url LIKE %s ORDER BY image_url LIMIT %s",
+                    (cursor, IMAGE_BASE_URL + "%", limit))
+        image_urls = [row[0] for row in cur.fetchall()]
+        conn.commit()
+
+        for image_url in image_urls:
+            image_uuid = image_uuid_from_url(image_url)
+            if image_uuid is None:
+                continue
+
+            cur.execute("SELECT 1 FROM image_hashes WHERE image_uuid = %s", (image_uuid,))
+            if cur.fetchone():
+                continue
+
+            try:
+                binary = store.get(image_key(image_uuid))
+            except Exception as e:
+                logger.warning(f"Could not read {image_uuid}: {e}")
+                missing += 1
+                continue
+
+            sha256, dhash_value = sha256_hex(binary), dhash(binary)
+            existing = find_duplicate(cur, sha256, dhash_value)
+            if existing is None:
+                record_image(cur, image_uuid, sha256, dhash_value)
+                conn.commit()
+                indexed += 1
+                continue
+
+            # Re-point every item at the surviving copy, fridge by fridge for delta sync
+            cur.execute("SELECT fridge_id, uuid FROM item_info WHERE image_url = %s FOR UPDATE", (image_url,))
+            items_by_fridge = {}
+            for fridge_id, item_uuid in cur.fetchall():
+                items_by_fridge.setdefault(fridge_id, []).append(item_uuid)
+
+            cur.execute("UPDATE item_info SET image_url = %s WHERE image_url = %s", (IMAGE_BASE_URL + image_key(existing), image_url))
+            for fridge_id, item_uuids in items_by_fridge.items():
+                record_changes(cur, fridge_id, upserted=item_uuids)
+            conn.commit()
+
+            # Objects go only after the items stopped pointing at them
+            cur.execute("DELETE FROM image_thumbnails WHERE image_url = %s", (image_url,))
+            conn.commit()
+            store.delete(image_key(image_uuid))
+            for width in THUMBNAIL_WIDTHS:
+                store.delete(thumbnail_key(image_uuid, width))
+            merged += 1
+
+    return {
+        "success": True,
+        "indexed": indexed,
+        "merged": merged,
+        "missing": missing,
+        "cursor": image_urls[-1] if image_urls else cursor,
+        "has_more": len(image_urls) == limit,
+    }, 200
+
+@router.route("backfill_thumbnails")
+def backfill_thumbnails(data):
+    """
+    Record the thumbnails of item images that have none recorded (stored before
+    thumbnails existed, or whose rendering failed or had no Pillow), rendering
+    them first where the bucket has none, so get_data starts handing them out.
+    Walks item_info's image URLs in order; pass the returned "cursor" back until
+    "has_more" is false.
+    {
+        "cursor": "",
+        "limit": 100
+    }
+    """
+    cursor = data.get('cursor') or ""
+    limit = parse_limit(data, 100, 500)
+    if limit is None:
+        return {"success": False, "message": "Invalid limit"}, 400
+
+    conn = db.connection()
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT DISTINCT i.image_url FROM item_info i
+            LEFT JOIN image_thumbnails t ON t.image_url = i.image_url
+            WHERE i.image_url > %s AND i.image_url LIKE %s AND t.image_url IS NULL
+            ORDER BY i.image_url LIMIT %s
+        """, (cursor, IMAGE_BASE_URL + "%", limit))
+        image_urls = [row[0] for row in cur.fetchall()]
+        conn.commit()
+
+        found, to_render, missing = [], [], 0
+        for image_url in image_urls:
+            image_uuid = image_uuid_from_url(image_url)
+            if image_uuid is None:
+                continue
+            if store.exists(thumbnail_key(image_uuid, DEFAULT_THUMBNAIL_WIDTH)):
+                found.append(image_uuid)
+            elif store.exists(image_key(image_uuid)):
+                to_render.append(image_uuid)
+            else:
+                missing += 1
+
+        # Without Pillow nothing is rendered and those images stay unrecorded
+        rendered = list(generate_thumbnails(store, to_render)) if to_render else []
+
+        if found or rendered:
+            record_thumbnails(cur, found + rendered)
+            conn.commit()
+
+    return {
+        "success": True,
+        "found": len(found),
+        "rendered": len(rendered),
+        "unrendered": len(to_render) - len(rendered),
+        "missing": missing,
+        "cursor": image_urls[-1] if image_urls else cursor,
+        "has_more": len(image_urls) == limit,
+    }, 200
 
 def lambda_handler(event, context):
     """
-    This function creates a new RDS database table and writes records to it
+    Entry point for the setup API; requests are dispatched by the last segment of the path
     """
-    
-    path = event["path"].split('/')[-1]
-    # body = json.loads(event["body"])
-    
-    return_body = None
-    return_status = None
-    if path == "create_tables":
-        return_body, return_status = create_tables()
-    elif path == "clear_tables":
-        return_body, return_status = clear_tables()
-    elif path == "get_all_items":
-        return_body, return_status = get_all_items()
-    else:
-        return_body, return_status = {"message": "Invalid path"}, 500 
-    
-    return generate_response(return_body, return_status)
-    
\ No newline at end of file
+    return router.handle(event)
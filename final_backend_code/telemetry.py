@@ -0,0 +1,133 @@
+# Environment (temperature/humidity) history (MySQL).
+# Raw readings are appended to env_readings, keyed by (fridge_id, ts), and
+# every write also folds the readings into per-minute, per-hour and per-day
+# rollups in env_rollups, so history queries read a few hundred pre-aggregated
+# rows instead of scanning raw readings. Timestamps are UTC epoch seconds.
+
+RESOLUTIONS = {"minute": 60, "hour": 3600, "day": 86400}
+
+# "auto" picks the finest resolution that returns at most this many points
+MAX_POINTS = 1000
+
+def rollup_rows(fridge_id, readings):
+    """
+    Pre-aggregate (ts, temperature, humidity) readings into one env_rollups row
+    per (resolution, bucket) so a batch costs one upsert per bucket
+    """
+    buckets = {}
+    for ts, temperature, humidity in readings:
+        for resolution in RESOLUTIONS.values():
+            key = (resolution, ts - ts % resolution)
+            bucket = buckets.get(key)
+            if bucket is None:
+                buckets[key] = [1, temperature, temperature, temperature, humidity, humidity, humidity]
+            else:
+                bucket[0] += 1
+                bucket[1] += temperature
+                bucket[2] = min(bucket[2], temperature)
+                bucket[3] = max(bucket[3], temperature)
+                bucket[4] += humidity
+                bucket[5] = min(bucket[5], humidity)
+                bucket[6] = max(bucket[6], humidity)
+
+    return [(fridge_id, resolution, start, *bucket) for (resolution, start), bucket in buckets.items()]
+
+def record_env_readings(cur, fridge_id, readings):
+    """
+    Append readings, a list of (ts, temperature, humidity), update the rollups
+    and keep env_info at the newest reading. Runs in the caller's transaction.
+    Readings already stored for their second (a retried or duplicated batch)
+    are ignored: the first reading of a second is kept and counted once.
+    """
+    if not readings:
+        return
+
+    # Upserting env_info first locks the fridge's row until commit, so batches of
+    # one fridge are recorded one at a time and the check for stored readings below
+    # cannot race a retry of the same batch. MySQL assigns left to right, so ts is
+    # compared before it is moved forward; an older batch leaves env_info alone.
+    newest_ts, temperature, humidity = max(readings, key=lambda reading: reading[0])
+    cur.execute("""
+        INSERT INTO env_info (fridge_id, temperature, humidity, ts)
+        VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            temperature = IF(ts IS NULL OR VALUES(ts) > ts, VALUES(temperature), temperature),
+            humidity = IF(ts IS NULL OR VALUES(ts) > ts, VALUES(humidity), humidity),
+            ts = IF(ts IS NULL OR VALUES(ts) > ts, VALUES(ts), ts)
+    """, (fridge_id, temperature, humidity, newest_ts))
+
+    # A locking read sees rows committed by the batch that held the lock before us
+    timestamps = sorted({reading[0] for reading in readings})
+    cur.execute(f"SELECT ts FROM env_readings WHERE fridge_id = %s AND ts IN ({', '.join(['%s'] * len(timestamps))}) FOR UPDATE",
+                [fridge_id] + timestamps)
+    stored = {row[0] for row in cur.fetchall()}
+
+    new_readings = []
+    for reading in readings:
+        if reading[0] not in stored:
+            stored.add(reading[0])
+            new_readings.append(reading)
+    if not new_readings:
+        return
+
+    # pymysql turns each executemany into a single multi-row statement
+    cur.executemany("""
+        INSERT IGNORE INTO env_readings (fridge_id, ts, temperature, humidity)
+        VALUES (%s, %s, %s, %s)
+    """, [(fridge_id, ts, temperature, humidity) for ts, temperature, humidity in new_readings])
+
+    cur.executemany("""
+        INSERT INTO env_rollups (fridge_id, resolution, bucket, count,
+                                 temperature_sum, temperature_min, temperature_max,
+                                 humidity_sum, humidity_min, humidity_max)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            count = count + VALUES(count),
+            temperature_sum = temperature_sum + VALUES(temperature_sum),
+            temperature_min = LEAST(temperature_min, VALUES(temperature_min)),
+            temperature_max = GREATEST(temperature_max, VALUES(temperature_max)),
+            humidity_sum = humidity_sum + VALUES(humidity_sum),
+            humidity_min = LEAST(humidity_min, VALUES(humidity_min)),
+            humidity_max = GREATEST(humidity_max, VALUES(humidity_max))
+    """, rollup_rows(fridge_id, new_readings))
+
+def pick_resolution(start, end):
+    for name, seconds in sorted(RESOLUTIONS.items(), key=lambda item: item[1]):
+        if (end - start) // seconds <= MAX_POINTS:
+            return name
+    return "day"
+
+def query_env_history(cur, fridge_id, resolution, start, end):
+    """
+    Rollup points with start <= bucket < end, oldest first; a primary key range scan
+    """
+    cur.execute("""
+        SELECT bucket, count, temperature_sum, temperature_min, temperature_max,
+               humidity_sum, humidity_min, humidity_max
+        FROM env_rollups
+        WHERE fridge_id = %s AND resolution = %s AND bucket >= %s AND bucket < %s
+        ORDER BY bucket
+    """, (fridge_id, RESOLUTIONS[resolution], start - start % RESOLUTIONS[resolution], end))
+
+    return [{
+        "timestamp": bucket,
+        "count": count,
+        "temperature": {"min": temperature_min, "max": temperature_max, "mean": temperature_sum / count},
+        "humidity": {"min": humidity_min, "max": humidity_max, "mean": humidity_sum / count},
+    } for bucket, count, temperature_sum, temperature_min, temperature_max, humidity_sum, humidity_min, humidity_max in cur.fetchall()]
+
+def prune_env_readings(cur, before):
+    """
+    Drop raw readings and minute rollups older than before, fridge by fridge so
+    each delete is a primary key range scan; hour and day rollups are kept for
+    long-range history. Returns (readings, rollups) deleted.
+    """
+    cur.execute("SELECT fridge_id FROM env_info")
+    readings = rollups = 0
+    for (fridge_id,) in cur.fetchall():
+        cur.execute("DELETE FROM env_readings WHERE fridge_id = %s AND ts < %s", (fridge_id, before))
+        readings += cur.rowcount
+        cur.execute("DELETE FROM env_rollups WHERE fridge_id = %s AND resolution = %s AND bucket < %s",
+                    (fridge_id, RESOLUTIONS["minute"], before))
+        rollups += cur.rowcount
+    return readings, rollups
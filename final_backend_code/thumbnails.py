@@ -0,0 +1,190 @@
+import io
+import os
+import logging
+import urllib.parse
+import concurrent.futures
+
+from object_store import get_object_store, image_key, IMAGE_CONTENT_TYPE
+
+# Pillow is only needed where thumbnails are rendered (the image lambdas and
+# the local server); without it uploads still succeed and no variants are made.
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Database of the S3 trigger, opened on first use; None without database settings
+_db = None
+
+IMAGE_BASE_URL = "https://fridgemate-images.s3.us-east-2.amazonaws.com/"
+
+# Widths rendered for every item image; get_data hands out the first one
+THUMBNAIL_WIDTHS = (200, 800)
+DEFAULT_THUMBNAIL_WIDTH = THUMBNAIL_WIDTHS[0]
+THUMBNAIL_QUALITY = 80
+THUMBNAIL_PREFIX = "thumbnails/"
+
+def thumbnail_key(image_uuid, width):
+    return f"{THUMBNAIL_PREFIX}{image_uuid}_{width}.jpg"
+
+def image_uuid_from_url(image_url):
+    """
+    uuid of an uploaded item image from its URL, None for any other URL
+    """
+    if not image_url or not image_url.startswith(IMAGE_BASE_URL) or not image_url.endswith(".jpg"):
+        return None
+
+    image_uuid = image_url[len(IMAGE_BASE_URL):-len(".jpg")]
+    return None if "/" in image_uuid else image_uuid
+
+def thumbnail_url(image_url, thumbnailed, width=DEFAULT_THUMBNAIL_WIDTH):
+    """
+    URL of the thumbnail of an uploaded item image whose thumbnails are stored
+    (thumbnailed is the set from read_thumbnailed); any other URL (images not
+    rendered yet, the placeholder image, external links) is returned unchanged
+    """
+    image_uuid = image_uuid_from_url(image_url)
+    if image_uuid is None or image_url not in thumbnailed:
+        return image_url
+    return IMAGE_BASE_URL + thumbnail_key(image_uuid, width)
+
+def read_thumbnailed(cur, image_urls):
+    """
+    The image_urls whose thumbnails are stored, from one read of image_thumbnails
+    """
+    image_urls = list({image_url for image_url in image_urls if image_uuid_from_url(image_url) is not None})
+    if not image_urls:
+        return set()
+
+    cur.execute(f"SELECT image_url FROM image_thumbnails WHERE image_url IN ({', '.join(['%s'] * len(image_urls))})", image_urls)
+    return {row[0] for row in cur.fetchall()}
+
+def record_thumbnails(cur, image_uuids):
+    """
+    Mark the images' thumbnails as stored once generate_thumbnails has written
+    them; until then thumbnail_url hands out the original
+    """
+    cur.executemany("INSERT IGNORE INTO image_thumbnails (image_url) VALUES (%s)",
+                    [(IMAGE_BASE_URL + image_key(image_uuid),) for image_uuid in image_uuids])
+
+def render_thumbnails(data, widths=THUMBNAIL_WIDTHS):
+    """
+    JPEG bytes of the image scaled down to each width -> {width: bytes}.
+    Runs in a worker process, so it only takes and returns plain bytes.
+    """
+    image = Image.open(io.BytesIO(data))
+    # Let the JPEG decoder downscale by up to 8x while decoding, which is far
+    # cheaper than decoding the full capture and resizing it afterwards
+    image.draft("RGB", (max(widths), max(widths)))
+    image = ImageOps.exif_transpose(image).convert("RGB")
+
+    variants = {}
+    # Largest first, so each smaller variant is resized from the previous one
+    for width in sorted(widths, reverse=True):
+        if image.width > width:
+            image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+        out = io.BytesIO()
+        image.save(out, "JPEG", quality=THUMBNAIL_QUALITY, optimize=True, progressive=True)
+        variants[width] = out.getvalue()
+    return variants
+
+def render_or_skip(data):
+    # One unreadable capture must not fail the rest of the batch
+    try:
+        return render_thumbnails(data)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not render thumbnails: {e}")
+        return None
+
+_pool = None
+_pool_unavailable = False
+
+def get_pool():
+    """
+    Process pool shared by the container, or None where processes cannot be
+    started (Lambda has no /dev/shm for multiprocessing's semaphores)
+    """
+    global _pool, _pool_unavailable
+    if _pool is None and not _pool_unavailable:
+        try:
+            _pool = concurrent.futures.ProcessPoolExecutor(max_workers=int(os.environ.get('THUMBNAIL_WORKERS', os.cpu_count() or 1)))
+        except (OSError, NotImplementedError) as e:
+            logger.info(f"Rendering thumbnails inline, no process pool: {e}")
+            _pool_unavailable = True
+    return _pool
+
+def generate_thumbnails(store, image_uuids, originals=None):
+    """
+    Render and store the thumbnails of each image in image_uuids. originals may
+    map uuid -> bytes for images already in memory; the rest are read from the
+    store. Returns uuid -> list of thumbnail keys written.
+    """
+    if Image is None:
+        logger.info("Pillow is not installed, skipping thumbnails")
+        return {}
+
+    originals = originals or {}
+    datas = [originals.get(image_uuid) or store.get(image_key(image_uuid)) for image_uuid in image_uuids]
+
+    pool = get_pool()
+    if pool is not None and len(datas) > 1:
+        try:
+            rendered = list(pool.map(render_or_skip, datas))
+        except concurrent.futures.BrokenExecutor:
+            logger.info("Thumbnail process pool broke, rendering inline")
+            rendered = [render_or_skip(data) for data in datas]
+    else:
+        # A single image is not worth the round trip through a worker
+        rendered = [render_or_skip(data) for data in datas]
+
+    written = {}
+    for image_uuid, variants in zip(image_uuids, rendered):
+        if variants is None:
+            continue
+        written[image_uuid] = []
+        for width, thumbnail in variants.items():
+            key = thumbnail_key(image_uuid, width)
+            store.put(key, thumbnail, IMAGE_CONTENT_TYPE)
+            written[image_uuid].append(key)
+    return written
+
+def get_db():
+    global _db
+    if _db is None and os.environ.get('RDS_PROXY_HOST'):
+        from db import ConnectionManager
+        _db = ConnectionManager(host=os.environ['RDS_PROXY_HOST'], user=os.environ['USER_NAME'],
+                                password=os.environ['PASSWORD'], db=os.environ['DB_NAME'], connect_timeout=5)
+    return _db
+
+def lambda_handler(event, context):
+    """
+    S3 ObjectCreated trigger for the image bucket, so images uploaded directly
+    through presigned URLs get thumbnails too. Thumbnail writes land under
+    THUMBNAIL_PREFIX and are ignored here, as are images image_upload already
+    rendered. The thumbnails written are recorded in image_thumbnails; images
+    this misses are picked up by the setup API's backfill_thumbnails.
+    """
+    store = get_object_store()
+
+    image_uuids = []
+    for record in event.get("Records", []):
+        key = urllib.parse.unquote_plus(record["s3"]["object"]["key"])
+        if key.startswith(THUMBNAIL_PREFIX) or not key.endswith(".jpg") or "/" in key:
+            continue
+        image_uuid = key[:-len(".jpg")]
+        if not store.exists(thumbnail_key(image_uuid, DEFAULT_THUMBNAIL_WIDTH)):
+            image_uuids.append(image_uuid)
+
+    written = generate_thumbnails(store, image_uuids)
+    logger.info(f"Generated thumbnails for {len(written)} image(s)")
+
+    db = get_db()
+    if written and db is not None:
+        conn = db.connection()
+        with conn.cursor() as cur:
+            record_thumbnails(cur, list(written))
+        conn.commit()
+    return {"statusCode": 200, "body": {"thumbnails": written}}
@@ -1,10 +1,49 @@
 # hardware.py
 
+import os
 import uuid
+import sqlite3
 import datetime
+import collections
+import backend_path  # noqa: F401  (makes final_backend_code importable)
+from inventory import record_changes
+from barcode_names import lookup_barcode_names
+from catalog import lookup_product
+from object_store import LocalObjectStore, image_key, IMAGE_CONTENT_TYPE
+
+# Local stand-in for the image bucket; main.py serves presigned PUTs at /objects
+store = LocalObjectStore(os.environ.get('LOCAL_OBJECT_STORE_DIR', 'objects'),
+                         base_url=os.environ.get('LOCAL_OBJECT_STORE_URL', 'http://127.0.0.1:5000/objects'),
+                         secret=os.environ.get('LOCAL_OBJECT_STORE_SECRET'))
+
+UPLOAD_URL_EXPIRES = int(os.environ.get('UPLOAD_URL_EXPIRES', 300))
+MAX_UPLOAD_URLS = 20
+
+def parse_item(item):
+    """
+    Validate one entry of the "items" array and return (barcode, image_url, expiration_date).
+    Raises ValueError with a message that is reported back for that item.
+    """
+    if not isinstance(item, dict):
+        raise ValueError("Item must be an object")
+
+    expiration_date_str = item.get('expiration_date')
+    if not expiration_date_str:
+        raise ValueError("Missing expiration_date")
+
+    # Convert expiration_date string to a datetime object
+    try:
+        expiration_date = datetime.datetime.strptime(expiration_date_str, "%m/%d/%Y").date()
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid expiration_date {expiration_date_str!r}, expected MM/DD/YYYY")
+
+    return item.get('barcode'), item.get('image_url'), expiration_date
 
 def add_data(data, db_conn, db_cursor):
     """
+    All items are validated up front and the valid ones are written in a single
+    transaction; "results" reports the outcome of each item by its index. Items
+    named from the product catalog report that "name" and the product's "category".
     {
         "fridge_id": "fridge1",
         "items": [
@@ -24,57 +63,184 @@ def add_data(data, db_conn, db_cursor):
     fridge_id = data.get('fridge_id')
     items = data.get('items', [])
 
-    # Fetch barcode-name pairs from the saved_map table and store them in a dictionary
-    barcode_name_map = {}
-    db_cursor.execute("SELECT barcode, name FROM saved_map WHERE fridge_id = ?", (fridge_id,))
-    rows = db_cursor.fetchall()
-    for row in rows:
-        barcode_name_map[row[0]] = row[1]
-
-    for item in items:
-        barcode = item.get('barcode')
-        image_url = item.get('image_url')
-        expiration_date_str = item.get('expiration_date')
-
-        # Generate UUID for the item
-        item_uuid = str(uuid.uuid4())
-
-        # Convert expiration_date string to a datetime object
-        expiration_date = datetime.datetime.strptime(expiration_date_str, "%m/%d/%Y").date()
-
-        # Check if the barcode has a name in the barcode_name_map dictionary
-        name = barcode_name_map.get(barcode)
-
-        # Add the item to the item_info table
-        db_cursor.execute("INSERT INTO item_info (uuid, fridge_id, expiration_date, barcode, image_url, name) VALUES (?, ?, ?, ?, ?, ?)",
-                          (item_uuid, fridge_id, expiration_date, barcode, image_url, name))
-        db_conn.commit()
-
-    return {"success": True, "message": "Items added successfully"}
-
+    if not fridge_id:
+        return {"success": False, "message": "Missing fridge_id"}
+
+    # Validate the whole batch before touching the database
+    results = [None] * len(items)
+    parsed = []
+    for index, item in enumerate(items):
+        try:
+            parsed.append((index, parse_item(item)))
+        except ValueError as e:
+            results[index] = {"index": index, "success": False, "message": str(e)}
+
+    if parsed:
+        # barcode -> name pairs of the fridge, from the process cache when warm
+        barcode_name_map = lookup_barcode_names(db_cursor, fridge_id, param="?")
+
+        rows = []
+        for index, (barcode, image_url, expiration_date) in parsed:
+            # Generate UUID for the item
+            item_uuid = str(uuid.uuid4())
+
+            results[index] = {"index": index, "success": True, "uuid": item_uuid}
+
+            # Check if the barcode has a name in the barcode_name_map dictionary
+            name = barcode_name_map.get(barcode)
+            if name is None and barcode:
+                # Fall back to the global product catalog; the fridge's own labels win
+                product = lookup_product(barcode)
+                if product is not None:
+                    name, category = product
+                    results[index].update(name=name, category=category)
+
+            rows.append((item_uuid, fridge_id, expiration_date, barcode, image_url, name))
+
+        # Insert the whole basket in one transaction with a single commit
+        try:
+            db_cursor.executemany("INSERT INTO item_info (uuid, fridge_id, expiration_date, barcode, image_url, name) VALUES (?, ?, ?, ?, ?, ?)", rows)
+            record_changes(db_cursor, fridge_id, upserted=[row[0] for row in rows], param="?")
+            db_conn.commit()
+        except sqlite3.Error:
+            db_conn.rollback()
+            for index, _ in parsed:
+                results[index] = {"index": index, "success": False, "message": "Failed to insert item"}
+            return {"success": False, "message": "Failed to add items", "results": results}
+
+    added = len(parsed)
+    if added < len(items):
+        return {"success": False, "message": f"Added {added} of {len(items)} items", "results": results}
+
+    return {"success": True, "message": "Items added successfully", "results": results}
+
+
+def consume_items(db_cursor, fridge_id, barcode_counts):
+    """
+    Delete the earliest-expiring units of each barcode.
+    barcode_counts maps barcode -> number of units that left the fridge; returns
+    barcode -> list of deleted uuids (shorter than requested if the fridge ran out).
+    Each barcode is one atomic DELETE ... RETURNING served by idx_item_fridge_barcode_exp.
+    """
+    consumed = {}
+    for barcode, count in barcode_counts.items():
+        db_cursor.execute("""
+            DELETE FROM item_info
+            WHERE uuid IN (
+                SELECT uuid FROM item_info
+                WHERE fridge_id = ? AND barcode = ?
+                ORDER BY expiration_date, uuid
+                LIMIT ?
+            )
+            RETURNING uuid
+        """, (fridge_id, barcode, count))
+        consumed[barcode] = [row[0] for row in db_cursor.fetchall()]
+
+    return consumed
 
 def delete_data(data, db_conn, db_cursor):
     """
+    Consumes the earliest-expiring unit of the barcode. Send "barcodes" instead of
+    "barcode" to consume several items that left the fridge in one door cycle;
+    repeat a barcode once per unit.
     {
         "fridge_id": "fridge1",
         "barcode": "1234567890"
     }
+    {
+        "fridge_id": "fridge1",
+        "barcodes": ["1234567890", "1234567890", "0987654321"]
+    }
     """
     fridge_id = data.get('fridge_id')
     barcode = data.get('barcode')
+    barcodes = data.get('barcodes')
 
-    # Check if there's an item with the specified fridge_id and barcode
-    db_cursor.execute("SELECT uuid, MIN(expiration_date) FROM item_info WHERE fridge_id = ? AND barcode = ?", (fridge_id, barcode))
-    row = db_cursor.fetchone()
+    # A null "barcodes" counts as left out
+    batch = barcodes is not None
+    if not batch:
+        barcodes = [barcode] if barcode is not None else []
 
-    if row is None:
-        return {"success": False, "message": "No item found with the specified fridge_id and barcode"}
+    if not fridge_id or not barcodes:
+        return {"success": False, "message": "Missing fridge_id or barcode"}
 
-    item_uuid, latest_expiration_date = row
+    if not isinstance(barcodes, list) or not all(isinstance(code, str) for code in barcodes):
+        return {"success": False, "message": "barcode must be a string and barcodes a list of strings"}
 
-    # Delete the row with the latest expiration date
-    db_cursor.execute("DELETE FROM item_info WHERE uuid = ?", (item_uuid,))
+    # Counter keeps first-seen order, so results come back in request order
+    barcode_counts = collections.Counter(barcodes)
+
+    consumed = consume_items(db_cursor, fridge_id, barcode_counts)
+
+    deleted = [item_uuid for item_uuids in consumed.values() for item_uuid in item_uuids]
+    if deleted:
+        record_changes(db_cursor, fridge_id, deleted=deleted, param="?")
     db_conn.commit()
 
-    return {"success": True, "message": f"Item with barcode {barcode} deleted successfully"}
+    if not batch:
+        if not consumed[barcode]:
+            return {"success": False, "message": "No item found with the specified fridge_id and barcode"}
+
+        return {"success": True, "message": f"Item with barcode {barcode} deleted successfully"}
+
+    results = [{"barcode": code, "requested": count, "consumed": len(consumed[code]), "uuids": consumed[code]}
+               for code, count in barcode_counts.items()]
+    missing = sum(count - len(consumed[code]) for code, count in barcode_counts.items())
+
+    if missing:
+        return {"success": False, "message": f"{missing} item(s) not found in fridge {fridge_id}", "results": results}
+
+    return {"success": True, "message": "Items deleted successfully", "results": results}
+
+def request_upload(data, db_conn, db_cursor):
+    """
+    Presigned PUT URLs for direct image uploads; see hw_lambda.request_upload
+    {
+        "fridge_id": "fridge1",
+        "count": 2
+    }
+    """
+    count = data.get('count', 1)
+    if not isinstance(count, int) or not 1 <= count <= MAX_UPLOAD_URLS:
+        return {"success": False, "message": f"count must be between 1 and {MAX_UPLOAD_URLS}"}
+
+    uploads = []
+    for _ in range(count):
+        image_uuid = str(uuid.uuid4())
+        uploads.append({
+            "file_name": image_uuid,
+            "upload_url": store.presign_put(image_key(image_uuid), IMAGE_CONTENT_TYPE, UPLOAD_URL_EXPIRES),
+            "headers": {"Content-Type": IMAGE_CONTENT_TYPE},
+        })
+
+    return {"success": True, "expires_in": UPLOAD_URL_EXPIRES, "uploads": uploads}
+
+def link_image(data, db_conn, db_cursor):
+    """
+    Completion hook for a presigned upload: point the item at the uploaded image
+    {
+        "fridge_id": "fridge1",
+        "uuid": "<item uuid>",
+        "file_name": "<file_name from request_upload>"
+    }
+    """
+    fridge_id = data.get('fridge_id')
+    item_uuid = data.get('uuid')
+    file_name = data.get('file_name')
+
+    try:
+        uploaded = store.exists(image_key(file_name))
+    except ValueError:
+        uploaded = False
+    if not uploaded:
+        return {"success": False, "message": f"Image {file_name} has not been uploaded"}
+
+    db_cursor.execute("UPDATE item_info SET image_url = ? WHERE uuid = ? AND fridge_id = ?", (file_name, item_uuid, fridge_id))
+    if db_cursor.rowcount == 0:
+        db_conn.rollback()
+        return {"success": False, "message": "No item found with the specified fridge_id and uuid"}
+
+    record_changes(db_cursor, fridge_id, upserted=[item_uuid], param="?")
+    db_conn.commit()
 
+    return {"success": True, "message": f"Item {item_uuid} linked to image {file_name}"}
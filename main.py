@@ -1,156 +1,119 @@
 # main.py
+import os
 import sqlite3
 from flask import Flask, request, jsonify, g
-from software import get_user_mapping, add_user_mapping, get_data, update_unlabeled_data, update_labeled_data, add_data as add_software_data, delete_data as delete_software_data
-from hardware import add_data as add_hardware_data, delete_data as delete_hardware_data
+
+# Pure-python helpers (caches, migrations, routing, etc.) are shared with the lambdas in final_backend_code
+import backend_path  # noqa: F401
+from barcode_names import barcode_name_cache
+from software import fridge_cache, get_user_mapping, add_user_mapping, get_data, get_changes, get_expiring, search_items, update_unlabeled_data, update_labeled_data, add_data as add_software_data, delete_data as delete_software_data
+from hardware import store as object_store, request_upload, link_image, add_data as add_hardware_data, delete_data as delete_hardware_data
+from migrations import run_migrations
+from sqlite_pool import SQLitePool
+from router import Router
 
 app = Flask(__name__)
 
 DATABASE = 'my_database.db'
 
-# Connect to the database
+# Create or upgrade the schema
 conn = sqlite3.connect(DATABASE)
-cursor = conn.cursor()
-
-# Create tables if they don't exist
-cursor.execute('''CREATE TABLE IF NOT EXISTS item_info (
-                    uuid TEXT PRIMARY KEY,
-                    fridge_id INTEGER NOT NULL,
-                    expiration_date DATE NOT NULL,
-                    barcode TEXT,
-                    image_url TEXT,
-                    name TEXT
-                )''')
-
-cursor.execute('''CREATE TABLE IF NOT EXISTS user_map (
-                    user_id TEXT PRIMARY KEY,
-                    fridge_id INTEGER NOT NULL
-                )''')
-
-cursor.execute('''CREATE TABLE IF NOT EXISTS saved_map (
-                    barcode TEXT PRIMARY KEY,
-                    name TEXT NOT NULL,
-                    fridge_id INTEGER NOT NULL
-                )''')
-
-conn.commit()
-
+run_migrations(conn, "sqlite")
 conn.close()
 
+# Connections are pooled across requests instead of opened per request
+db_pool = SQLitePool(DATABASE, size=int(os.environ.get('DB_POOL_SIZE', 8)))
+
 # Function to get database connection
 def get_db():
     db = getattr(g, '_database', None)
     if db is None:
-        db = g._database = sqlite3.connect(DATABASE)
+        db = g._database = db_pool.acquire()
     return db
 
-# Function to close database connection
+# Function to return the database connection to the pool
 @app.teardown_appcontext
 def close_connection(exception):
-    db = getattr(g, '_database', None)
+    db = g.pop('_database', None)
     if db is not None:
-        db.close()
-
-@app.route('/software/get_user_mapping', methods=['POST'])
-def software_get_user_mapping():
-    data = request.json
-
-    # Get database cursor
-    db_conn = get_db()
-    db_cursor = db_conn.cursor()
-    result = get_user_mapping(data, db_conn, db_cursor)
-    return jsonify(result)
-
-@app.route('/software/add_user_mapping', methods=['POST'])
-def software_add_user_mapping():
-    data = request.json
-
-    # Get database cursor
-    db_conn = get_db()
-    db_cursor = db_conn.cursor()
-    result = add_user_mapping(data, db_conn, db_cursor)
-    return jsonify(result)
-
-@app.route('/software/get_data', methods=['POST'])
-def software_get_data():
-    data = request.json
-
-    # Get database cursor
-    db_conn = get_db()
-    db_cursor = db_conn.cursor()
-    result = get_data(data, db_conn, db_cursor)
-    return jsonify(result)
-
-@app.route('/software/update_unlabeled_data', methods=['POST'])
-def software_update_unlabeled_data():
-    data = request.json
-
-    # Get database cursor
-    db_conn = get_db()
-    db_cursor = db_conn.cursor()
-    result = update_unlabeled_data(data, db_conn, db_cursor)
-    return jsonify(result)
-
-@app.route('/software/update_labeled_data', methods=['POST'])
-def software_update_labeled_data():
-    data = request.json
-
-    # Get database cursor
-    db_conn = get_db()
-    db_cursor = db_conn.cursor()
-    result = update_labeled_data(data, db_conn, db_cursor)
-    return jsonify(result)
-
-@app.route('/software/add_data', methods=['POST'])
-def software_add_data():
-    data = request.json
-
-    # Get database cursor
-    db_conn = get_db()
-    db_cursor = db_conn.cursor()
-    result = add_software_data(data, db_conn, db_cursor)
-    return jsonify(result)
-
-@app.route('/software/delete_data', methods=['POST'])
-def software_delete_data():
-    data = request.json
-
-    # Get database cursor
-    db_conn = get_db()
-    db_cursor = db_conn.cursor()
-    result = delete_software_data(data, db_conn, db_cursor)
-    return jsonify(result)
-
-
-@app.route('/hardware/add_data', methods=['POST'])
-def hardware_add_data():
-    data = request.json
-
-    # Get database cursor
-    db_conn = get_db()
-    db_cursor = db_conn.cursor()
-    result = add_hardware_data(data, db_conn, db_cursor)
-    return jsonify(result)
-
-@app.route('/hardware/delete_data', methods=['POST'])
-def hardware_delete_data():
-    data = request.json
-
-    # Get database cursor
-    db_conn = get_db()
-    db_cursor = db_conn.cursor()
-    result = delete_hardware_data(data, db_conn, db_cursor)
-    return jsonify(result)
+        db_pool.release(db)
+
+# Same table-driven dispatch as the lambdas: one router per API, routes declare
+# their body schema and share the timing middleware
+software_router = Router()
+hardware_router = Router()
+
+def register(router, path, handler, schema):
+    @router.route(path, schema=schema)
+    def route(data):
+        # Get database cursor
+        db_conn = get_db()
+        db_cursor = db_conn.cursor()
+        return handler(data, db_conn, db_cursor), 200
+
+for path, handler, schema in [
+    ("get_user_mapping", get_user_mapping, {"user_id": str}),
+    ("add_user_mapping", add_user_mapping, {"user_id": str, "fridge_id": str}),
+    ("get_data", get_data, {"user_id": str}),
+    ("get_changes", get_changes, {"user_id": str}),
+    ("get_expiring", get_expiring, {"user_id": str}),
+    ("search_items", search_items, {"user_id": str, "query": str}),
+    ("update_unlabeled_data", update_unlabeled_data, {"user_id": str, "item": dict}),
+    ("update_labeled_data", update_labeled_data, {"user_id": str, "item": dict}),
+    ("add_data", add_software_data, {"user_id": str, "item": dict}),
+    ("delete_data", delete_software_data, {"user_id": str, "item": dict}),
+]:
+    register(software_router, path, handler, schema)
+
+for path, handler, schema in [
+    ("add_data", add_hardware_data, {"fridge_id": str, "items": list}),
+    ("delete_data", delete_hardware_data, {"fridge_id": str}),
+    ("request_upload", request_upload, {"fridge_id": str}),
+    ("link_image", link_image, {"fridge_id": str, "uuid": str, "file_name": str}),
+]:
+    register(hardware_router, path, handler, schema)
+
+@software_router.route("get_cache_stats", body=False)
+def get_cache_stats():
+    return {"success": True, "fridge_cache": fridge_cache.stats(), "routes": {"software": software_router.timings, "hardware": hardware_router.timings}}, 200
+
+def dispatch(router, path):
+    result = router.dispatch({"path": path, "body": request.get_data(as_text=True)})
+    return jsonify(result[0]), result[1]
+
+@app.route('/software/<path>', methods=['POST'])
+def software_api(path):
+    return dispatch(software_router, path)
+
+@app.route('/hardware/<path>', methods=['POST'])
+def hardware_api(path):
+    return dispatch(hardware_router, path)
+
+@app.route('/objects/<path:key>', methods=['PUT'])
+def put_object(key):
+    # Target of the presigned URLs handed out by /hardware/request_upload
+    content_type = request.headers.get('Content-Type')
+    if not object_store.verify_presigned(key, content_type, request.args.get('expires'), request.args.get('signature')):
+        return jsonify({"message": "Invalid or expired signature"}), 403
+    object_store.put(key, request.stream, content_type)
+    return '', 200
 
 @app.route('/clear_tables', methods=['POST'])
 def clear_tables():
     # Get database cursor
     db_conn = get_db()
     db_cursor = db_conn.cursor()
+    # Tombstone every item so clients syncing through get_changes drop them too
+    db_cursor.execute("INSERT INTO item_changes (fridge_id, uuid, deleted) SELECT fridge_id, uuid, TRUE FROM item_info")
     db_cursor.execute("DELETE FROM item_info")
     db_cursor.execute("DELETE FROM user_map")
     db_cursor.execute("DELETE FROM saved_map")
+    db_cursor.execute("DELETE FROM label_sketch")
+    # Phones holding an old ETag refetch the emptied inventory
+    db_cursor.execute("UPDATE fridge_version SET version = version + 1, labels_version = labels_version + 1")
     db_conn.commit()
+    fridge_cache.clear()
+    barcode_name_cache.clear()
     return jsonify({"message": "Tables cleared successfully"})
 
 if __name__ == '__main__':
@@ -26,8 +26,37 @@ except pymysql.MySQLError as e:
 
 logger.info("SUCCESS: Connection to RDS for MySQL instance succeeded")
 
+BASE_IMAGE_URL = "https://fridgemate-images.s3.us-east-2.amazonaws.com/{}.jpg"
+
+def parse_item(item):
+    """
+    Validate one entry of the "items" array and return (barcode, image_url, expiration_date).
+    Raises ValueError with a message that is reported back for that item.
+    """
+    if not isinstance(item, dict):
+        raise ValueError("Item must be an object")
+
+    barcode = item.get('barcode')
+    image_name = item.get('image_url')
+    expiration_date_str = item.get('expiration_date')
+
+    if not expiration_date_str:
+        raise ValueError("Missing expiration_date")
+
+    # Convert expiration_date string to a datetime object
+    try:
+        expiration_date = datetime.datetime.strptime(expiration_date_str, "%m/%d/%Y").date()
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid expiration_date {expiration_date_str!r}, expected MM/DD/YYYY")
+
+    image_url = BASE_IMAGE_URL.format(image_name)
+
+    return barcode, image_url, expiration_date
+
 def add_data(data):
     """
+    All items are validated up front and the valid ones are written in a single
+    transaction; "results" reports the outcome of each item by its index.
     {
         "fridge_id": "fridge1",
         "items": [
@@ -44,42 +73,58 @@ def add_data(data):
         ]
     }
     """
-    
-    base_image_url = "https://fridgemate-images.s3.us-east-2.amazonaws.com/{}.jpg"
-    
     fridge_id = data.get('fridge_id')
     items = data.get('items', [])
 
-    with conn.cursor() as cur:
-        # Fetch barcode-name pairs from the saved_map table and store them in a dictionary
-        barcode_name_map = {}
-        cur.execute("SELECT barcode, name FROM saved_map WHERE fridge_id = %s", (fridge_id,))
-        rows = cur.fetchall()
-        for row in rows:
-            barcode_name_map[row[0]] = row[1]
-    
-        for item in items:
-            barcode = item.get('barcode')
-            image_name = item.get('image_url')
-            image_url = base_image_url.format(image_name)
-            expiration_date_str = item.get('expiration_date')
-    
-            # Generate UUID for the item
-            item_uuid = str(uuid.uuid4())
-    
-            # Convert expiration_date string to a datetime object
-            expiration_date = datetime.datetime.strptime(expiration_date_str, "%m/%d/%Y").date()
-    
-            # Check if the barcode has a name in the barcode_name_map dictionary
-            name = barcode_name_map.get(barcode)
-    
-            # Add the item to the item_info table
-            cur.execute("INSERT INTO item_info (uuid, fridge_id, expiration_date, barcode, image_url, name) VALUES (%s, %s, %s, %s, %s, %s)",
-                              (item_uuid, fridge_id, expiration_date, barcode, image_url, name))
-            
-            conn.commit()
+    if not fridge_id:
+        return {"success": False, "message": "Missing fridge_id"}, 200
+
+    # Validate the whole batch before touching the database
+    results = [None] * len(items)
+    parsed = []
+    for index, item in enumerate(items):
+        try:
+            parsed.append((index, parse_item(item)))
+        except ValueError as e:
+            results[index] = {"index": index, "success": False, "message": str(e)}
+
+    if parsed:
+        with conn.cursor() as cur:
+            # Fetch barcode-name pairs from the saved_map table and store them in a dictionary
+            barcode_name_map = {}
+            cur.execute("SELECT barcode, name FROM saved_map WHERE fridge_id = %s", (fridge_id,))
+            rows = cur.fetchall()
+            for row in rows:
+                barcode_name_map[row[0]] = row[1]
+
+            rows = []
+            for index, (barcode, image_url, expiration_date) in parsed:
+                # Generate UUID for the item
+                item_uuid = str(uuid.uuid4())
+
+                # Check if the barcode has a name in the barcode_name_map dictionary
+                name = barcode_name_map.get(barcode)
+
+                rows.append((item_uuid, fridge_id, expiration_date, barcode, image_url, name))
+                results[index] = {"index": index, "success": True, "uuid": item_uuid}
+
+            # pymysql rewrites executemany of a plain INSERT ... VALUES into multi-row
+            # INSERT statements, so the whole basket costs one round trip and one commit
+            try:
+                cur.executemany("INSERT INTO item_info (uuid, fridge_id, expiration_date, barcode, image_url, name) VALUES (%s, %s, %s, %s, %s, %s)", rows)
+                conn.commit()
+            except pymysql.MySQLError as e:
+                conn.rollback()
+                logger.error(e)
+                for index, _ in parsed:
+                    results[index] = {"index": index, "success": False, "message": "Failed to insert item"}
+                return {"success": False, "message": "Failed to add items", "results": results}, 200
+
+    added = len(parsed)
+    if added < len(items):
+        return {"success": False, "message": f"Added {added} of {len(items)} items", "results": results}, 200
 
-    return {"success": True, "message": "Items added successfully"}, 200
+    return {"success": True, "message": "Items added successfully", "results": results}, 200
 
 
 def delete_data(data):
@@ -1,6 +1,35 @@
 # software.py
+import os
 import uuid
 import datetime
+import functools
+import backend_path  # noqa: F401  (makes final_backend_code importable)
+from ttl_cache import TTLCache
+from inventory import bump_labels_version, get_cursor, get_version, make_etag, read_changes, record_changes
+from label_suggestions import add_suggestions, count_label
+from item_search import SEARCH_LIMIT, MAX_SEARCH_LIMIT, MAX_RANKED_MATCHES, fts5_query, search_terms
+
+# user_id -> fridge_id mappings are kept for the lifetime of the server process
+fridge_cache = TTLCache(maxsize=int(os.environ.get('FRIDGE_CACHE_SIZE', 1024)),
+                        ttl=float(os.environ.get('FRIDGE_CACHE_TTL', 300)))
+
+def lookup_fridge_id(db_cursor, user_id):
+    """
+    Return the fridge_id mapped to user_id, or None if the user has no fridge.
+    Only existing mappings are cached since a missing one can be added at any time.
+    """
+    fridge_id = fridge_cache.get(user_id)
+    if fridge_id is None:
+        db_cursor.execute("SELECT fridge_id FROM user_map WHERE user_id = ?", (user_id,))
+        fridge_id_row = db_cursor.fetchone()
+
+        if fridge_id_row is None:
+            return None
+
+        fridge_id = fridge_id_row[0]
+        fridge_cache.set(user_id, fridge_id)
+
+    return fridge_id
 
 def get_user_mapping(data, db_conn, db_cursor):
     """
@@ -11,15 +40,12 @@ def get_user_mapping(data, db_conn, db_cursor):
     # Extract user_id from the request
     user_id = data.get('user_id')
 
-    # Check if user_id exists in user_map table
-    db_cursor.execute("SELECT fridge_id FROM user_map WHERE user_id = ?", (user_id,))
-    fridge_id_row = db_cursor.fetchone()
+    # Resolve the user's fridge, served from the process cache when warm
+    fridge_id = lookup_fridge_id(db_cursor, user_id)
 
-    if fridge_id_row is None:
+    if fridge_id is None:
         return {"success": False, "message": "User does not have a fridge associated"}
 
-    fridge_id = fridge_id_row[0]
-
     return {"success": True, "user_id": user_id, "fridge_id": fridge_id}
 
 def add_user_mapping(data, db_conn, db_cursor):
@@ -44,35 +70,206 @@ def add_user_mapping(data, db_conn, db_cursor):
     db_cursor.execute("INSERT INTO user_map (user_id, fridge_id) VALUES (?, ?)", (user_id, fridge_id))
     db_conn.commit()
 
+    fridge_cache.invalidate(user_id)
+
     return {"success": True, "user_id": user_id, "fridge_id": fridge_id}
 
+@functools.lru_cache(maxsize=4096)
+def format_date(value):
+    """
+    "YYYY-MM-DD" as stored by SQLite -> "MM/DD/YYYY". A fridge holds few distinct
+    dates, so the cache turns most rows into a dictionary hit.
+    """
+    return f"{value[5:7]}/{value[8:10]}/{value[:4]}"
+
+def serialize_items(rows):
+    """
+    Split (uuid, expiration_date, name, barcode, image_url) rows into the
+    labeled and unlabeled item lists returned by get_data. The local server
+    renders no thumbnails, so "image_url" and "full_image_url" are both the original.
+    """
+    labeled_items, unlabeled_items = [], []
+    for item_uuid, expiration_date, name, barcode, image_url in rows:
+        if name is not None:
+            labeled_items.append({"uuid": item_uuid, "expiration_date": format_date(expiration_date), "name": name})
+        else:
+            unlabeled_items.append({"uuid": item_uuid, "expiration_date": format_date(expiration_date), "barcode": barcode,
+                                    "image_url": image_url, "full_image_url": image_url})
+
+    return labeled_items, unlabeled_items
+
 def get_data(data, db_conn, db_cursor):
     """
+    Pass the "etag" of a previous response to get {"not_modified": true} back without
+    the item lists when the fridge's inventory has not changed since.
+    Unlabeled items carry "suggestions", the names other fridges most often gave their barcode.
     {
-        "user_id": "user1"
+        "user_id": "user1",
+        "etag": "\"fridge1:42\""
     }
     """
     # Extract user_id from the request
     user_id = data.get('user_id')
 
-    # Check if user_id exists in user_map table
-    db_cursor.execute("SELECT fridge_id FROM user_map WHERE user_id = ?", (user_id,))
-    fridge_id_row = db_cursor.fetchone()
+    # Resolve the user's fridge, served from the process cache when warm
+    fridge_id = lookup_fridge_id(db_cursor, user_id)
+
+    if fridge_id is None:
+        return {"success": False, "message": "User does not have a fridge associated"}
+
+    etag = make_etag(fridge_id, get_version(db_cursor, fridge_id, param="?"))
+
+    if data.get('etag') == etag:
+        return {"success": True, "not_modified": True, "etag": etag}
+
+    # Starting point for get_changes
+    cursor = get_cursor(db_cursor, fridge_id, param="?")
+
+    # Fetch every item of the fridge in one pass and split it in Python
+    db_cursor.execute("SELECT uuid, expiration_date, name, barcode, image_url FROM item_info WHERE fridge_id = ?", (fridge_id,))
+    labeled_items, unlabeled_items = serialize_items(db_cursor.fetchall())
+
+    # Names other fridges gave the unlabeled barcodes
+    add_suggestions(db_cursor, unlabeled_items, param="?")
+
+    return {"success": True, "etag": etag, "cursor": cursor, "labeled_items": labeled_items, "unlabeled_items": unlabeled_items}
+
+def get_changes(data, db_conn, db_cursor):
+    """
+    Items inserted, updated or deleted since "cursor" (from get_data or a previous
+    get_changes). Returns the new cursor; keep calling while "has_more" is true.
+    {
+        "user_id": "user1",
+        "cursor": 1234,
+        "limit": 500
+    }
+    """
+    # Extract user_id and the sync position from the request
+    user_id = data.get('user_id')
+    try:
+        cursor = int(data.get('cursor') or 0)
+        limit = min(max(int(data.get('limit') or 500), 1), 1000)
+    except (TypeError, ValueError):
+        return {"success": False, "message": "Invalid cursor or limit"}
+
+    # Resolve the user's fridge, served from the process cache when warm
+    fridge_id = lookup_fridge_id(db_cursor, user_id)
+
+    if fridge_id is None:
+        return {"success": False, "message": "User does not have a fridge associated"}
+
+    cursor, has_more, rows, deleted = read_changes(db_cursor, fridge_id, cursor, limit, param="?")
+    labeled_items, unlabeled_items = serialize_items(rows)
+    add_suggestions(db_cursor, unlabeled_items, param="?")
+
+    return {"success": True, "cursor": cursor, "has_more": has_more, "labeled_items": labeled_items, "unlabeled_items": unlabeled_items, "deleted": deleted}
 
-    if fridge_id_row is None:
+# get_expiring defaults and caps
+EXPIRING_DAYS = 3
+MAX_EXPIRING_DAYS = 365
+EXPIRING_LIMIT = 20
+MAX_EXPIRING_LIMIT = 200
+
+def get_expiring(data, db_conn, db_cursor):
+    """
+    Items expiring within "days" days of "today" (default: the server's date),
+    already expired ones included, soonest first. Served by a range scan on
+    idx_item_fridge_exp. Pass the returned "cursor" back for the next page;
+    it is null on the last one.
+    {
+        "user_id": "user1",
+        "days": 3,
+        "today": "01/01/2024",
+        "limit": 20,
+        "cursor": null
+    }
+    """
+    # Extract user_id from the request
+    user_id = data.get('user_id')
+
+    try:
+        days = min(max(int(data.get('days', EXPIRING_DAYS)), 0), MAX_EXPIRING_DAYS)
+        limit = min(max(int(data.get('limit') or EXPIRING_LIMIT), 1), MAX_EXPIRING_LIMIT)
+        today = datetime.datetime.strptime(data['today'], "%m/%d/%Y").date() if data.get('today') else datetime.date.today()
+        cursor = data.get('cursor')
+        if cursor:
+            # "YYYY-MM-DD|uuid" of the last item of the previous page
+            after_date, after_uuid = cursor.split("|", 1)
+            datetime.date.fromisoformat(after_date)
+    except (TypeError, ValueError, AttributeError):
+        return {"success": False, "message": "Invalid days, limit, today or cursor"}
+
+    # Resolve the user's fridge, served from the process cache when warm
+    fridge_id = lookup_fridge_id(db_cursor, user_id)
+
+    if fridge_id is None:
         return {"success": False, "message": "User does not have a fridge associated"}
 
-    fridge_id = fridge_id_row[0]
+    until = today + datetime.timedelta(days=days)
+    query = "SELECT uuid, expiration_date, name, barcode, image_url FROM item_info WHERE fridge_id = ? AND expiration_date <= ?"
+    params = [fridge_id, until.isoformat()]
+    if cursor:
+        query += " AND (expiration_date > ? OR (expiration_date = ? AND uuid > ?))"
+        params += [after_date, after_date, after_uuid]
+    query += " ORDER BY expiration_date, uuid LIMIT ?"
+    params.append(limit + 1)
+
+    db_cursor.execute(query, params)
+    rows = db_cursor.fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    items = []
+    for item_uuid, expiration_date, name, barcode, image_url in rows:
+        days_left = (datetime.date.fromisoformat(expiration_date) - today).days
+        items.append({"uuid": item_uuid, "expiration_date": format_date(expiration_date), "days_left": days_left,
+                      "name": name, "barcode": barcode, "image_url": image_url})
+
+    next_cursor = f"{rows[-1][1]}|{rows[-1][0]}" if has_more else None
+    return {"success": True, "items": items, "cursor": next_cursor}
+
+def search_items(data, db_conn, db_cursor):
+    """
+    Labeled items with a word starting with each word of "query", closest match
+    first. Served by the item_search FTS5 table.
+    {
+        "user_id": "user1",
+        "query": "chees",
+        "limit": 20
+    }
+    """
+    # Extract user_id from the request
+    user_id = data.get('user_id')
+
+    terms = search_terms(data.get('query'))
+    if not terms:
+        return {"success": False, "message": "Query has no words to search for"}
 
-    # Fetch labeled items
-    db_cursor.execute("SELECT uuid, expiration_date, name FROM item_info WHERE fridge_id = ? AND name IS NOT NULL", (fridge_id,))
-    labeled_items = [{"uuid": row[0], "expiration_date": datetime.datetime.strptime(row[1], "%Y-%m-%d").strftime("%m/%d/%Y"), "name": row[2]} for row in db_cursor.fetchall()]
+    try:
+        limit = min(max(int(data.get('limit') or SEARCH_LIMIT), 1), MAX_SEARCH_LIMIT)
+    except (TypeError, ValueError):
+        return {"success": False, "message": "Invalid limit"}
 
-    # Fetch unlabeled items with barcode
-    db_cursor.execute("SELECT uuid, expiration_date, barcode, image_url FROM item_info WHERE fridge_id = ? AND name IS NULL", (fridge_id,))
-    unlabeled_items = [{"uuid": row[0], "expiration_date": datetime.datetime.strptime(row[1], "%Y-%m-%d").strftime("%m/%d/%Y"), "barcode": row[2], "image_url": row[3]} for row in db_cursor.fetchall()]
+    # Resolve the user's fridge, served from the process cache when warm
+    fridge_id = lookup_fridge_id(db_cursor, user_id)
 
-    return {"success": True, "labeled_items": labeled_items, "unlabeled_items": unlabeled_items}
+    if fridge_id is None:
+        return {"success": False, "message": "User does not have a fridge associated"}
+
+    # The index narrows to the fridge's newest matches; the join re-checks the fridge
+    # exactly and the shortest names, the closest matches, come first
+    db_cursor.execute("""
+        SELECT i.uuid, i.expiration_date, i.name, i.barcode, i.image_url
+        FROM (SELECT rowid FROM item_search WHERE item_search MATCH ? ORDER BY rowid DESC LIMIT ?) s
+        JOIN item_info i ON i.rowid = s.rowid
+        WHERE i.fridge_id = ?
+        ORDER BY length(i.name), i.name, i.uuid
+        LIMIT ?
+    """, (fts5_query(fridge_id, terms), MAX_RANKED_MATCHES, fridge_id, limit))
+    items, _ = serialize_items(db_cursor.fetchall())
+
+    return {"success": True, "items": items}
 
 def update_unlabeled_data(data, db_conn, db_cursor):
     """
@@ -94,15 +291,12 @@ def update_unlabeled_data(data, db_conn, db_cursor):
     name = item.get('name')
     expiration_date_str = item.get('expiration_date')
 
-    # Check if user_id exists in user_map table
-    db_cursor.execute("SELECT fridge_id FROM user_map WHERE user_id = ?", (user_id,))
-    fridge_id_row = db_cursor.fetchone()
+    # Resolve the user's fridge, served from the process cache when warm
+    fridge_id = lookup_fridge_id(db_cursor, user_id)
 
-    if fridge_id_row is None:
+    if fridge_id is None:
         return {"success": False, "message": "User does not have a fridge associated"}
 
-    fridge_id = fridge_id_row[0]
-
     # Check if the item exists and is unlabeled
     db_cursor.execute("SELECT name FROM item_info WHERE uuid = ? AND name IS NULL", (uuid,))
     existing_item = db_cursor.fetchone()
@@ -116,6 +310,7 @@ def update_unlabeled_data(data, db_conn, db_cursor):
     # Update the item in item_info table
     db_cursor.execute("UPDATE item_info SET name = ?, expiration_date = ? WHERE uuid = ?",
                       (name, expiration_date, uuid))
+    record_changes(db_cursor, fridge_id, upserted=[uuid], param="?")
     db_conn.commit()
 
     # Get barcode
@@ -129,6 +324,10 @@ def update_unlabeled_data(data, db_conn, db_cursor):
     if existing_mapping_count == 0:
         # Add an entry in the saved_map table associating the barcode with the name
         db_cursor.execute("INSERT INTO saved_map (fridge_id, barcode, name) VALUES (?, ?, ?)", (fridge_id, barcode, name))
+        # Suggest the name to other fridges that scan this barcode
+        count_label(db_cursor, barcode, name, param="?")
+        # Restocks re-read the fridge's names on their next lookup
+        bump_labels_version(db_cursor, fridge_id, param="?")
         db_conn.commit()
     else:
         return {"success": False, "message": f"Barcode {barcode} already exists in the saved_map table"}
@@ -137,13 +336,21 @@ def update_unlabeled_data(data, db_conn, db_cursor):
 
 def update_labeled_data(data, db_conn, db_cursor):
     """
+    Note: not all labeled items that can be updated need to have a barcode. For example, an items added from the phone may not have a barcode.
     {
         "user_id": "user1",
-        "item": {       
+        "item": {
             "uuid": "1234",
-            "expiration_date": "12/31/2020"
+            "name": "Cheese",
+            "expiration_date": "12/31/2020",
+            "expected_name": "Cheddar"
         }
     }
+    name is optional and keeps the current name when left out; a new name is
+    given to every item of the fridge with the same barcode, so a wrong name
+    from the product catalog can be corrected. expected_name is optional: the
+    name the client last saw. If the item has been renamed since, nothing is
+    written and "conflict": true is returned.
     """
     # Extract user_id and item data from the request
     user_id = data.get('user_id')
@@ -153,26 +360,47 @@ def update_labeled_data(data, db_conn, db_cursor):
     uuid = item.get('uuid')
     expiration_date_str = item.get('expiration_date')
 
-    # Check if user_id exists in user_map table
-    db_cursor.execute("SELECT fridge_id FROM user_map WHERE user_id = ?", (user_id,))
-    fridge_id_row = db_cursor.fetchone()
+    # Resolve the user's fridge, served from the process cache when warm
+    fridge_id = lookup_fridge_id(db_cursor, user_id)
 
-    if fridge_id_row is None:
+    if fridge_id is None:
         return {"success": False, "message": "User does not have a fridge associated"}
 
     # Check if the item exists and is labeled
-    db_cursor.execute("SELECT name FROM item_info WHERE uuid = ? AND name IS NOT NULL", (uuid,))
+    db_cursor.execute("SELECT name, barcode FROM item_info WHERE uuid = ? AND fridge_id = ? AND name IS NOT NULL", (uuid, fridge_id))
     existing_item = db_cursor.fetchone()
 
     if existing_item is None:
         return {"success": False, "message": "Item with specified UUID does not exist or is unlabeled"}
 
+    existing_name, barcode = existing_item
+    name = item.get('name') or existing_name
+    if item.get('expected_name', existing_name) != existing_name:
+        return {"success": False, "conflict": True, "message": "Item was changed by another request"}
+
     # Convert expiration_date string to a datetime object
     expiration_date = datetime.datetime.strptime(expiration_date_str, "%m/%d/%Y").date()
 
-    # Update the expiration_date for the labeled item in item_info table
-    db_cursor.execute("UPDATE item_info SET expiration_date = ? WHERE uuid = ?",
-                      (expiration_date, uuid))
+    # Update the labeled item in item_info table
+    db_cursor.execute("UPDATE item_info SET name = ?, expiration_date = ? WHERE uuid = ?",
+                      (name, expiration_date, uuid))
+
+    if barcode is not None:
+        # Update barcode's value in saved_map; an item named from the product catalog has no entry yet
+        db_cursor.execute("""
+            INSERT INTO saved_map (fridge_id, barcode, name) VALUES (?, ?, ?)
+            ON CONFLICT (fridge_id, barcode) DO UPDATE SET name = excluded.name
+        """, (fridge_id, barcode, name))
+        # Update all items with that barcode to that name for that fridge id in item_info table
+        db_cursor.execute("UPDATE item_info SET name = ? WHERE fridge_id = ? AND barcode = ?", (name, fridge_id, barcode))
+        if name != existing_name:
+            # Suggest the name to other fridges that scan this barcode
+            count_label(db_cursor, barcode, name, param="?")
+
+    record_changes(db_cursor, fridge_id, upserted=[uuid], barcode=barcode, param="?")
+    if barcode is not None:
+        # Restocks re-read the fridge's names on their next lookup
+        bump_labels_version(db_cursor, fridge_id, param="?")
     db_conn.commit()
 
     return {"success": True, "item": {"uuid": uuid, "expiration_date": expiration_date_str}}
@@ -191,15 +419,12 @@ def add_data(data, db_conn, db_cursor):
     user_id = data.get('user_id')
     item = data.get('item')
 
-    # Check if user_id exists in user_map table
-    db_cursor.execute("SELECT fridge_id FROM user_map WHERE user_id = ?", (user_id,))
-    fridge_id_row = db_cursor.fetchone()
+    # Resolve the user's fridge, served from the process cache when warm
+    fridge_id = lookup_fridge_id(db_cursor, user_id)
 
-    if fridge_id_row is None:
+    if fridge_id is None:
         return {"success": False, "message": "User does not have a fridge associated"}
 
-    fridge_id = fridge_id_row[0]
-
     # Generate UUID for the item
     item_uuid = str(uuid.uuid4())
 
@@ -213,6 +438,7 @@ def add_data(data, db_conn, db_cursor):
     # Insert item into item_info table
     db_cursor.execute("INSERT INTO item_info (uuid, fridge_id, name, expiration_date) VALUES (?, ?, ?, ?)",
                       (item_uuid, fridge_id, name, expiration_date))
+    record_changes(db_cursor, fridge_id, upserted=[item_uuid], param="?")
     db_conn.commit()
 
     return {"success": True, "item": {"uuid": item_uuid, "name": name, "expiration_date": expiration_date_str}}
@@ -234,18 +460,19 @@ def delete_data(data, db_conn, db_cursor):
     # Extract item details
     uuid = item.get('uuid')
 
-    # Check if user_id exists in user_map table
-    db_cursor.execute("SELECT fridge_id FROM user_map WHERE user_id = ?", (user_id,))
-    fridge_id_row = db_cursor.fetchone()
+    # Resolve the user's fridge, served from the process cache when warm
+    fridge_id = lookup_fridge_id(db_cursor, user_id)
 
-    if fridge_id_row is None:
+    if fridge_id is None:
         return {"success": False, "message": "User does not have a fridge associated"}
 
-    # Delete the item from item_info table
-    db_cursor.execute("DELETE FROM item_info WHERE uuid = ?", (uuid,))
-    db_conn.commit()
+    # Delete the item from item_info table, only from the user's own fridge
+    db_cursor.execute("DELETE FROM item_info WHERE uuid = ? AND fridge_id = ?", (uuid, fridge_id))
 
     if db_cursor.rowcount == 0:
         return {"success": False, "message": "Item with specified UUID does not exist"}
 
+    record_changes(db_cursor, fridge_id, deleted=[uuid], param="?")
+    db_conn.commit()
+
     return {"success": True, "item": {"uuid": uuid}}
@@ -0,0 +1,77 @@
+# sqlite_pool.py
+import queue
+import sqlite3
+import threading
+
+# Applied to every pooled connection. WAL lets the app read while the hardware
+# writes; NORMAL sync is durable across application crashes in WAL mode.
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -16000,  # negative means KiB, i.e. 16 MB of page cache
+    "temp_store": "MEMORY",
+}
+
+class SQLitePool:
+    """
+    Bounded pool of SQLite connections shared by the Flask request threads.
+    Connections are opened on demand up to size and handed back in release(),
+    so a request re-uses a connection (and its page cache) instead of opening
+    the database file again. Waiting for a lock is left to SQLite's busy timeout.
+    """
+
+    def __init__(self, database, size=8, busy_timeout=5.0, pragmas=None):
+        self.database = database
+        self.size = size
+        self.busy_timeout = busy_timeout
+        self.pragmas = DEFAULT_PRAGMAS if pragmas is None else pragmas
+
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _open(self):
+        conn = sqlite3.connect(self.database, timeout=self.busy_timeout, check_same_thread=False)
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout * 1000)}")
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def acquire(self, timeout=None):
+        """
+        Return an idle connection, opening a new one while the pool is below size.
+        Blocks up to timeout seconds (forever if None) once every connection is in use.
+        """
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                try:
+                    return self._open()
+                except sqlite3.Error:
+                    self._opened -= 1
+                    raise
+
+        return self._idle.get(timeout=timeout)
+
+    def release(self, conn):
+        """
+        Hand a connection back; an unfinished transaction is rolled back first.
+        """
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1